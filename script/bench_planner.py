@@ -0,0 +1,224 @@
+"""
+计划生成压测脚本
+
+direct 模式在进程内直接调用 ai_planner (不入库、不走缓存和计划模板)，api 模式通过 Web 接口提交后台任务并轮询结果。
+先启动本地模拟服务，再按不同日期跨度和并发数压测:
+    python script/mock_llm_server.py --port 8900
+    python script/bench_planner.py --base-url http://127.0.0.1:8900/v1 --ranges 10,30,60 --concurrency 1,4,8
+    python script/bench_planner.py --mode api --api-url http://127.0.0.1:5001/auto_ribao --user admin --password xxx
+
+注意: api 模式下 Web 服务使用自身 config.yaml 中的 ai.base_url，需提前指向模拟服务
+direct 模式默认使用临时数据库 (导入 ai_planner 时会对数据库执行迁移)，不会改动正式的 work_plan.db；
+生成缓存目录也始终指向临时目录，不会读写正式的 cache/generations
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import tempfile
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 添加 src 目录到路径，以便导入 ai_planner
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+REQUIREMENT = "开发一个新的企业级CRM客户管理系统，包含前后端，使用Vue3和SpringBoot"
+START_DATE = datetime.date(2025, 3, 3)
+
+
+def _percentile(values, pct):
+    """最近邻法计算分位数"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+
+
+def _date_range(days):
+    """从 START_DATE 开始跨 days 个自然日"""
+    end = START_DATE + datetime.timedelta(days=days - 1)
+    return START_DATE.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+
+def _run_direct(start, end, stream):
+    """进程内生成一次，返回生成的天数"""
+    from ai_planner import generate_plan, generate_plan_stream
+
+    if stream:
+        count = 0
+        for event, _ in generate_plan_stream(REQUIREMENT, start, end, use_cache=False, use_template=False):
+            if event == 'day':
+                count += 1
+        return count
+    plan, _ = generate_plan(REQUIREMENT, start, end, save_db=False, use_cache=False, use_template=False)
+    return len(plan)
+
+
+class ApiClient:
+    """通过 Web 接口提交生成任务，每个线程使用独立的会话"""
+
+    def __init__(self, api_url, user, password, poll_interval):
+        import requests
+
+        self.api_url = api_url.rstrip('/')
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._requests = requests
+        self._user = user
+        self._password = password
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._requests.Session()
+            resp = session.post(f"{self.api_url}/api/login", json={"username": self._user, "password": self._password}, timeout=10)
+            if resp.status_code != 200:
+                raise RuntimeError(f"登录失败: {resp.status_code} {resp.text}")
+            self._local.session = session
+        return session
+
+    def run(self, start, end):
+        """
+        提交任务并等待结果
+        :return: (生成的天数, 提交接口耗时)，任务数超限被拒绝时天数为 None
+        """
+        session = self._session()
+        t0 = time.perf_counter()
+        resp = session.post(f"{self.api_url}/api/generate_plan", json={
+            "requirement": REQUIREMENT, "start_date": start, "end_date": end, "no_cache": True,
+        }, timeout=30)
+        submit_latency = time.perf_counter() - t0
+        if resp.status_code == 429:
+            return None, submit_latency
+        resp.raise_for_status()
+
+        job_id = resp.json()['job_id']
+        while True:
+            time.sleep(self.poll_interval)
+            resp = session.get(f"{self.api_url}/api/jobs/{job_id}/result", timeout=30)
+            if resp.status_code == 202:
+                continue
+            if resp.status_code != 200:
+                raise RuntimeError(f"任务 {job_id} 失败: {resp.status_code} {resp.text}")
+            return len(resp.json().get('plan') or []), submit_latency
+
+
+def bench(label, fn, concurrency, total):
+    """
+    以 concurrency 的并发执行 total 次 fn
+    :return: 统计结果字典
+    """
+    latencies, submit_latencies = [], []
+    errors = rejected = days = 0
+    lock = threading.Lock()
+
+    def one():
+        nonlocal errors, rejected, days
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            with lock:
+                errors += 1
+            print(f"  [{label}] 请求失败: {e}", file=sys.stderr)
+            return
+        elapsed = time.perf_counter() - t0
+        with lock:
+            if isinstance(result, tuple):
+                result, submit_latency = result
+                submit_latencies.append(submit_latency)
+            if result is None:
+                rejected += 1
+                return
+            latencies.append(elapsed)
+            days += result
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(one) for _ in range(total)]:
+            future.result()
+    wall = time.perf_counter() - t0
+
+    def ms(value):
+        return round(value * 1000) if value is not None else None
+
+    return {
+        "label": label,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(latencies),
+        "errors": errors,
+        "rejected": rejected,
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "submit_p95_ms": ms(_percentile(submit_latencies, 95)),
+        "plans_per_s": round(len(latencies) / wall, 2) if wall else None,
+        "days_per_s": round(days / wall, 1) if wall else None,
+        "wall_s": round(wall, 2),
+    }
+
+
+def _print_table(rows):
+    columns = ["label", "concurrency", "requests", "ok", "errors", "rejected",
+               "p50_ms", "p95_ms", "submit_p95_ms", "plans_per_s", "days_per_s", "wall_s"]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="计划生成压测")
+    parser.add_argument('--mode', choices=['direct', 'api', 'both'], default='direct')
+    parser.add_argument('--base-url', default="http://127.0.0.1:8900/v1", help="direct 模式使用的 ai.base_url (默认本地模拟服务)")
+    parser.add_argument('--ranges', default="10,30,60", help="日期跨度 (自然日)，逗号分隔")
+    parser.add_argument('--concurrency', default="1,4", help="并发数，逗号分隔")
+    parser.add_argument('--requests', type=int, default=8, help="每组 (跨度, 并发) 的请求数")
+    parser.add_argument('--stream', action='store_true', help="direct 模式使用流式生成")
+    parser.add_argument('--api-url', default="http://127.0.0.1:5001/auto_ribao")
+    parser.add_argument('--user', default="admin")
+    parser.add_argument('--password', default="")
+    parser.add_argument('--poll-interval', type=float, default=0.2, help="api 模式轮询任务结果的间隔 (秒)")
+    parser.add_argument('--json', action='store_true', help="以 JSON 输出结果")
+    parser.add_argument('--db-file', default=None, help="direct 模式使用的数据库文件 (默认临时文件，结束后删除)")
+    args = parser.parse_args()
+
+    ranges = [int(x) for x in args.ranges.split(',') if x.strip()]
+    levels = [int(x) for x in args.concurrency.split(',') if x.strip()]
+
+    if args.mode in ('direct', 'both'):
+        # 导入 ai_planner 会连带导入 db_manager 并执行迁移，先把数据库和生成缓存指向临时目录，避免改动正式数据
+        from config_loader import config
+        temp_dir = tempfile.mkdtemp(prefix='bench_planner_')
+        atexit.register(shutil.rmtree, temp_dir, True)
+        db_file = args.db_file or os.path.join(temp_dir, 'work_plan.db')
+        config['app']['db_file'] = os.path.abspath(db_file)
+        config['cache'] = {**(config.get('cache') or {}), 'generation_dir': os.path.join(temp_dir, 'generations')}
+        from ai_planner import set_ai_overrides
+        set_ai_overrides(base_url=args.base_url, api_key='mock')
+    client = ApiClient(args.api_url, args.user, args.password, args.poll_interval) if args.mode in ('api', 'both') else None
+
+    rows = []
+    for days in ranges:
+        start, end = _date_range(days)
+        for concurrency in levels:
+            if args.mode in ('direct', 'both'):
+                label = f"direct{'-stream' if args.stream else ''} {days}d"
+                rows.append(bench(label, lambda: _run_direct(start, end, args.stream), concurrency, args.requests))
+            if client:
+                rows.append(bench(f"api {days}d", lambda: client.run(start, end), concurrency, args.requests))
+            print(f"完成: {days} 天 x 并发 {concurrency}", file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        _print_table(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
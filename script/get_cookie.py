@@ -9,12 +9,15 @@ from playwright.sync_api import sync_playwright
 # 添加 src 目录到路径，以便导入 config_loader
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
 from config_loader import config
+from accounts import DEFAULT_ACCOUNT, get_account, get_user_data_dir, get_session_file
 
 # --- 配置 ---
 LOGIN_URL = config['app']['target_url']
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-USER_DATA_DIR = os.path.join(BASE_DIR, 'browser_data')
-SESSION_FILE = os.path.join(BASE_DIR, 'session_token.json')
+# 由 --account 参数决定，默认账号使用 browser_data 和 session_token.json
+USER_DATA_DIR = get_user_data_dir(DEFAULT_ACCOUNT)
+SESSION_FILE = get_session_file(DEFAULT_ACCOUNT)
+ACCOUNT = DEFAULT_ACCOUNT
 
 # 统一的 User-Agent
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
@@ -55,6 +58,8 @@ def export_session():
     # 确保目录存在
     if not os.path.exists(USER_DATA_DIR):
         os.makedirs(USER_DATA_DIR)
+    if not os.path.exists(os.path.dirname(SESSION_FILE)):
+        os.makedirs(os.path.dirname(SESSION_FILE))
 
     with sync_playwright() as p:
         # 启动持久化上下文 (带界面)
@@ -111,8 +116,8 @@ def export_session():
             json.dump(session_data, f, ensure_ascii=False, indent=4)
 
         print(f"✅ 会话数据已导出到: {SESSION_FILE}")
-        print(f"👉 请将 {os.path.basename(SESSION_FILE)} 上传到服务器项目根目录")
-        print(f"👉 然后在服务器运行: python script/get_cookie.py --import")
+        print(f"👉 请将 {os.path.relpath(SESSION_FILE, BASE_DIR)} 上传到服务器项目根目录下的相同位置")
+        print(f"👉 然后在服务器运行: python script/get_cookie.py --import-session --account {ACCOUNT}")
 
         context.close()
 
@@ -188,8 +193,18 @@ def import_session():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="会话管理工具")
     parser.add_argument('--import-session', action='store_true', dest='do_import', help="导入会话数据 (在服务器运行)")
+    parser.add_argument('--account', default=DEFAULT_ACCOUNT, help="账号名 (默认为 security.admin_user)")
     args = parser.parse_args()
 
+    if not get_account(args.account):
+        print(f"❌ 账号不存在: {args.account}，请先在 config.yaml 的 accounts 中配置")
+        sys.exit(1)
+
+    ACCOUNT = args.account
+    USER_DATA_DIR = get_user_data_dir(ACCOUNT)
+    SESSION_FILE = get_session_file(ACCOUNT)
+    print(f"👤 当前账号: {ACCOUNT}")
+
     if args.do_import:
         import_session()
     else:
@@ -0,0 +1,238 @@
+"""
+本地 OpenAI 兼容模拟服务，用于离线调试和压测计划生成 (只依赖标准库)
+
+根据提示词中的工作日列表返回每日计划，可模拟首 token 延迟、输出速率、流式输出、错误和格式错误的返回:
+    python script/mock_llm_server.py --port 8900 --latency-ms 800 --token-rate 200 --malformed-rate 0.1
+
+然后将 ai.base_url 指向 http://127.0.0.1:8900/v1 (或使用 bench_planner.py 的 --base-url)
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 提示词中的日期列表，如 ["2025-03-03", "2025-03-04"]
+DATE_LIST_RE = re.compile(r'\[\s*"\d{4}-\d{2}-\d{2}"(?:\s*,\s*"\d{4}-\d{2}-\d{2}")*\s*\]')
+
+# 格式错误的类型
+MALFORMED_KINDS = ('truncate', 'drop_day', 'bad_object', 'wrong_date')
+
+PHASE_TASKS = (
+    ["需求调研与分析", "技术方案设计", "开发环境搭建"],
+    ["核心模块开发", "接口联调", "代码评审与重构"],
+    ["功能测试", "修复Bug", "部署上线准备"],
+)
+
+# 运行参数 (由命令行设置)
+OPTIONS = None
+_rand_lock = threading.Lock()
+_stats = {"requests": 0, "streams": 0, "errors": 0, "malformed": 0}
+
+
+def _random():
+    with _rand_lock:
+        return random.random()
+
+
+def _extract_dates(messages):
+    """从最后一条用户消息中提取需要生成的日期列表"""
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            match = DATE_LIST_RE.search(message.get('content') or '')
+            if match:
+                return json.loads(match.group(0))
+    return []
+
+
+def _build_plan(dates):
+    """按日期生成计划列表，前/中/后期使用不同的工作内容"""
+    plan = []
+    for i, date in enumerate(dates):
+        tasks = PHASE_TASKS[min(i * 3 // max(len(dates), 1), 2)]
+        todo = "\n".join(f"{n}. {task}{'，' + '细化内容' * OPTIONS.todo_repeat if OPTIONS.todo_repeat else ''}"
+                         for n, task in enumerate(tasks, 1))
+        plan.append({"date": date, "todo": todo, "progress": f"整体进度 {round((i + 1) * 100 / len(dates))}%"})
+    return plan
+
+
+def _render_content(dates):
+    """生成返回内容，按 --malformed-rate 的概率注入格式错误"""
+    plan = _build_plan(dates)
+    if not plan or _random() >= OPTIONS.malformed_rate:
+        return json.dumps(plan, ensure_ascii=False)
+
+    _stats["malformed"] += 1
+    kind = random.choice(MALFORMED_KINDS)
+    if kind == 'drop_day':
+        del plan[random.randrange(len(plan))]
+    elif kind == 'wrong_date':
+        plan[random.randrange(len(plan))]['date'] = "1999-01-01"
+    content = json.dumps(plan, ensure_ascii=False)
+    if kind == 'truncate':
+        content = content[:int(len(content) * 0.7)]
+    elif kind == 'bad_object':
+        content = content.replace('"todo": ', '"todo": oops ', 1)
+    return "```json\n" + content + "\n```"
+
+
+def _tokenize(content):
+    """粗略地按每 3 个字符切分为一个 token"""
+    return [content[i:i + 3] for i in range(0, len(content), 3)]
+
+
+def _sleep_ms(ms):
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+def _first_token_delay():
+    return OPTIONS.latency_ms + (random.uniform(0, OPTIONS.jitter_ms) if OPTIONS.jitter_ms else 0)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if OPTIONS.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {"object": "list", "data": [{"id": OPTIONS.model, "object": "model"}]})
+        elif self.path.rstrip('/').endswith('/stats'):
+            self._send_json(200, _stats)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        _stats["requests"] += 1
+
+        if _random() < OPTIONS.error_rate:
+            _stats["errors"] += 1
+            _sleep_ms(_first_token_delay())
+            self._send_json(500, {"error": {"message": "mock injected error", "type": "server_error"}})
+            return
+
+        messages = request.get('messages') or []
+        content = _render_content(_extract_dates(messages))
+        tokens = _tokenize(content)
+        usage = {
+            "prompt_tokens": sum(len(m.get('content') or '') for m in messages) // 3,
+            "completion_tokens": len(tokens),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = request.get('model') or OPTIONS.model
+
+        if request.get('stream'):
+            _stats["streams"] += 1
+            include_usage = (request.get('stream_options') or {}).get('include_usage')
+            self._stream(model, tokens, usage if include_usage else None)
+        else:
+            _sleep_ms(_first_token_delay() + len(tokens) * 1000 / OPTIONS.token_rate)
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    def _stream(self, model, tokens, usage):
+        """以 SSE 格式按 --token-rate 的速率逐个输出 token"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(delta, finish_reason=None, chunk_usage=None):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [] if chunk_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if chunk_usage:
+                payload["usage"] = chunk_usage
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            _sleep_ms(_first_token_delay())
+            chunk({"role": "assistant", "content": ""})
+            # 每次写出一批 token，避免过于频繁的小睡眠
+            batch = max(1, OPTIONS.token_rate // 50)
+            for i in range(0, len(tokens), batch):
+                chunk({"content": "".join(tokens[i:i + batch])})
+                _sleep_ms(batch * 1000 / OPTIONS.token_rate)
+            chunk({}, finish_reason="stop")
+            if usage:
+                chunk(None, chunk_usage=usage)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开 (如对冲请求落败、任务被取消)
+            pass
+
+
+def main():
+    global OPTIONS
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--model', default='mock-planner')
+    parser.add_argument('--latency-ms', type=float, default=500, help="首 token 延迟 (毫秒)")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="首 token 延迟的随机抖动上限 (毫秒)")
+    parser.add_argument('--token-rate', type=int, default=300, help="输出速率 (token/秒)")
+    parser.add_argument('--todo-repeat', type=int, default=2, help="每条工作内容的填充长度，用于控制输出 token 数")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="返回格式错误内容的概率 (0~1)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回 500 错误的概率 (0~1)")
+    parser.add_argument('--seed', type=int, help="随机种子")
+    parser.add_argument('--verbose', action='store_true', help="打印每个请求的访问日志")
+    OPTIONS = parser.parse_args()
+
+    if OPTIONS.token_rate <= 0:
+        parser.error("--token-rate 必须大于 0")
+    if OPTIONS.seed is not None:
+        random.seed(OPTIONS.seed)
+
+    server = ThreadingHTTPServer((OPTIONS.host, OPTIONS.port), MockHandler)
+    server.daemon_threads = True
+    print(f"模拟 LLM 服务已启动: http://{OPTIONS.host}:{OPTIONS.port}/v1 "
+          f"(首 token {OPTIONS.latency_ms}ms, {OPTIONS.token_rate} token/s, 格式错误率 {OPTIONS.malformed_rate}, 错误率 {OPTIONS.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import os
+import re
+import hmac
+from config_loader import config
+
+# 项目根目录 (src 的上一级)
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 默认账号 (security.admin_user)，升级前的所有计划、浏览器数据和会话文件都归属于它
+DEFAULT_ACCOUNT = config['security']['admin_user']
+
+# 默认账号沿用原有路径，其他账号按账号名分目录存放
+DEFAULT_USER_DATA_DIR = os.path.join(BASE_DIR, 'browser_data')
+DEFAULT_SESSION_FILE = os.path.join(BASE_DIR, 'session_token.json')
+PROFILES_DIR = os.path.join(BASE_DIR, 'browser_profiles')
+SESSIONS_DIR = os.path.join(BASE_DIR, 'sessions')
+# 录制的日报提交请求 (见 http_replay)，每个账号一个文件
+RECORDINGS_DIR = os.path.join(BASE_DIR, 'recordings')
+
+# 账号名会用作目录名和文件名，只允许安全字符
+_ACCOUNT_NAME_RE = re.compile(r'^[A-Za-z0-9_.\-]{1,64}$')
+
+
+def _load_accounts():
+    """
+    从 config.yaml 加载账号列表
+    security.admin_user 始终作为默认账号存在，accounts 段中可追加任意多个账号:
+        accounts:
+          - username: "alice"
+            password: "xxx"              # 或使用 password_hash (werkzeug 格式)
+            dingtalk_webhook: "..."      # 可选，默认使用全局 webhook
+            team: "backend"              # 可选，所属团队 (用于公司日历中按团队的停工安排)
+            enabled: true                # 可选，false 时不参与定时填报
+    """
+    accounts = {
+        DEFAULT_ACCOUNT: {
+            "username": DEFAULT_ACCOUNT,
+            "password": config['security'].get('admin_password'),
+            "password_hash": config['security'].get('admin_password_hash'),
+            "dingtalk_webhook": None,
+            "team": config['security'].get('team'),
+            "enabled": True,
+        }
+    }
+
+    for item in config.get('accounts') or []:
+        username = str(item.get('username', ''))
+        if not _ACCOUNT_NAME_RE.match(username):
+            raise ValueError(f"无效的账号名: {username!r} (仅允许字母、数字、'_'、'.'、'-')")
+        if username in accounts and username != DEFAULT_ACCOUNT:
+            raise ValueError(f"账号重复配置: {username}")
+
+        accounts[username] = {
+            "username": username,
+            "password": item.get('password'),
+            "password_hash": item.get('password_hash'),
+            "dingtalk_webhook": item.get('dingtalk_webhook'),
+            "team": item.get('team'),
+            "enabled": item.get('enabled', True),
+        }
+
+    return accounts
+
+
+# 全局账号表
+ACCOUNTS = _load_accounts()
+
+
+def get_account(username):
+    """获取账号配置，不存在时返回 None"""
+    return ACCOUNTS.get(username)
+
+
+def list_accounts(enabled_only=True):
+    """获取账号名列表"""
+    return [name for name, acc in ACCOUNTS.items() if acc['enabled'] or not enabled_only]
+
+
+def verify_password(username, password):
+    """校验账号密码"""
+    account = ACCOUNTS.get(username)
+    if not account or not password:
+        return False
+
+    if account['password_hash']:
+        from werkzeug.security import check_password_hash
+        return check_password_hash(account['password_hash'], password)
+
+    if account['password'] is None:
+        return False
+    return hmac.compare_digest(str(account['password']).encode('utf-8'), password.encode('utf-8'))
+
+
+def get_user_data_dir(username):
+    """获取账号的浏览器数据目录"""
+    if username == DEFAULT_ACCOUNT:
+        return DEFAULT_USER_DATA_DIR
+    return os.path.join(PROFILES_DIR, username)
+
+
+def get_session_file(username):
+    """获取账号的会话 Token 文件路径"""
+    if username == DEFAULT_ACCOUNT:
+        return DEFAULT_SESSION_FILE
+    return os.path.join(SESSIONS_DIR, f"{username}.json")
+
+
+def get_recording_file(username):
+    """获取账号录制的提交请求文件路径"""
+    return os.path.join(RECORDINGS_DIR, f"{username}.json")
+
+
+def get_dingtalk_webhook(username):
+    """获取账号的钉钉 Webhook，未单独配置时使用全局配置"""
+    account = ACCOUNTS.get(username)
+    if account and account['dingtalk_webhook']:
+        return account['dingtalk_webhook']
+    return config['dingtalk']['webhook']
+
+
+def get_team(username):
+    """获取账号所属团队，未配置时返回 None"""
+    account = ACCOUNTS.get(username)
+    return account['team'] if account else None
@@ -1,42 +1,308 @@
+import os
 import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from openai import OpenAI
 from workday_utils import get_workdays  # 导入更强大的工作日计算工具
-from config_loader import config
-from db_manager import add_or_update_plan, clear_plans_by_date_range  # 导入数据库操作
+from config_loader import config, load_config, CONFIG_FILE
+from db_manager import save_plans_bulk  # 导入数据库操作
+import generation_cache
+import plan_templates
+import llm_metrics
+from accounts import DEFAULT_ACCOUNT, get_team
 from logger import logger
 
 # === 配置 AI (从 config.yaml 加载) ===
-AI_API_KEY = config['ai']['api_key']
-AI_BASE_URL = config['ai']['base_url']
-AI_MODEL = config['ai']['model']
-SYSTEM_PROMPT = config['ai'].get('system_prompt', "你是一个资深技术经理，擅长拆解开发任务并编写日报。只返回 JSON 数据。")
-USER_PROMPT_TEMPLATE = config['ai'].get('user_prompt_template', "")
+# ai 段支持热更新：config.yaml 修改后重新读取，配置有变化时才重建客户端
+DEFAULT_SYSTEM_PROMPT = "你是一个资深技术经理，擅长拆解开发任务并编写日报。只返回 JSON 数据。"
+AI_CONFIG_CHECK_INTERVAL = 5  # 检查 config.yaml 修改时间的最小间隔 (秒)
 
-def generate_plan(requirement, start_date, end_date, mode='overwrite', save_db=True):
+# 运行时覆盖的配置项 (如压测时指向本地模拟服务)，重新读取配置后仍然生效
+_ai_overrides = {}
+_ai_config = dict(config['ai'])
+_config_mtime = os.stat(CONFIG_FILE).st_mtime_ns
+_last_config_check = time.monotonic()
+
+# 进程内共享的 OpenAI 客户端 (底层 httpx 连接池复用 TCP/TLS 连接)
+# 只有以下配置项变化时才需要重建，修改 model / 提示词等不影响连接
+_CLIENT_CONFIG_KEYS = ('api_key', 'base_url', 'max_connections', 'max_keepalive_connections',
+                       'keepalive_expiry', 'connect_timeout', 'timeout', 'max_retries')
+_clients = {}  # { 端点: (配置指纹, 客户端) }
+_client_lock = threading.Lock()
+
+# 端点：主端点为 ai 段本身，备用端点 (对冲请求) 使用 ai.hedge 中的配置
+PRIMARY = 'primary'
+FALLBACK = 'fallback'
+
+
+def get_ai_config():
+    """获取当前的 ai 配置 (config.yaml 修改后自动重新读取，读取失败时沿用旧配置)"""
+    global _ai_config, _config_mtime, _last_config_check
+    now = time.monotonic()
+    if now - _last_config_check < AI_CONFIG_CHECK_INTERVAL:
+        return _ai_config
+
+    with _client_lock:
+        if now - _last_config_check < AI_CONFIG_CHECK_INTERVAL:
+            return _ai_config
+        _last_config_check = now
+        try:
+            mtime = os.stat(CONFIG_FILE).st_mtime_ns
+            if mtime != _config_mtime:
+                _config_mtime = mtime
+                _ai_config = {**load_config()['ai'], **_ai_overrides}
+        except Exception as e:
+            logger.error(f"重新读取 AI 配置失败，继续使用原有配置: {e}")
+        return _ai_config
+
+
+def set_ai_overrides(**overrides):
     """
-    调用 AI 生成每日计划
-    :param mode: 'overwrite' (覆盖) 或 'append' (追加)
-    :param save_db: 是否保存到数据库，默认为 True。如果为 False，则只返回生成的数据。
+    在运行时覆盖 ai 配置项 (如 base_url、api_key、model)，主要用于本地压测和调试
+    连接相关的配置变化后，下次获取客户端时会自动重建
     """
-    client = OpenAI(api_key=AI_API_KEY, base_url=AI_BASE_URL)
+    global _ai_config
+    with _client_lock:
+        _ai_overrides.update(overrides)
+        _ai_config = {**_ai_config, **overrides}
 
-    # 使用 workday_utils 中的 get_workdays，支持节假日判断
-    workdays = get_workdays(start_date, end_date)
 
-    if not workdays:
-        logger.warning(f"时间范围内没有工作日: {start_date} - {end_date}")
-        return None, 0
+class _TimingTransport(httpx.HTTPTransport):
+    """通过 httpx 的 trace 扩展分别记录建连耗时 (TCP + TLS) 和请求耗时"""
+
+    def handle_request(self, request):
+        events = {}
+        parent_trace = request.extensions.get("trace")
+
+        def trace(event_name, info):
+            events[event_name] = time.perf_counter()
+            if parent_trace:
+                parent_trace(event_name, info)
+
+        request.extensions = {**request.extensions, "trace": trace}
+        start = time.perf_counter()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            logger.warning(f"AI 请求失败: {request.method} {request.url.path}，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+            raise
+
+        total_ms = (time.perf_counter() - start) * 1000
+        connect_started = events.get("connection.connect_tcp.started")
+        connect_done = events.get("connection.start_tls.complete") or events.get("connection.connect_tcp.complete")
+        if connect_started and connect_done:
+            connect_ms = (connect_done - connect_started) * 1000
+            connection = "新建连接"
+        else:
+            connect_ms = 0.0
+            connection = "复用连接"
+        logger.info(
+            f"AI 请求 {request.method} {request.url.path} -> {response.status_code}: "
+            f"{connection}，建连 {connect_ms:.0f}ms，请求 {total_ms - connect_ms:.0f}ms (至响应头)"
+        )
+        return response
+
+
+def _build_client(ai_config):
+    """
+    按 ai 配置创建 OpenAI 客户端，可选参数:
+        max_connections / max_keepalive_connections / keepalive_expiry: 连接池大小及空闲连接保持时间 (秒)
+        connect_timeout / timeout: 建连超时和整体请求超时 (秒)
+        max_retries: 连接错误、429、5xx 的自动重试次数 (SDK 内置指数退避)
+    """
+    limits = httpx.Limits(
+        max_connections=int(ai_config.get('max_connections', 10)),
+        max_keepalive_connections=int(ai_config.get('max_keepalive_connections', 5)),
+        keepalive_expiry=float(ai_config.get('keepalive_expiry', 60)),
+    )
+    timeout = httpx.Timeout(
+        float(ai_config.get('timeout', 120)),
+        connect=float(ai_config.get('connect_timeout', 10)),
+    )
+    http_client = httpx.Client(transport=_TimingTransport(limits=limits), timeout=timeout)
+    return OpenAI(
+        api_key=ai_config['api_key'],
+        base_url=ai_config['base_url'],
+        timeout=timeout,
+        max_retries=int(ai_config.get('max_retries', 2)),
+        http_client=http_client,
+    )
+
+
+def _endpoint_config(ai_config, endpoint):
+    """端点的配置：备用端点用 ai.hedge 中的 api_key / base_url / model 覆盖 ai 段的同名配置"""
+    if endpoint == PRIMARY:
+        return ai_config
+    hedge = ai_config.get('hedge') or {}
+    return {**ai_config, **{key: hedge[key] for key in ('api_key', 'base_url', 'model') if hedge.get(key)}}
+
+
+def get_client(endpoint=PRIMARY):
+    """获取进程内共享的 OpenAI 客户端 (线程安全)，连接相关的 ai 配置变化时重建"""
+    endpoint_config = _endpoint_config(get_ai_config(), endpoint)
+    fingerprint = tuple(str(endpoint_config.get(key)) for key in _CLIENT_CONFIG_KEYS)
+    cached = _clients.get(endpoint)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    with _client_lock:
+        cached = _clients.get(endpoint)
+        if cached is None or cached[0] != fingerprint:
+            # 旧客户端可能仍有请求在进行，不主动关闭，由其自行回收
+            if cached is not None:
+                logger.info(f"AI 配置已变化，重建 OpenAI 客户端 ({endpoint})")
+            cached = (fingerprint, _build_client(endpoint_config))
+            _clients[endpoint] = cached
+        return cached[1]
+
+
+class JsonArrayStreamParser:
+    """
+    增量解析 JSON 数组：流式输入文本片段，每当数组中的一个顶层对象完整时立即返回
+    忽略数组前后的多余内容 (如 markdown 代码块标记)，单个对象格式错误时跳过该对象
+    """
+
+    def __init__(self):
+        self.started = False    # 是否已遇到数组的起始 '['
+        self.finished = False   # 是否已遇到数组的结束 ']'
+        self.errors = 0         # 跳过的格式错误对象数
+        self._depth = 0         # 当前对象内的嵌套深度 (0 表示位于数组顶层)
+        self._in_string = False
+        self._escape = False
+        self._buffer = []       # 当前未完成对象的文本片段
+
+    def feed(self, text):
+        """
+        输入一段文本
+        :return: 本次新解析完成的对象列表
+        """
+        items = []
+        for ch in text:
+            if self.finished:
+                break
+            if not self.started:
+                if ch == '[':
+                    self.started = True
+                continue
+
+            if self._depth == 0:
+                # 数组顶层：只关心对象起始和数组结束，跳过逗号和空白
+                if ch == '{':
+                    self._depth = 1
+                    self._buffer = [ch]
+                elif ch == ']':
+                    self.finished = True
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json.loads(''.join(self._buffer)))
+                    except ValueError:
+                        self.errors += 1
+                    self._buffer = []
+        return items
+
+
+def _normalize_item(item):
+    """统一 AI 返回的单日计划格式：todo / progress 为列表时按行合并为字符串"""
+    todo_content = item.get('todo', '')
+    if isinstance(todo_content, list):
+        item['todo'] = "\n".join(str(t) for t in todo_content)
+
+    # 处理 progress 字段，如果是列表则转换为字符串
+    progress_content = item.get('progress')
+    if isinstance(progress_content, list):
+        item['progress'] = "\n".join(str(p) for p in progress_content)
+    elif progress_content is None:
+        item['progress'] = ''
+    return item
+
+
+# 补充生成时附带的相邻已有计划的最大条数
+REPAIR_CONTEXT_MAX = 10
+
+# 项目阶段：分段生成时按每段在整个周期中的位置给出阶段提示
+_PHASES = (
+    ("前期", "注重调研、设计、搭建环境"),
+    ("中期", "注重核心开发、接口联调"),
+    ("后期", "注重测试、修复Bug、部署"),
+)
+
+
+def _phase_hint(lo, hi, total):
+    """
+    生成分段的阶段提示
+    :param lo: 分段第一天在全部工作日中的下标
+    :param hi: 分段最后一天的下标 + 1
+    :param total: 全部工作日数
+    """
+    first = _PHASES[min(lo * 3 // total, 2)]
+    last = _PHASES[min((hi - 1) * 3 // total, 2)]
+    hint = f"本次只需规划整个周期中的第 {lo + 1}-{hi} 个工作日 (共 {total} 个工作日)，"
+    if first is last:
+        return hint + f"处于项目{first[0]}，{first[1]}。"
+    return hint + f"处于项目{first[0]}向{last[0]}过渡的阶段，先{first[1]}，逐步转向{last[1]}。"
+
 
+def _split_windows(workdays, chunk_size):
+    """
+    按 chunk_size 将工作日列表切分为若干段
+    :return: [(该段工作日列表, 阶段提示), ...]
+    """
+    total = len(workdays)
+    return [
+        (workdays[lo:lo + chunk_size], _phase_hint(lo, min(lo + chunk_size, total), total))
+        for lo in range(0, total, chunk_size)
+    ]
+
+
+def _chunk_settings(ai_config, days_count, chunked=None):
+    """
+    计算分段参数 (ai.chunk_size: 每段工作日数，0 表示不分段；ai.chunk_workers: 并发请求数)
+    :param chunked: None 表示超过 chunk_size 时自动分段，False 强制不分段
+    :return: (每段天数, 并发数)，不分段时每段天数为 0
+    """
+    chunk_size = int(ai_config.get('chunk_size', 10))
+    workers = max(1, int(ai_config.get('chunk_workers', 4)))
+    if chunked is False or chunk_size <= 0 or days_count <= chunk_size:
+        return 0, workers
+    return chunk_size, workers
+
+
+def _build_prompt(requirement, start_date, end_date, workdays, ai_config, phase_hint=""):
+    """
+    根据需求和工作日列表生成用户提示词
+    :param phase_hint: 分段生成时的阶段提示，自定义模板可通过 {phase_hint} 引用
+    """
     days_count = len(workdays)
     workdays_json = json.dumps(workdays)
+    user_prompt_template = ai_config.get('user_prompt_template', "")
 
     # 如果配置文件中没有模板，使用默认模板
-    if not USER_PROMPT_TEMPLATE:
-        prompt = f"""
+    if not user_prompt_template:
+        return f"""
         我是一个程序员。
         总需求：{requirement}
         时间范围：{start_date} 到 {end_date}
         工作日列表：{workdays_json} (共 {days_count} 天)
+        {phase_hint}
 
         请根据总需求，合理拆解为每天的工作内容。
 
@@ -48,57 +314,506 @@ def generate_plan(requirement, start_date, end_date, mode='overwrite', save_db=T
            - "todo": 今日工作内容（简练，适合日报，如果是多条内容请用换行分隔或直接返回字符串）
            - "progress": 迭代事项及进度（例如：完成用户模块开发 30%）
         """
-    else:
-        # 使用配置文件中的模板
-        prompt = USER_PROMPT_TEMPLATE.format(
-            requirement=requirement,
-            start_date=start_date,
-            end_date=end_date,
-            workdays_json=workdays_json,
-            days_count=days_count
+
+    # 使用配置文件中的模板
+    prompt = user_prompt_template.format(
+        requirement=requirement,
+        start_date=start_date,
+        end_date=end_date,
+        workdays_json=workdays_json,
+        days_count=days_count,
+        phase_hint=phase_hint
+    )
+    if phase_hint and '{phase_hint}' not in user_prompt_template:
+        prompt += "\n" + phase_hint
+    return prompt
+
+
+def _build_messages(prompt, ai_config):
+    return [
+        {"role": "system", "content": ai_config.get('system_prompt', DEFAULT_SYSTEM_PROMPT)},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def _temperature(ai_config):
+    return float(ai_config.get('temperature', 0.7))
+
+
+def _cache_key(ai_config, prompt, workdays):
+    return generation_cache.make_key(
+        ai_config['model'],
+        ai_config.get('base_url'),
+        ai_config.get('system_prompt', DEFAULT_SYSTEM_PROMPT),
+        prompt,
+        workdays,
+        _temperature(ai_config)
+    )
+
+
+def _is_valid_item(item, allowed_dates):
+    """校验单日计划：date 在请求的工作日列表中，todo 为非空字符串，progress 为字符串"""
+    return (
+        isinstance(item, dict)
+        and item.get('date') in allowed_dates
+        and isinstance(item.get('todo'), str) and bool(item['todo'].strip())
+        and isinstance(item.get('progress'), str)
+    )
+
+
+def _covers(items, workdays):
+    """结果是否恰好覆盖所有工作日且全部有效 (只缓存完整的结果)"""
+    allowed = set(workdays)
+    return (
+        len(items) == len(workdays)
+        and {item.get('date') for item in items} == allowed
+        and all(_is_valid_item(item, allowed) for item in items)
+    )
+
+
+def _parse_items(content):
+    """
+    解析 AI 返回的内容为计划列表
+    整体不是合法的 JSON 列表时 (如输出被截断或中间有格式错误)，挽救其中完整的对象
+    """
+    # 清理可能存在的 markdown 标记
+    content = content.replace("```json", "").replace("```", "").strip()
+
+    try:
+        plan_data = json.loads(content)
+        if isinstance(plan_data, list):
+            return [item for item in plan_data if isinstance(item, dict)]
+    except ValueError:
+        pass
+
+    parser = JsonArrayStreamParser()
+    items = [item for item in parser.feed(content) if isinstance(item, dict)]
+    logger.warning(f"AI 返回的不是合法的 JSON 列表，已挽救 {len(items)} 条完整的计划 (跳过 {parser.errors} 条格式错误)")
+    return items
+
+
+def _metrics_key(ai_config, endpoint):
+    return f"{endpoint}:{_endpoint_config(ai_config, endpoint)['model']}"
+
+
+def _complete(ai_config, endpoint, messages):
+    """非流式请求一个端点，返回文本内容，并记录耗时和 token 用量"""
+    endpoint_config = _endpoint_config(ai_config, endpoint)
+    key = _metrics_key(ai_config, endpoint)
+    started_at = time.perf_counter()
+    try:
+        response = get_client(endpoint).chat.completions.create(
+            model=endpoint_config['model'],
+            messages=messages,
+            temperature=_temperature(ai_config)
         )
+    except Exception:
+        llm_metrics.record_failure(key)
+        raise
+
+    usage = getattr(response, 'usage', None)
+    llm_metrics.record_call(
+        key,
+        latency=time.perf_counter() - started_at,
+        prompt_tokens=getattr(usage, 'prompt_tokens', None),
+        completion_tokens=getattr(usage, 'completion_tokens', None),
+    )
+    content = response.choices[0].message.content or ""
+    logger.debug(f"AI 原始返回内容 ({key}): {content}")
+    return content
+
 
-    logger.info(f"正在请求 AI 拆解任务 ({days_count} 天)...")
+def _stream_completion(ai_config, endpoint, messages):
+    """流式请求一个端点，逐段产出文本，并记录首 token 耗时、总耗时和 token 用量"""
+    endpoint_config = _endpoint_config(ai_config, endpoint)
+    key = _metrics_key(ai_config, endpoint)
+    extra = {}
+    if ai_config.get('stream_include_usage', True):
+        # 要求在最后一个分片中返回 token 用量 (不支持该参数的兼容接口可关闭)
+        extra['stream_options'] = {"include_usage": True}
 
+    started_at = time.perf_counter()
+    ttft = None
+    usage = None
+    content = []
     try:
-        response = client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7
+        stream = get_client(endpoint).chat.completions.create(
+            model=endpoint_config['model'],
+            messages=messages,
+            temperature=_temperature(ai_config),
+            stream=True,
+            **extra
         )
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started_at
+                content.append(delta)
+                yield delta
+        finally:
+            # 调用方提前结束 (如客户端断开、对冲落败) 时同时关闭上游连接
+            stream.close()
+    except Exception:
+        llm_metrics.record_failure(key)
+        raise
 
-        content = response.choices[0].message.content
-        logger.info(f"AI 原始返回内容: {content}")
+    llm_metrics.record_call(
+        key,
+        latency=time.perf_counter() - started_at,
+        ttft=ttft,
+        prompt_tokens=getattr(usage, 'prompt_tokens', None),
+        completion_tokens=getattr(usage, 'completion_tokens', None),
+    )
+    logger.debug(f"AI 原始返回内容 ({key}): {''.join(content)}")
 
-        # 清理可能存在的 markdown 标记
-        content = content.replace("```json", "").replace("```", "").strip()
 
-        plan_data = json.loads(content)
+def _hedge_delay(ai_config, metric):
+    """
+    对冲请求的触发延迟 (秒)，未启用对冲时返回 None
+    取主端点最近调用耗时的 ai.hedge.percentile 分位数，样本不足时使用 ai.hedge.delay_ms
+    """
+    hedge = ai_config.get('hedge') or {}
+    if not hedge.get('enabled'):
+        return None
+    delay = llm_metrics.get_percentile(_metrics_key(ai_config, PRIMARY), float(hedge.get('percentile', 95)), metric)
+    if delay is None:
+        delay = float(hedge.get('delay_ms', 10000)) / 1000
+    return max(delay, float(hedge.get('min_delay_ms', 1000)) / 1000)
+
+
+def _is_valid_content(content):
+    return bool(_parse_items(content))
+
+
+def _request_content(ai_config, messages):
+    """
+    非流式请求，返回文本内容
+    启用对冲时，主端点超过触发延迟仍未返回 (或先返回了无效内容) 则向备用端点发出相同请求，取先返回的有效结果
+    """
+    delay = _hedge_delay(ai_config, 'latency')
+    if delay is None:
+        return _complete(ai_config, PRIMARY, messages)
+
+    results = queue.Queue()
+
+    def run(endpoint):
+        try:
+            results.put((endpoint, _complete(ai_config, endpoint, messages), None))
+        except Exception as e:
+            results.put((endpoint, None, e))
+
+    threading.Thread(target=run, args=(PRIMARY,), daemon=True).start()
+    deadline = time.monotonic() + delay
+    hedged = False
+    pending = 1
+    fallback_content = None
+    last_error = None
+    while pending:
+        try:
+            timeout = None if hedged else max(0.0, deadline - time.monotonic())
+            endpoint, content, error = results.get(timeout=timeout)
+        except queue.Empty:
+            endpoint, content, error = None, None, None
 
-        # 预处理数据（统一格式）
-        for item in plan_data:
-            todo_content = item.get('todo', '')
-            if isinstance(todo_content, list):
-                item['todo'] = "\n".join(str(t) for t in todo_content)
-            
-            # 处理 progress 字段，如果是列表则转换为字符串
-            progress_content = item.get('progress', '')
-            if isinstance(progress_content, list):
-                item['progress'] = "\n".join(str(p) for p in progress_content)
+        if endpoint is not None:
+            pending -= 1
+            if error is None and _is_valid_content(content):
+                if hedged:
+                    llm_metrics.record_hedge(_metrics_key(ai_config, PRIMARY), won=endpoint == FALLBACK)
+                return content
+            last_error = error or last_error
+            fallback_content = content if content is not None else fallback_content
+
+        if not hedged:
+            # 主端点超时未返回或返回无效时发出对冲请求
+            hedged = True
+            pending += 1
+            logger.info(f"主端点 {delay * 1000:.0f}ms 内未返回有效结果，向备用端点发出对冲请求")
+            threading.Thread(target=run, args=(FALLBACK,), daemon=True).start()
+
+    llm_metrics.record_hedge(_metrics_key(ai_config, PRIMARY), won=False)
+    if fallback_content is not None:
+        # 都没有有效结果时返回最后一份内容，由补充生成处理
+        return fallback_content
+    raise last_error
+
+
+def _stream_content(ai_config, messages):
+    """
+    流式请求，逐段产出文本
+    启用对冲时，主端点超过触发延迟仍未返回首个分片 (或在此之前失败) 则向备用端点发出相同请求，
+    先返回首个分片的一方胜出，另一方的连接被关闭
+    """
+    delay = _hedge_delay(ai_config, 'ttft')
+    if delay is None:
+        yield from _stream_completion(ai_config, PRIMARY, messages)
+        return
+
+    events = queue.Queue()
+    stopped = {PRIMARY: threading.Event(), FALLBACK: threading.Event()}
+
+    def pump(endpoint):
+        deltas = _stream_completion(ai_config, endpoint, messages)
+        try:
+            for delta in deltas:
+                if stopped[endpoint].is_set():
+                    return
+                events.put((endpoint, 'delta', delta))
+            events.put((endpoint, 'end', None))
+        except Exception as e:
+            events.put((endpoint, 'error', e))
+        finally:
+            deltas.close()
+
+    def start_hedge():
+        logger.info(f"主端点 {delay * 1000:.0f}ms 内未返回首个分片，向备用端点发出对冲请求")
+        threading.Thread(target=pump, args=(FALLBACK,), daemon=True).start()
+
+    threading.Thread(target=pump, args=(PRIMARY,), daemon=True).start()
+    deadline = time.monotonic() + delay
+    hedged = False
+    winner = None
+    failed = set()
+    try:
+        while True:
+            try:
+                timeout = None if hedged or winner else max(0.0, deadline - time.monotonic())
+                endpoint, kind, data = events.get(timeout=timeout)
+            except queue.Empty:
+                hedged = True
+                start_hedge()
+                continue
+
+            if winner is not None and endpoint != winner:
+                continue
+
+            if kind == 'delta':
+                if winner is None:
+                    winner = endpoint
+                    other = FALLBACK if endpoint == PRIMARY else PRIMARY
+                    stopped[other].set()
+                    if hedged:
+                        llm_metrics.record_hedge(_metrics_key(ai_config, PRIMARY), won=endpoint == FALLBACK)
+                yield data
+            elif kind == 'end':
+                return
+            else:
+                if winner is not None:
+                    raise data
+                failed.add(endpoint)
+                if not hedged:
+                    hedged = True
+                    start_hedge()
+                elif len(failed) == 2:
+                    llm_metrics.record_hedge(_metrics_key(ai_config, PRIMARY), won=False)
+                    raise data
+    finally:
+        stopped[PRIMARY].set()
+        stopped[FALLBACK].set()
+
+
+def _request_items(ai_config, prompt, workdays, use_cache=True):
+    """
+    请求一次 AI (非流式)，返回解析后的计划列表
+    :param workdays: 本次请求的工作日列表 (参与缓存键计算)
+    :param use_cache: 是否使用生成缓存，False 时既不读取也不写入 (重新生成和压测不会覆盖或挤出已有缓存)
+    """
+    key = _cache_key(ai_config, prompt, workdays)
+    if use_cache:
+        cached = generation_cache.get(key)
+        if cached is not None:
+            logger.info(f"命中生成缓存 ({len(workdays)} 天)")
+            return cached
+
+    content = _request_content(ai_config, _build_messages(prompt, ai_config))
+
+    # 预处理数据（统一格式）
+    items = [_normalize_item(item) for item in _parse_items(content)]
+    if use_cache and _covers(items, workdays):
+        generation_cache.put(key, items)
+    return items
+
+
+def _stream_items(ai_config, prompt, workdays, use_cache=True):
+    """流式请求一次 AI，边接收边解析，逐个产出计划 (参数同 _request_items)"""
+    key = _cache_key(ai_config, prompt, workdays)
+    if use_cache:
+        cached = generation_cache.get(key)
+        if cached is not None:
+            logger.info(f"命中生成缓存 ({len(workdays)} 天)")
+            yield from cached
+            return
+
+    parser = JsonArrayStreamParser()
+    items = []
+    deltas = _stream_content(ai_config, _build_messages(prompt, ai_config))
+    try:
+        for delta in deltas:
+            for item in parser.feed(delta):
+                if isinstance(item, dict):
+                    item = _normalize_item(item)
+                    items.append(dict(item))
+                    yield item
+    finally:
+        # 调用方提前结束 (如客户端断开) 时同时关闭上游连接
+        deltas.close()
+
+    if not parser.finished:
+        logger.warning("AI 返回的 JSON 数组不完整")
+    elif use_cache and _covers(items, workdays):
+        generation_cache.put(key, items)
+
+
+def _collect_valid(workdays, items):
+    """
+    按日期收集有效的计划：不在工作日列表中、格式错误和重复的日期会被丢弃 (重复时保留第一条)
+    :return: { 'YYYY-MM-DD': 计划 }
+    """
+    allowed = set(workdays)
+    by_date = {}
+    for item in items:
+        date = item.get('date') if isinstance(item, dict) else None
+        if not _is_valid_item(item, allowed):
+            logger.warning(f"丢弃无效或不在工作日列表中的计划: {date}")
+        elif date in by_date:
+            logger.warning(f"丢弃重复日期的计划: {date}")
+        else:
+            by_date[date] = item
+    return by_date
+
+
+def _build_repair_prompt(requirement, workdays, by_date, missing):
+    """生成补充缺失日期的提示词，附带缺失日期前后最近的已有计划，保证内容衔接"""
+    context_dates = set()
+    for day in missing:
+        i = workdays.index(day)
+        before = next((d for d in reversed(workdays[:i]) if d in by_date), None)
+        after = next((d for d in workdays[i + 1:] if d in by_date), None)
+        context_dates.update(d for d in (before, after) if d)
+    context = [by_date[d] for d in workdays if d in context_dates][:REPAIR_CONTEXT_MAX]
+
+    return f"""
+        我是一个程序员。
+        总需求：{requirement}
+        整个周期共 {len(workdays)} 个工作日 ({workdays[0]} 到 {workdays[-1]})，每日计划已基本生成，但以下日期的计划缺失或格式错误，需要补充：
+        {json.dumps(missing)} (共 {len(missing)} 天)
+        相邻日期已有的计划如下，请保持内容衔接、进度连贯：
+        {json.dumps(context, ensure_ascii=False)}
+
+        要求：
+        1. 只输出上面需要补充的日期，每个日期恰好一项。
+        2. 输出必须是严格的 JSON 格式列表，不要包含 Markdown 代码块标记。
+        3. 列表每一项包含三个字段："date" (日期)、"todo" (今日工作内容)、"progress" (迭代事项及进度)。
+        """
+
+
+def _repair_missing(requirement, workdays, by_date, ai_config, use_cache=True):
+    """
+    只针对缺失或无效的日期重新请求 AI，结果合并进 by_date (原地修改)
+    最多补充 ai.repair_attempts 次，每次只请求仍然缺失的日期
+    :return: 补充后仍然缺失的日期列表
+    """
+    missing = [day for day in workdays if day not in by_date]
+    attempts = int(ai_config.get('repair_attempts', 2))
+    for attempt in range(1, attempts + 1):
+        if not missing or not by_date:
+            # 一天都没有生成时没有可参考的上下文，不做补充，由调用方报错
+            break
+        logger.info(f"第 {attempt} 次补充生成: {len(missing)}/{len(workdays)} 个工作日缺失或无效")
+        prompt = _build_repair_prompt(requirement, workdays, by_date, missing)
+        try:
+            items = _request_items(ai_config, prompt, missing, use_cache)
+        except Exception as e:
+            logger.warning(f"补充生成失败: {e}")
+            continue
+        by_date.update(_collect_valid(missing, items))
+        missing = [day for day in workdays if day not in by_date]
+    return missing
+
+
+def _merge_and_validate(workdays, by_date):
+    """
+    校验每个请求的工作日都恰好有一条计划，缺失日期时抛出 ValueError
+    :return: 按工作日顺序排列的计划列表
+    """
+    missing = [day for day in workdays if day not in by_date]
+    if missing:
+        raise ValueError(f"AI 返回的计划缺少 {len(missing)} 个工作日: {', '.join(missing)}")
+    return [by_date[day] for day in workdays]
+
+
+def _request_window(ai_config, prompt, workdays, use_cache):
+    """分段请求：单段失败时记录日志并返回空列表，缺失的日期由补充生成处理"""
+    try:
+        return _request_items(ai_config, prompt, workdays, use_cache)
+    except Exception as e:
+        logger.warning(f"分段生成失败 ({workdays[0]} ~ {workdays[-1]}): {e}")
+        return []
+
+
+def _generate_items(requirement, start_date, end_date, workdays, ai_config, chunked=None, use_cache=True):
+    """生成计划 (未校验)：范围较长时分段并发请求，每段分别缓存"""
+    chunk_size, workers = _chunk_settings(ai_config, len(workdays), chunked)
+    if not chunk_size:
+        prompt = _build_prompt(requirement, start_date, end_date, workdays, ai_config)
+        return _request_items(ai_config, prompt, workdays, use_cache)
+
+    windows = _split_windows(workdays, chunk_size)
+    logger.info(f"分段生成: 共 {len(workdays)} 天，分为 {len(windows)} 段，并发数 {workers}")
+    requests = [
+        (_build_prompt(requirement, start_date, end_date, window, ai_config, phase_hint), window)
+        for window, phase_hint in windows
+    ]
+    items = []
+    with ThreadPoolExecutor(max_workers=min(workers, len(requests)), thread_name_prefix='ai-chunk') as executor:
+        for window_items in executor.map(lambda req: _request_window(ai_config, req[0], req[1], use_cache), requests):
+            items.extend(window_items)
+    return items
+
+
+def generate_plan(requirement, start_date, end_date, mode='overwrite', save_db=True, account=DEFAULT_ACCOUNT,
+                  chunked=None, use_cache=True, use_template=True):
+    """
+    调用 AI 生成每日计划
+    :param mode: 'overwrite' (覆盖) 或 'append' (追加)
+    :param save_db: 是否保存到数据库，默认为 True。如果为 False，则只返回生成的数据。
+    :param account: 保存到哪个账号下
+    :param chunked: 是否分段并发生成，None 表示工作日数超过 ai.chunk_size 时自动分段
+    :param use_cache: 是否使用生成缓存，False 时强制重新请求 AI，结果也不写入缓存
+    :param use_template: 是否优先复用相似的计划模板，没有足够相似的模板时才请求 AI
+    """
+    ai_config = get_ai_config()
+
+    # 使用 workday_utils 中的 get_workdays，支持节假日判断
+    workdays = get_workdays(start_date, end_date, team=get_team(account))
+
+    if not workdays:
+        logger.warning(f"时间范围内没有工作日: {start_date} - {end_date}")
+        return None, 0
+
+    days_count = len(workdays)
+
+    try:
+        matched = plan_templates.match_plan(requirement, workdays, account) if use_template else None
+        if matched:
+            plan_data = matched[0]
+        else:
+            logger.info(f"正在请求 AI 拆解任务 ({days_count} 天)...")
+            items = _generate_items(requirement, start_date, end_date, workdays, ai_config, chunked, use_cache)
+            by_date = _collect_valid(workdays, items)
+            # 只对缺失或无效的日期补充生成
+            _repair_missing(requirement, workdays, by_date, ai_config, use_cache)
+            plan_data = _merge_and_validate(workdays, by_date)
 
         if save_db:
-            # 根据模式处理数据库
-            if mode == 'overwrite':
-                # 覆盖模式：先清除范围内的旧计划
-                clear_plans_by_date_range(start_date, end_date)
-                logger.info(f"已清除旧计划: {start_date} - {end_date}")
-                
-            # 统一使用 add_or_update_plan 处理
-            for item in plan_data:
-                add_or_update_plan(item['date'], item['todo'], item['progress'], mode)
+            # 覆盖模式会在同一事务中先清除范围内的旧计划
+            save_plans_bulk(plan_data, mode, start_date, end_date, account=account)
 
             logger.info(f"计划已生成并保存至数据库 (模式: {mode})")
         else:
@@ -111,10 +826,147 @@ def generate_plan(requirement, start_date, end_date, mode='overwrite', save_db=T
         # 抛出异常以便上层捕获并返回给前端
         raise e
 
+
+def _stream_windows(ai_config, requests, workers, use_cache=True):
+    """
+    并发流式请求多个分段，按完成顺序逐个产出计划
+    :param requests: [(提示词, 该段工作日列表), ...]
+    单段失败时记录日志并继续，缺失的日期由补充生成处理
+    """
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    def worker(prompt, workdays):
+        try:
+            for item in _stream_items(ai_config, prompt, workdays, use_cache):
+                if cancelled.is_set():
+                    return
+                events.put(('day', item))
+        except Exception as e:
+            logger.warning(f"分段流式生成失败 ({workdays[0]} ~ {workdays[-1]}): {e}")
+        finally:
+            events.put(('done', None))
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(requests)), thread_name_prefix='ai-chunk')
+    futures = []
+    try:
+        for prompt, workdays in requests:
+            futures.append(executor.submit(worker, prompt, workdays))
+
+        remaining = len(requests)
+        while remaining:
+            event, data = events.get()
+            if event == 'day':
+                yield data
+            else:
+                remaining -= 1
+    finally:
+        cancelled.set()
+        # 取消尚未开始的分段 (shutdown 的 cancel_futures 参数需要 Python 3.9+)
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def generate_plan_stream(requirement, start_date, end_date, account=DEFAULT_ACCOUNT, chunked=None, use_cache=True,
+                         use_template=True):
+    """
+    流式生成每日计划 (仅预览，不入库)：边接收 AI 输出边解析，每完成一天立即产出
+    范围较长时分段并发请求，各段的计划按完成顺序交错产出；流结束后对缺失或无效的日期补充生成
+    有足够相似的计划模板时 (use_template 为 True) 直接产出映射后的模板计划，不请求 AI
+    生成器依次产出 (事件, 数据):
+        ('start', {"days_count": n, "workdays": [...], "template": {"id": ..., "score": ...} 或 None})
+        ('day', {"date": ..., "todo": ..., "progress": ...})  每天一次
+        ('done', {"days_count": n, "count": 实际产出天数})
+    时间范围内没有工作日时抛出 ValueError
+    """
+    ai_config = get_ai_config()
+    workdays = get_workdays(start_date, end_date, team=get_team(account))
+    if not workdays:
+        logger.warning(f"时间范围内没有工作日: {start_date} - {end_date}")
+        raise ValueError("时间范围内没有工作日")
+
+    days_count = len(workdays)
+    matched = plan_templates.match_plan(requirement, workdays, account) if use_template else None
+    template = {"id": matched[1], "score": round(matched[2], 4)} if matched else None
+    yield 'start', {"days_count": days_count, "workdays": workdays, "template": template}
+
+    if matched:
+        for item in matched[0]:
+            yield 'day', item
+        yield 'done', {"days_count": days_count, "count": days_count}
+        return
+
+    chunk_size, workers = _chunk_settings(ai_config, days_count, chunked)
+    if chunk_size:
+        windows = _split_windows(workdays, chunk_size)
+        logger.info(f"正在分段流式请求 AI 拆解任务 ({days_count} 天，{len(windows)} 段，并发数 {workers})...")
+        items = _stream_windows(ai_config, [
+            (_build_prompt(requirement, start_date, end_date, window, ai_config, phase_hint), window)
+            for window, phase_hint in windows
+        ], workers, use_cache)
+    else:
+        logger.info(f"正在流式请求 AI 拆解任务 ({days_count} 天)...")
+        prompt = _build_prompt(requirement, start_date, end_date, workdays, ai_config)
+        items = _stream_items(ai_config, prompt, workdays, use_cache)
+
+    # 与非流式一致：只产出请求范围内的有效计划，每个日期只产出一次
+    allowed = set(workdays)
+    by_date = {}
+    stream_error = None
+    started_at = time.perf_counter()
+    try:
+        for item in items:
+            date = item.get('date')
+            if not _is_valid_item(item, allowed) or date in by_date:
+                logger.warning(f"丢弃无效、重复或不在工作日列表中的计划: {date}")
+                continue
+            by_date[date] = item
+            if len(by_date) == 1:
+                logger.info(f"首日计划已生成，耗时 {time.perf_counter() - started_at:.2f}s")
+            yield 'day', item
+    except Exception as e:
+        # 流中断时保留已收到的计划，缺失部分交给补充生成
+        logger.error(f"AI 流式生成失败: {e}", exc_info=True)
+        stream_error = e
+    finally:
+        items.close()
+
+    if not by_date and stream_error:
+        raise stream_error
+
+    if len(by_date) < days_count:
+        received = set(by_date)
+        _repair_missing(requirement, workdays, by_date, ai_config, use_cache)
+        for day in workdays:
+            if day in by_date and day not in received:
+                yield 'day', by_date[day]
+
+    count = len(by_date)
+    if count == 0:
+        raise ValueError("AI 未生成任何有效的计划")
+    if count < days_count:
+        missing = [day for day in workdays if day not in by_date]
+        logger.warning(f"AI 返回的计划缺少 {len(missing)} 个工作日: {', '.join(missing)}")
+    logger.info(f"流式生成完成，共 {count}/{days_count} 天，耗时 {time.perf_counter() - started_at:.2f}s")
+    yield 'done', {"days_count": days_count, "count": count}
+
+
 # 单独运行此文件可以生成计划
 if __name__ == "__main__":
-    # 示例：你可以手动修改这里的需求和时间，生成一次计划并存入数据库
-    req = "开发一个新的企业级CRM客户管理系统，包含前后端，使用Vue3和SpringBoot"
-    s_date = "2024-05-20"
-    e_date = "2024-05-31"
-    generate_plan(req, s_date, e_date)
\ No newline at end of file
+    import argparse
+
+    # 示例：默认需求和时间，生成一次计划并存入数据库
+    # 配合 script/mock_llm_server.py 可离线调试: python ai_planner.py --base-url http://127.0.0.1:8900/v1 --dry-run
+    parser = argparse.ArgumentParser(description="生成每日计划")
+    parser.add_argument('--requirement', default="开发一个新的企业级CRM客户管理系统，包含前后端，使用Vue3和SpringBoot")
+    parser.add_argument('--start', default="2024-05-20", help="开始日期 YYYY-MM-DD")
+    parser.add_argument('--end', default="2024-05-31", help="结束日期 YYYY-MM-DD")
+    parser.add_argument('--base-url', help="覆盖 ai.base_url (如本地模拟服务)")
+    parser.add_argument('--dry-run', action='store_true', help="只生成不入库")
+    args = parser.parse_args()
+
+    if args.base_url:
+        set_ai_overrides(base_url=args.base_url)
+    plan, days = generate_plan(args.requirement, args.start, args.end, save_db=not args.dry_run)
+    print(json.dumps(plan, ensure_ascii=False, indent=2))
\ No newline at end of file
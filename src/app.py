@@ -1,14 +1,24 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Blueprint
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Blueprint, Response, stream_with_context
 import json
 import os
+import base64
 import threading
 from datetime import datetime, timedelta
-from ai_planner import generate_plan
+from ai_planner import generate_plan_stream
 from config_loader import config
 from functools import wraps
 from workday_utils import get_holiday_info, get_holidays_in_range
-from db_manager import get_all_plans, update_plan, delete_plan, get_plans_by_date, add_or_update_plan, clear_plans_by_date_range, clear_all_plans
+from workday_calc import count_workdays, add_workdays, MAX_COUNT_RANGE_DAYS, MAX_OFFSET_WORKDAYS
+from accounts import verify_password, get_team
+from db_manager import get_all_plans, iter_plans, get_change_version, get_pruned_version, get_changes_since, update_plan, delete_plan, save_plans_bulk, clear_plans_by_date_range, clear_all_plans, release_connection, get_pool_stats
+import plan_cache
+import generation_cache
+import plan_templates
+import job_queue
+import llm_metrics
+import browser_pool
+import http_replay
+import route_policy
 from scheduler import start_scheduler, get_current_schedule_time, update_schedule_time
 from logger import logger
 from handler import run as run_handler
@@ -26,14 +36,18 @@ app.secret_key = os.urandom(24)
 # 设置 session 有效期为 30 分钟
 app.permanent_session_lifetime = timedelta(minutes=30)
 
-# 用户配置 (从 config.yaml 加载)
-users = {
-    config['security']['admin_user']: generate_password_hash(config['security']['admin_password'])
-}
+@app.teardown_appcontext
+def _release_db_connection(exc):
+    """请求结束后归还数据库连接 (开发服务器为每个请求新建线程，不归还会一直占用连接和文件句柄)"""
+    release_connection()
 
 # 创建 Blueprint，设置 URL 前缀
 bp = Blueprint('auto_ribao', __name__, url_prefix='/auto_ribao')
 
+# 分页查询每页条数 (默认值 / 上限)
+PLANS_PAGE_SIZE = 200
+PLANS_PAGE_SIZE_MAX = 1000
+
 # === 登录验证装饰器 ===
 def login_required(f):
     @wraps(f)
@@ -60,7 +74,7 @@ def api_login():
     username = data.get('username')
     password = data.get('password')
     
-    if username in users and check_password_hash(users.get(username), password):
+    if verify_password(username, password):
         session.permanent = True
         session['user'] = username
         logger.info(f"用户 {username} 登录成功")
@@ -81,17 +95,40 @@ def logout():
 def index():
     return render_template('index.html')
 
+def _run_generation_job(job, requirement, start_date, end_date, account, use_cache):
+    """后台任务：流式生成计划，每生成一天追加到 job.items，便于轮询时展示部分结果"""
+    # 重新生成 (不使用缓存) 时同样跳过计划模板
+    events = generate_plan_stream(requirement, start_date, end_date, account=account,
+                                  use_cache=use_cache, use_template=use_cache)
+    try:
+        for event, payload in events:
+            if job.is_cancelled():
+                logger.info(f"任务 {job.id} 已取消，停止生成")
+                return None
+            if event == 'start':
+                job.progress["days_count"] = payload["days_count"]
+                job.progress["template"] = payload["template"]
+            elif event == 'day':
+                job.items.append(payload)
+    finally:
+        # 取消时关闭生成器，同时关闭与 AI 的连接
+        events.close()
+
+    plan = sorted(job.items, key=lambda item: item['date'])
+    return {"plan": plan, "days_count": job.progress.get("days_count", len(plan))}
+
 @bp.route('/api/generate_plan', methods=['POST'])
 @login_required
 def api_generate_plan():
-    data = request.json
+    """提交计划生成任务 (仅预览，不入库)，立即返回任务 ID，通过 /api/jobs/<job_id> 查询进度和结果"""
+    data = request.json or {}
     requirement = data.get('requirement')
     start_date = data.get('start_date')
     end_date = data.get('end_date')
-    mode = data.get('mode', 'overwrite') # 获取生成模式
+    use_cache = not data.get('no_cache', False) # no_cache 为 true 时跳过生成缓存，强制重新请求 AI
     
     user = session.get('user')
-    logger.info(f"用户 {user} 请求生成计划预览: {start_date} 至 {end_date}, 模式: {mode}")
+    logger.info(f"用户 {user} 请求生成计划预览: {start_date} 至 {end_date}")
     
     if not requirement or not start_date or not end_date:
         logger.warning("生成计划失败: 缺少必要参数")
@@ -101,22 +138,59 @@ def api_generate_plan():
         logger.warning("生成计划失败: 需求描述过长")
         return jsonify({"error": "需求描述过长"}), 400
 
+    error = _check_date_span(start_date, end_date)
+    if error:
+        logger.warning(f"生成计划失败: {error}")
+        return jsonify({"error": error}), 400
+
     try:
-        # save_db=False 表示只生成不保存
-        plan, days_count = generate_plan(requirement, start_date, end_date, mode, save_db=False)
-        if plan:
-            logger.info(f"计划预览生成成功，共 {days_count} 天")
-            return jsonify({
-                "message": "计划生成成功", 
-                "plan": plan,
-                "days_count": days_count
-            })
-        else:
-            logger.error("计划生成失败: AI 返回空结果")
-            return jsonify({"error": "计划生成失败: AI 返回空结果"}), 500
-    except Exception as e:
-        logger.error(f"生成计划时发生异常: {e}", exc_info=True)
-        return jsonify({"error": f"系统错误: {str(e)}"}), 500
+        job = job_queue.submit(user, 'generate_plan', _run_generation_job,
+                               requirement, start_date, end_date, user, use_cache)
+    except job_queue.TooManyJobsError as e:
+        logger.warning(f"用户 {user} 提交生成任务被拒绝: {e}")
+        return jsonify({"error": str(e)}), 429
+
+    logger.info(f"计划生成任务已提交: {job.id}")
+    return jsonify({"job_id": job.id, "status": job.status}), 202
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def api_get_job(job_id):
+    """查询任务状态及已生成的部分结果: /api/jobs/<job_id>?offset=n 只返回第 n 条之后的部分结果"""
+    job = job_queue.get_job(job_id, user=session['user'])
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({"error": "无效的 offset 参数"}), 400
+    return jsonify(job.to_dict(offset))
+
+@bp.route('/api/jobs/<job_id>/result', methods=['GET'])
+@login_required
+def api_get_job_result(job_id):
+    """获取任务结果：未完成时返回 202，失败或已取消时返回错误信息"""
+    job = job_queue.get_job(job_id, user=session['user'])
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+
+    if job.status in job_queue.ACTIVE_STATUSES:
+        return jsonify({"job_id": job.id, "status": job.status}), 202
+    if job.status == job_queue.FAILED:
+        return jsonify({"error": f"系统错误: {job.error}", "status": job.status}), 500
+    if job.status == job_queue.CANCELLED:
+        return jsonify({"error": "任务已取消", "status": job.status}), 409
+    return jsonify({"message": "计划生成成功", "status": job.status, **job.result})
+
+@bp.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def api_cancel_job(job_id):
+    job = job_queue.cancel(job_id, user=session['user'])
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+    logger.info(f"用户 {session['user']} 取消任务 {job_id}")
+    return jsonify({"job_id": job.id, "status": job.status})
 
 @bp.route('/api/save_generated_plans', methods=['POST'])
 @login_required
@@ -126,6 +200,7 @@ def api_save_generated_plans():
     mode = data.get('mode', 'overwrite')
     start_date = data.get('start_date')
     end_date = data.get('end_date')
+    requirement = data.get('requirement') # 生成时的需求描述，用于保存为计划模板
     
     user = session.get('user')
     logger.info(f"用户 {user} 确认保存计划: {len(plans) if plans else 0} 条, 模式: {mode}")
@@ -134,30 +209,163 @@ def api_save_generated_plans():
         return jsonify({"error": "没有计划数据"}), 400
         
     try:
-        # 如果是覆盖模式，且提供了日期范围，先清除旧数据
-        if mode == 'overwrite' and start_date and end_date:
-            clear_plans_by_date_range(start_date, end_date)
-            logger.info(f"已清除旧计划: {start_date} - {end_date}")
-            
-        for item in plans:
-            add_or_update_plan(item['date'], item['todo'], item['progress'], mode)
-            
-        logger.info("计划保存完成")
-        return jsonify({"message": "计划保存成功"})
+        # 覆盖模式下如提供了日期范围，会在同一事务中先清除旧数据
+        saved_count = save_plans_bulk(plans, mode, start_date, end_date, account=user)
+        logger.info(f"计划保存完成，共 {saved_count} 天")
     except Exception as e:
         logger.error(f"保存计划失败: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+    # 模板保存失败不影响计划入库
+    try:
+        plan_templates.save_template(requirement, plans, start_date, end_date, account=user)
+    except Exception as e:
+        logger.warning(f"保存计划模板失败: {e}")
+    return jsonify({"message": "计划保存成功"})
+
 @bp.route('/api/get_plan', methods=['GET'])
 @login_required
 def api_get_plan():
     try:
-        plans = get_all_plans()
+        plans = get_all_plans(account=session.get('user'))
         return jsonify(plans)
     except Exception as e:
         logger.error(f"获取计划列表失败: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+def _is_valid_date(date_str):
+    """校验 YYYY-MM-DD 格式"""
+    try:
+        datetime.strptime(date_str, "%Y-%m-%d")
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def _check_date_span(start_date, end_date):
+    """校验日期范围的格式和跨度 (不超过 MAX_COUNT_RANGE_DAYS)，不合法时返回错误信息，否则返回 None"""
+    if not _is_valid_date(start_date) or not _is_valid_date(end_date):
+        return "缺少或无效的日期范围参数"
+    span = (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days
+    if span > MAX_COUNT_RANGE_DAYS:
+        return f"日期范围过大，最多 {MAX_COUNT_RANGE_DAYS} 天"
+    return None
+
+def _encode_cursor(plan):
+    """将一条计划的 (date, id) 编码为不透明的分页游标"""
+    raw = f"{plan['date']}|{plan['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor):
+    """解析分页游标，格式错误时返回 None"""
+    try:
+        date_str, plan_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        if not _is_valid_date(date_str):
+            return None
+        return date_str, int(plan_id)
+    except (ValueError, UnicodeError):
+        return None
+
+@bp.route('/api/plans', methods=['GET'])
+@login_required
+def api_plans():
+    """按日期范围分页获取计划: /api/plans?start=YYYY-MM-DD&end=YYYY-MM-DD&cursor=&limit="""
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+    cursor = request.args.get('cursor')
+
+    if not _is_valid_date(start_date) or not _is_valid_date(end_date):
+        return jsonify({"error": "缺少或无效的日期范围参数"}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', PLANS_PAGE_SIZE)), 1), PLANS_PAGE_SIZE_MAX)
+    except ValueError:
+        return jsonify({"error": "无效的 limit 参数"}), 400
+
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor)
+        if not after:
+            return jsonify({"error": "无效的分页游标"}), 400
+
+    try:
+        items, has_more, version = plan_cache.get_plans_page(start_date, end_date, after, limit, account=session.get('user'))
+        return jsonify({
+            "items": items,
+            "next_cursor": _encode_cursor(items[-1]) if has_more else None,
+            "version": version
+        })
+    except Exception as e:
+        logger.error(f"分页获取计划失败: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/api/plans/changes', methods=['GET'])
+@login_required
+def api_plan_changes():
+    """
+    增量同步: /api/plans/changes?since=<version>[&start=&end=]
+    返回 since 之后新增/修改的计划和被删除的计划 ID；数据未变化时根据 ETag 返回 304
+    """
+    user = session.get('user')
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({"error": "缺少或无效的 since 参数"}), 400
+
+    if (start_date and not _is_valid_date(start_date)) or (end_date and not _is_valid_date(end_date)):
+        return jsonify({"error": "无效的日期范围参数"}), 400
+
+    try:
+        version = get_change_version(account=user)
+
+        # 客户端版本比服务端还新 (如数据库被重建)，或早于已清理的删除记录，通知客户端全量重新加载
+        if since > version or since < get_pruned_version(account=user):
+            return jsonify({"version": version, "reset": True, "upserted": [], "deleted": []})
+
+        # 相同 URL (since/范围) 下响应只取决于当前版本号，据此生成 ETag
+        etag = f"{user}:{version}"
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify({"reset": False, **get_changes_since(since, start_date, end_date, account=user)})
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    except Exception as e:
+        logger.error(f"获取增量变更失败: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/api/plans/export', methods=['GET'])
+@login_required
+def api_export_plans():
+    """以流式 JSON 数组导出计划 (可选 start/end 限定范围)"""
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+
+    if (start_date and not _is_valid_date(start_date)) or (end_date and not _is_valid_date(end_date)):
+        return jsonify({"error": "无效的日期范围参数"}), 400
+
+    user = session.get('user')
+    logger.info(f"用户 {user} 导出计划: {start_date or '最早'} 至 {end_date or '最晚'}")
+
+    def generate():
+        yield '['
+        first = True
+        for plan in iter_plans(start_date, end_date, account=user):
+            if not first:
+                yield ','
+            first = False
+            yield json.dumps(plan, ensure_ascii=False)
+        yield ']'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/json',
+        headers={"Content-Disposition": "attachment; filename=work_plans.json"}
+    )
+
 @bp.route('/api/update_day', methods=['POST'])
 @login_required
 def api_update_day():
@@ -171,7 +379,8 @@ def api_update_day():
         return jsonify({"error": "缺少计划ID"}), 400
         
     try:
-        update_plan(plan_id, todo, progress)
+        if not update_plan(plan_id, todo, progress, account=user):
+            return jsonify({"error": "计划不存在"}), 404
         logger.info(f"用户 {user} 更新了计划 ID {plan_id}")
         return jsonify({"message": "更新成功"})
     except Exception as e:
@@ -189,7 +398,8 @@ def api_delete_plan():
         return jsonify({"error": "缺少计划ID"}), 400
         
     try:
-        delete_plan(plan_id)
+        if not delete_plan(plan_id, account=user):
+            return jsonify({"error": "计划不存在"}), 404
         logger.info(f"用户 {user} 删除了计划 ID {plan_id}")
         return jsonify({"message": "删除成功"})
     except Exception as e:
@@ -208,13 +418,13 @@ def api_clear_plans():
     
     try:
         if clear_type == 'all':
-            clear_all_plans()
+            clear_all_plans(account=user)
             logger.info(f"用户 {user} 清除了所有计划")
             return jsonify({"message": "所有计划已清除"})
         elif clear_type == 'range':
             if not start_date or not end_date:
                 return jsonify({"error": "缺少日期范围参数"}), 400
-            clear_plans_by_date_range(start_date, end_date)
+            clear_plans_by_date_range(start_date, end_date, account=user)
             logger.info(f"用户 {user} 清除了 {start_date} 至 {end_date} 的计划")
             return jsonify({"message": "指定范围内的计划已清除"})
         else:
@@ -223,6 +433,22 @@ def api_clear_plans():
         logger.error(f"清除计划失败: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+@bp.route('/api/metrics', methods=['GET'])
+@login_required
+def api_metrics():
+    """运行指标 (缓存命中率、任务队列、AI 调用耗时和 token 用量等)"""
+    return jsonify({
+        "plan_cache": plan_cache.get_stats(),
+        "generation_cache": generation_cache.get_stats(),
+        "jobs": job_queue.get_stats(),
+        "llm": llm_metrics.get_stats(),
+        "templates": plan_templates.get_stats(),
+        "browser": browser_pool.get_stats(),
+        "http_replay": http_replay.get_stats(),
+        "blocking": route_policy.get_stats(),
+        "db_pool": get_pool_stats()
+    })
+
 @bp.route('/api/check_holiday', methods=['GET'])
 @login_required
 def api_check_holiday():
@@ -230,7 +456,7 @@ def api_check_holiday():
     if not date_str:
         return jsonify({"error": "缺少日期参数"}), 400
     
-    holiday_info = get_holiday_info(date_str)
+    holiday_info = get_holiday_info(date_str, team=get_team(session['user']))
     return jsonify({"holiday": holiday_info})
 
 @bp.route('/api/get_holidays_batch', methods=['GET'])
@@ -239,12 +465,48 @@ def api_get_holidays_batch():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    if not start_date or not end_date:
-        return jsonify({"error": "缺少日期范围参数"}), 400
+    error = _check_date_span(start_date, end_date)
+    if error:
+        return jsonify({"error": error}), 400
         
-    holidays = get_holidays_in_range(start_date, end_date)
+    holidays = get_holidays_in_range(start_date, end_date, team=get_team(session['user']))
     return jsonify(holidays)
 
+@bp.route('/api/workdays/count', methods=['GET'])
+@login_required
+def api_count_workdays():
+    """统计区间内工作日数量: /api/workdays/count?start=&end="""
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+
+    error = _check_date_span(start_date, end_date)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        return jsonify({"count": count_workdays(start_date, end_date, team=get_team(session['user']))})
+    except ValueError as e:
+        return jsonify({"error": f"无效的参数: {e}"}), 400
+
+@bp.route('/api/workdays/offset', methods=['GET'])
+@login_required
+def api_offset_workdays():
+    """
+    工作日偏移: /api/workdays/offset?date=&n=
+    n > 0 为之后第 n 个工作日，n < 0 为之前第 |n| 个工作日；date 默认为今天，n 默认为 1 (下一个工作日)
+    """
+    date_str = request.args.get('date') or datetime.now().strftime("%Y-%m-%d")
+    if not _is_valid_date(date_str):
+        return jsonify({"error": "无效的日期参数"}), 400
+
+    try:
+        n = int(request.args.get('n', 1))
+        if abs(n) > MAX_OFFSET_WORKDAYS:
+            return jsonify({"error": f"n 的绝对值不能超过 {MAX_OFFSET_WORKDAYS}"}), 400
+        return jsonify({"date": add_workdays(date_str, n, team=get_team(session['user']))})
+    except ValueError as e:
+        return jsonify({"error": f"无效的参数: {e}"}), 400
+
 @bp.route('/api/get_schedule_time', methods=['GET'])
 @login_required
 def api_get_schedule_time():
@@ -279,7 +541,7 @@ def api_trigger_fill():
     logger.info(f"用户 {user} 手动触发日报填写任务")
     
     try:
-        result = run_handler(is_api_call=True)
+        result = run_handler(account=user, is_api_call=True)
         if result and result.get('success'):
             return jsonify({"message": result.get('message', '执行成功')})
         else:
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import asyncio
+import functools
+from playwright.async_api import async_playwright
+from config_loader import config
+from accounts import get_session_file, get_dingtalk_webhook
+from browser_pool import LAUNCH_ARGS, CONTEXT_OPTIONS, BROWSER_HEADLESS, BROWSER_NAV_TIMEOUT_MS, TARGET_URL, inject_stealth_scripts
+import http_replay
+import route_policy
+from fill_steps import FillStepError, run_fill_steps_async
+from handler import IMG_LOG_DIR, get_timestamp, load_session_file, write_session_file, notify_fill_result
+from logger import logger
+
+# 多账号并发填写 (config.yaml 的 fill 段，均可省略)
+# 少量浏览器进程中为每个账号创建独立的上下文 (从账号的会话文件恢复 Cookie 和 LocalStorage)，并发填写
+_fill_config = config.get('fill') or {}
+FILL_ENGINE = _fill_config.get('engine', 'async')  # 定时任务使用的填写方式: async (并发) / sync (逐个账号使用常驻浏览器)
+FILL_CONCURRENCY = int(_fill_config.get('concurrency', 4))  # 同时填写的账号数
+FILL_BROWSERS = int(_fill_config.get('browsers', 2))  # 浏览器进程数，账号轮流分配到各个浏览器
+FILL_ACCOUNT_TIMEOUT = float(_fill_config.get('account_timeout_seconds', 120))  # 单个账号的超时时间 (秒)
+FILL_FALLBACK_TO_BROWSER = bool(_fill_config.get('fallback_to_browser', True))  # 提交前失败的账号改用常驻浏览器 (持久化用户数据) 重试
+
+
+def to_storage_state(session_data):
+    """将会话文件的内容转换为 Playwright 的 storage_state (LocalStorage 为 {键: 值} 时转为列表)"""
+    origins = []
+    for item in session_data.get('origins') or []:
+        if not item.get('origin'):
+            continue
+        storage = item.get('localStorage') or {}
+        if isinstance(storage, dict):
+            storage = [{"name": key, "value": str(value)} for key, value in storage.items()]
+        origins.append({"origin": item['origin'], "localStorage": storage})
+    return {"cookies": session_data.get('cookies') or [], "origins": origins}
+
+
+async def _save_session(context, page, session_file):
+    """异步版本的会话保存 (写文件部分与同步流程共用)"""
+    try:
+        cookies = await context.cookies()
+        origin = await page.evaluate("() => window.location.origin")
+        local_storage = json.loads(await page.evaluate("() => JSON.stringify(localStorage)"))
+        write_session_file(session_file, cookies, origin, local_storage)
+    except Exception as e:
+        logger.error(f"保存会话失败: {e}")
+
+
+async def _screenshot(page, account, kind):
+    try:
+        path = os.path.join(IMG_LOG_DIR, f"daily_report_{kind}_{account}_{get_timestamp()}.png")
+        await page.screenshot(path=path)
+        return path
+    except Exception as e:
+        logger.error(f"[{account}] 截图失败: {e}")
+        return None
+
+
+async def _fill_in_context(browser, account, plan, result):
+    """在独立的浏览器上下文中填写一个账号的日报，结果写入 result"""
+    session_file = get_session_file(account)
+    session_data = load_session_file(session_file)
+    if session_data is None:
+        raise RuntimeError(f"会话文件不存在或已损坏: {os.path.basename(session_file)}")
+
+    context = await browser.new_context(storage_state=to_storage_state(session_data), **CONTEXT_OPTIONS)
+    block_stats = None
+    try:
+        block_stats = await route_policy.apply_async(context)
+        await inject_stealth_scripts(context)
+        page = await context.new_page()
+        await page.goto(TARGET_URL, timeout=BROWSER_NAV_TIMEOUT_MS)
+        await page.wait_for_load_state("domcontentloaded")
+
+        values = {"todo": plan['todo'], "progress": plan['progress'] or "正常推进中"}
+
+        async def record(response):
+            # 录制提交请求，之后可以直接 HTTP 提交 (见 http_replay)
+            try:
+                local_storage = json.loads(await page.evaluate("() => JSON.stringify(localStorage)"))
+                http_replay.save_recording(account, response.request, response.status, await response.text(), values, local_storage)
+            except Exception as e:
+                logger.warning(f"[{account}] 录制提交请求失败: {e}")
+
+        try:
+            result["steps"] = await run_fill_steps_async(page, values, label=f"[{account}] ", progress=result,
+                                                         on_submit=record if http_replay.FILL_MODE != 'browser' else None)
+        except Exception:
+            result["screenshot"] = await _screenshot(page, account, "error")
+            raise
+
+        result["screenshot"] = await _screenshot(page, account, "success")
+        await _save_session(context, page, session_file)
+    finally:
+        result["blocked"] = route_policy.log_run(block_stats, f"[{account}] ")
+        try:
+            await context.close()
+        except Exception as e:
+            logger.warning(f"[{account}] 关闭浏览器上下文时出错: {e}")
+
+
+async def _fill_one(browser, account, plan, semaphore):
+    """
+    填写一个账号 (受并发数和超时限制)，完成后发送通知
+    :return: {"account", "success", "message", "duration", "steps", "step", "fallback", "screenshot", "blocked"}
+    """
+    result = {"account": account, "success": False, "message": "", "duration": 0.0,
+              "steps": {}, "step": None, "fallback": False, "screenshot": None, "blocked": None}
+    async with semaphore:
+        started_at = time.perf_counter()
+        logger.info(f"[{account}] 开始填写日报")
+        try:
+            await asyncio.wait_for(_fill_in_context(browser, account, plan, result), FILL_ACCOUNT_TIMEOUT)
+            result["success"] = True
+            result["message"] = "日报填写成功"
+        except asyncio.TimeoutError:
+            result["message"] = f"超时 ({FILL_ACCOUNT_TIMEOUT:g}s)"
+        except FillStepError as e:
+            result["message"] = str(e)
+        except Exception as e:
+            logger.error(f"[{account}] 填写失败: {e}", exc_info=True)
+            result["message"] = f"执行失败: {e}"
+        result["duration"] = round(time.perf_counter() - started_at, 2)
+
+    # 还没有开始提交就失败 (如会话失效) 时可以安全地改用常驻浏览器重试，不会重复提交
+    if not result["success"] and FILL_FALLBACK_TO_BROWSER and result["step"] != 'submit':
+        result["fallback"] = True
+        logger.warning(f"[{account}] 并发填写失败，稍后改用常驻浏览器重试: {result['message']}")
+        return result
+
+    # 上传截图和发送通知是阻塞调用，放到线程中执行 (asyncio.to_thread 需要 Python 3.9+)
+    notify = functools.partial(notify_fill_result, account, plan['todo'], None if result["success"] else result["message"],
+                               result["screenshot"], get_dingtalk_webhook(account))
+    await asyncio.get_running_loop().run_in_executor(None, notify)
+    return result
+
+
+async def _fill_all(plans):
+    if not os.path.exists(IMG_LOG_DIR):
+        os.makedirs(IMG_LOG_DIR)
+
+    # 强制移除 DISPLAY 环境变量，防止 Xshell 触发 Xmanager 弹窗
+    if 'DISPLAY' in os.environ:
+        del os.environ['DISPLAY']
+
+    async with async_playwright() as p:
+        browsers = []
+        try:
+            for _ in range(max(1, min(FILL_BROWSERS, len(plans)))):
+                browsers.append(await p.chromium.launch(headless=BROWSER_HEADLESS, args=LAUNCH_ARGS))
+            semaphore = asyncio.Semaphore(max(1, FILL_CONCURRENCY))
+            return await asyncio.gather(*[
+                _fill_one(browsers[i % len(browsers)], account, plan, semaphore)
+                for i, (account, plan) in enumerate(plans.items())
+            ])
+        finally:
+            for browser in browsers:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+
+
+def fill_accounts(plans):
+    """
+    并发填写多个账号的日报
+    :param plans: {账号: 今日计划}
+    :return: 每个账号的结果列表，见 _fill_one；fallback 为 True 的账号尚未通知，需由调用方改用 handler.run 重试
+    """
+    if not plans:
+        return []
+
+    started_at = time.perf_counter()
+    logger.info(f"开始并发填写 {len(plans)} 个账号 (并发数 {FILL_CONCURRENCY}，浏览器 {min(FILL_BROWSERS, len(plans))} 个)")
+    results = asyncio.run(_fill_all(plans))
+
+    succeeded = sum(1 for r in results if r["success"])
+    blocked = [r["blocked"] for r in results if r["blocked"]]
+    logger.info(f"并发填写完成: 成功 {succeeded} / {len(results)}，总耗时 {time.perf_counter() - started_at:.2f}s，"
+                f"拦截 {sum(b['requests'] for b in blocked)} 个请求 (估算 {sum(b['estimated_kb'] for b in blocked)} KB)")
+    for r in results:
+        status = "✅" if r["success"] else ("↩️ 待重试" if r["fallback"] else "❌")
+        logger.info(f"  {status} {r['account']}: {r['message']} ({r['duration']}s)")
+    return results
@@ -0,0 +1,357 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from concurrent.futures import Future
+from playwright.sync_api import sync_playwright
+from config_loader import config
+from accounts import get_user_data_dir
+import route_policy
+from logger import logger
+
+# 常驻浏览器池 (config.yaml 的 browser 段，均可省略)
+# 每个账号的浏览器数据目录对应一个常驻的 Chromium 持久化上下文，由专属线程持有
+# (sync_playwright 的对象只能在创建它的线程中使用)，填报和保活任务提交到该线程执行，
+# 拿到的是已经打开目标页面的标签页，省去每次启动浏览器和加载用户数据的时间
+_browser_config = config.get('browser') or {}
+BROWSER_POOL_ENABLED = bool(_browser_config.get('pool_enabled', True))  # false 时每次任务单独启动浏览器 (原有方式)
+BROWSER_MAX_USES = int(_browser_config.get('max_uses', 20))  # 浏览器执行多少次任务后重启，0 表示不限
+BROWSER_MAX_HEAP_MB = float(_browser_config.get('max_heap_mb', 512))  # 页面 JS 堆超过该值 (MB) 时重启，0 表示不检查
+BROWSER_IDLE_TTL = float(_browser_config.get('idle_ttl_minutes', 30)) * 60  # 空闲超过该时间 (秒) 后关闭浏览器
+BROWSER_PAGE_MAX_AGE = float(_browser_config.get('page_max_age_seconds', 300))  # 预加载的页面超过该时间 (秒) 后交付前先刷新
+BROWSER_HEADLESS = bool(_browser_config.get('headless', True))
+BROWSER_NAV_TIMEOUT_MS = int(_browser_config.get('navigation_timeout_ms', 60000))
+
+TARGET_URL = config['app']['target_url']
+
+# 统一的 User-Agent (模拟 Windows Chrome)
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+LAUNCH_ARGS = [
+    "--start-maximized",
+    "--disable-gpu",
+    "--lang=zh-CN",
+    "--disable-blink-features=AutomationControlled",
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-infobars"
+]
+
+# 浏览器上下文参数 (持久化上下文和普通上下文共用)
+CONTEXT_OPTIONS = {
+    "user_agent": USER_AGENT,
+    "viewport": {'width': 1920, 'height': 1080},
+    "locale": 'zh-CN',            # 设置上下文语言环境
+    "timezone_id": 'Asia/Shanghai'  # 设置时区
+}
+
+# 深度伪装：反检测脚本，模拟真实浏览器特征
+# 1. 隐藏 webdriver 属性
+# 2. 伪装 WebGL 渲染器 (防止被识别为 Headless/SwiftShader)
+# 3. 伪装 Plugins 和 Languages
+STEALTH_JS = """
+    // 隐藏 WebDriver
+    Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
+
+    // 伪装 WebGL
+    const getParameter = WebGLRenderingContext.prototype.getParameter;
+    WebGLRenderingContext.prototype.getParameter = function(parameter) {
+        // 37445: UNMASKED_VENDOR_WEBGL
+        // 37446: UNMASKED_RENDERER_WEBGL
+        if (parameter === 37445) {
+            return 'Intel Inc.';
+        }
+        if (parameter === 37446) {
+            return 'Intel(R) Iris(R) Xe Graphics';
+        }
+        return getParameter.apply(this, [parameter]);
+    };
+
+    // 伪装 Plugins (Headless 默认无插件)
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5],
+    });
+
+    // 伪装 Languages
+    Object.defineProperty(navigator, 'languages', {
+        get: () => ['zh-CN', 'zh', 'en'],
+    });
+
+    // 绕过 Chrome 自动化检测
+    window.chrome = { runtime: {} };
+"""
+
+
+def inject_stealth_scripts(context):
+    """注入反检测脚本 (同步和异步上下文均可)"""
+    return context.add_init_script(STEALTH_JS)
+
+
+def launch_persistent_context(playwright, user_data_dir):
+    """以统一的参数启动持久化上下文并注入反检测脚本"""
+    # 强制移除 DISPLAY 环境变量，防止 Xshell 触发 Xmanager 弹窗
+    if 'DISPLAY' in os.environ:
+        del os.environ['DISPLAY']
+
+    context = playwright.chromium.launch_persistent_context(
+        user_data_dir=user_data_dir,
+        headless=BROWSER_HEADLESS,
+        args=LAUNCH_ARGS,
+        **CONTEXT_OPTIONS
+    )
+    inject_stealth_scripts(context)
+    return context
+
+
+def open_target_page(page):
+    """打开目标页面并等待 DOM 加载完成"""
+    page.goto(TARGET_URL, timeout=BROWSER_NAV_TIMEOUT_MS)
+    page.wait_for_load_state("domcontentloaded")
+
+
+class _BrowserWorker(threading.Thread):
+    """持有一个账号的常驻浏览器，按顺序执行提交的任务"""
+
+    def __init__(self, account):
+        super().__init__(name=f"browser-{account}", daemon=True)
+        self.account = account
+        self.user_data_dir = get_user_data_dir(account)
+        self.tasks = queue.Queue()
+        self._playwright = None
+        self._context = None
+        self._page = None
+        self._page_loaded_at = None
+        self._uses = 0
+        self._crashed = False
+        self._block_stats = None
+        self.stats = {"launches": 0, "recycles": 0, "crashes": 0, "tasks": 0}
+
+    # --- 浏览器生命周期 (只在本线程中调用) ---
+
+    def _launch(self):
+        started_at = time.perf_counter()
+        self._playwright = sync_playwright().start()
+        try:
+            self._context = launch_persistent_context(self._playwright, self.user_data_dir)
+        except Exception:
+            self._playwright.stop()
+            self._playwright = None
+            raise
+        self._context.on("close", lambda _: self._mark_crashed())
+        self._block_stats = route_policy.apply(self._context)
+        self._page = self._context.pages[0] if self._context.pages else self._context.new_page()
+        self._page_loaded_at = None
+        self._uses = 0
+        self._crashed = False
+        self.stats["launches"] += 1
+        logger.info(f"[浏览器池] 账号 {self.account} 的浏览器已启动，耗时 {time.perf_counter() - started_at:.2f}s")
+
+    def _mark_crashed(self):
+        if self._context is not None:
+            self._crashed = True
+
+    def _close(self, reason):
+        context, playwright = self._context, self._playwright
+        self._context = self._page = self._playwright = None
+        if context is not None:
+            try:
+                context.close()
+            except Exception as e:
+                logger.warning(f"[浏览器池] 关闭浏览器时出错 (可能已关闭): {e}")
+        if playwright is not None:
+            try:
+                playwright.stop()
+            except Exception:
+                pass
+        if context is not None:
+            logger.info(f"[浏览器池] 账号 {self.account} 的浏览器已关闭 ({reason})")
+
+    def _is_alive(self):
+        # 浏览器进程退出或断开时持久化上下文会触发 close 事件 (见 _mark_crashed)
+        return self._context is not None and not self._crashed
+
+    def _warm_page(self, force=False):
+        """确保标签页已打开目标页面，超过 BROWSER_PAGE_MAX_AGE 时重新加载"""
+        if self._page is None or self._page.is_closed():
+            self._page = self._context.new_page()
+            self._page_loaded_at = None
+        if not force and self._page_loaded_at is not None and time.monotonic() - self._page_loaded_at < BROWSER_PAGE_MAX_AGE:
+            return
+        open_target_page(self._page)
+        self._page_loaded_at = time.monotonic()
+
+    def _heap_mb(self):
+        try:
+            used = self._page.evaluate("() => (performance.memory && performance.memory.usedJSHeapSize) || 0")
+            return used / 1024 / 1024
+        except Exception:
+            return 0
+
+    def _after_task(self):
+        """任务结束后检查是否需要回收，否则预先打开下一次使用的页面"""
+        if not self._is_alive():
+            self.stats["crashes"] += 1
+            self._close("浏览器已崩溃或被关闭")
+            return
+
+        reason = None
+        if BROWSER_MAX_USES and self._uses >= BROWSER_MAX_USES:
+            reason = f"已使用 {self._uses} 次"
+        elif BROWSER_MAX_HEAP_MB:
+            heap = self._heap_mb()
+            if heap > BROWSER_MAX_HEAP_MB:
+                reason = f"JS 堆 {heap:.0f}MB 超过上限"
+        if reason:
+            self.stats["recycles"] += 1
+            self._close(f"回收: {reason}")
+            return
+
+        try:
+            self._warm_page(force=True)
+        except Exception as e:
+            logger.warning(f"[浏览器池] 预加载页面失败，下次使用时重试: {e}")
+            self._page_loaded_at = None
+
+    def _execute(self, fn, future):
+        """执行任务，fn 为 None 时只启动浏览器并预加载页面"""
+        if not future.set_running_or_notify_cancel():
+            return
+        ran = False
+        try:
+            if not self._is_alive():
+                if self._context is not None:
+                    self.stats["crashes"] += 1
+                    self._close("浏览器已崩溃或被关闭，重新启动")
+                self._launch()
+            self._warm_page()
+            result = None
+            if fn is not None:
+                ran = True
+                self._uses += 1
+                self.stats["tasks"] += 1
+                result = fn(self._context, self._page)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+        # 结果已交给调用方，再检查浏览器状态 (崩溃、回收或预加载下一次的页面)
+        if ran and self._context is not None:
+            # 本次任务 (含任务前预加载页面) 拦截的请求
+            route_policy.log_run(self._block_stats, f"[浏览器池] 账号 {self.account} ")
+            self._after_task()
+
+    def run(self):
+        while True:
+            try:
+                task = self.tasks.get(timeout=BROWSER_IDLE_TTL if BROWSER_IDLE_TTL > 0 else None)
+            except queue.Empty:
+                if _retire(self):
+                    self._close("空闲超时")
+                    return
+                continue
+
+            if task is None:
+                self._close("浏览器池关闭")
+                return
+            fn, future = task
+            self._execute(fn, future)
+
+
+_workers = {}
+_lock = threading.Lock()
+_shutdown = False
+
+
+def _retire(worker):
+    """空闲超时：队列为空时从池中移除该线程，之后的任务会创建新线程"""
+    with _lock:
+        if not worker.tasks.empty():
+            return False
+        if _workers.get(worker.account) is worker:
+            del _workers[worker.account]
+        return True
+
+
+def _run_cold(account, fn):
+    """不使用浏览器池：在当前线程中启动浏览器，执行完后关闭"""
+    with sync_playwright() as p:
+        context = launch_persistent_context(p, get_user_data_dir(account))
+        block_stats = route_policy.apply(context)
+        try:
+            page = context.pages[0] if context.pages else context.new_page()
+            open_target_page(page)
+            return fn(context, page)
+        finally:
+            route_policy.log_run(block_stats, f"账号 {account} ")
+            try:
+                context.close()
+            except Exception as e:
+                logger.warning(f"关闭浏览器时出错 (可能已关闭): {e}")
+
+
+def submit(account, fn):
+    """
+    提交浏览器任务到账号的常驻浏览器线程
+    :param fn: fn(context, page)，page 已打开目标页面，在浏览器线程中执行；为 None 时只预热浏览器
+    :return: concurrent.futures.Future
+    """
+    future = Future()
+    with _lock:
+        if _shutdown:
+            raise RuntimeError("浏览器池已关闭")
+        worker = _workers.get(account)
+        if worker is None:
+            worker = _BrowserWorker(account)
+            _workers[account] = worker
+            worker.start()
+        worker.tasks.put((fn, future))
+    return future
+
+
+def run_in_browser(account, fn, timeout=None):
+    """
+    在账号的浏览器中执行 fn(context, page) 并返回结果 (异常原样抛出)
+    未启用浏览器池时单独启动浏览器执行
+    """
+    if not BROWSER_POOL_ENABLED:
+        return _run_cold(account, fn)
+    return submit(account, fn).result(timeout=timeout)
+
+
+def warm_up(accounts):
+    """预先启动账号的浏览器并打开目标页面 (如定时填报前几分钟)"""
+    if not BROWSER_POOL_ENABLED:
+        return
+    for account in accounts:
+        if os.path.exists(get_user_data_dir(account)):
+            submit(account, None)
+
+
+def get_stats():
+    """获取浏览器池统计信息"""
+    with _lock:
+        return {
+            "enabled": BROWSER_POOL_ENABLED,
+            "browsers": {
+                account: {**worker.stats, "queued": worker.tasks.qsize(), "alive": worker._context is not None}
+                for account, worker in _workers.items()
+            },
+        }
+
+
+def shutdown(timeout=10):
+    """关闭所有常驻浏览器"""
+    global _shutdown
+    with _lock:
+        _shutdown = True
+        workers = list(_workers.values())
+        _workers.clear()
+    for worker in workers:
+        worker.tasks.put(None)
+    for worker in workers:
+        worker.join(timeout)
+
+
+atexit.register(shutdown)
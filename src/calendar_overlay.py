@@ -0,0 +1,181 @@
+import csv
+import os
+import threading
+import time
+import datetime
+import yaml
+from config_loader import config
+from logger import logger
+
+# 公司日历覆盖文件 (config.yaml 的 calendar 段，均可省略)
+# 在法定节假日之外追加公司自己的放假日、调休上班日以及按团队的停工安排
+_calendar_config = config.get('calendar') or {}
+OVERLAY_FILE = _calendar_config.get('overlay_file')  # 相对路径按项目根目录解析
+OVERLAY_CHECK_INTERVAL = float(_calendar_config.get('overlay_check_interval', 5))  # 检查文件修改时间的最小间隔 (秒)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 覆盖类型 -> 是否为工作日
+_DAY_TYPES = {
+    'closure': False,
+    'holiday': False,
+    'off': False,
+    'workday': True,
+    'work': True,
+}
+DEFAULT_CLOSURE_NAME = "公司休息日"
+
+# 当前生效的覆盖数据: { 年份: { 团队 (None 表示全员): { 'YYYY-MM-DD': (是否工作日, 名称) } } }
+_overlay = {}
+_overlay_mtime = None
+_last_check = None  # None 表示尚未加载过
+_reload_lock = threading.Lock()
+
+
+def _resolve_path(path):
+    if os.path.isabs(path):
+        return path
+    return os.path.join(BASE_DIR, path)
+
+
+def _parse_day(value):
+    """YAML 中未加引号的日期会被解析为 date 对象，统一转成 date"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+
+
+def _read_entries(path):
+    """读取覆盖文件中的原始条目 (字典列表)，按扩展名区分 CSV / YAML"""
+    if path.lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            return [row for row in csv.DictReader(f) if any((v or '').strip() for v in row.values())]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = yaml.safe_load(f) or []
+    if isinstance(data, dict):
+        data = data.get('days') or []
+    return data
+
+
+def parse_overlay(path):
+    """
+    解析覆盖文件
+    YAML 格式 (也可直接是列表):
+        days:
+          - date: "2025-12-31"
+            type: closure          # closure 放假 / workday 上班
+            name: "公司年会"        # 可选
+          - start: "2026-02-09"    # 也可以用 start/end 指定一段日期
+            end: "2026-02-13"
+            type: closure
+            team: "backend"        # 可选，只对该团队生效
+    CSV 格式的表头为 date,end,type,name,team (end/name/team 可留空)
+    :return: { 年份: { 团队: { 'YYYY-MM-DD': (是否工作日, 名称) } } }
+    """
+    overlay = {}
+    for i, entry in enumerate(_read_entries(path), 1):
+        try:
+            day_type = str(entry.get('type') or 'closure').strip().lower()
+            if day_type not in _DAY_TYPES:
+                raise ValueError(f"未知的类型 {day_type!r}")
+            is_workday = _DAY_TYPES[day_type]
+
+            start = _parse_day(entry.get('date') or entry.get('start'))
+            end = _parse_day(entry['end']) if entry.get('end') else start
+            if end < start:
+                raise ValueError("结束日期早于开始日期")
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"第 {i} 条覆盖配置无效: {e}") from e
+
+        name = None if is_workday else (str(entry.get('name') or '').strip() or DEFAULT_CLOSURE_NAME)
+        team = str(entry.get('team') or '').strip() or None
+
+        day = start
+        while day <= end:
+            overlay.setdefault(day.year, {}).setdefault(team, {})[day.strftime("%Y-%m-%d")] = (is_workday, name)
+            day += datetime.timedelta(days=1)
+
+    return overlay
+
+
+def _flatten(overlay):
+    return {
+        (team, date): value
+        for teams in overlay.values()
+        for team, days in teams.items()
+        for date, value in days.items()
+    }
+
+
+def _changed_years(old, new):
+    """对比新旧覆盖数据，返回有变化的年份"""
+    old_items, new_items = _flatten(old), _flatten(new)
+    changed = set(old_items.items()) ^ set(new_items.items())
+    return {int(date[:4]) for (_, date), _ in changed}
+
+
+def reload_if_changed(force=False):
+    """
+    覆盖文件的修改时间变化时重新加载 (两次检查之间至少间隔 OVERLAY_CHECK_INTERVAL 秒)
+    解析失败时记录错误并保留原有数据
+    :return: 覆盖数据有变化的年份集合
+    """
+    global _overlay, _overlay_mtime, _last_check
+    if not OVERLAY_FILE:
+        return set()
+
+    now = time.monotonic()
+    if not force and _last_check is not None and now - _last_check < OVERLAY_CHECK_INTERVAL:
+        return set()
+
+    with _reload_lock:
+        first_load = _last_check is None
+        if not force and not first_load and now - _last_check < OVERLAY_CHECK_INTERVAL:
+            return set()
+        _last_check = now
+
+        path = _resolve_path(OVERLAY_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime == _overlay_mtime and not force and not first_load:
+            return set()
+
+        try:
+            new_overlay = parse_overlay(path) if mtime is not None else {}
+        except Exception as e:
+            logger.error(f"公司日历覆盖文件加载失败，继续使用原有数据: {e}")
+            _overlay_mtime = mtime
+            return set()
+
+        changed = _changed_years(_overlay, new_overlay)
+        _overlay = new_overlay
+        _overlay_mtime = mtime
+
+    if mtime is None:
+        logger.warning(f"公司日历覆盖文件不存在: {path}")
+    else:
+        logger.info(f"公司日历覆盖文件已加载: {path}，受影响年份: {sorted(changed) or '无'}")
+    return changed
+
+
+def get_overrides(year, team=None):
+    """
+    获取某年对指定团队生效的覆盖日期 (全员覆盖 + 团队覆盖，团队覆盖优先)
+    :return: { 'YYYY-MM-DD': (是否工作日, 名称) }
+    """
+    teams = _overlay.get(year) or {}
+    overrides = dict(teams.get(None) or {})
+    if team:
+        overrides.update(teams.get(team) or {})
+    return overrides
+
+
+def has_team_overrides(year, team):
+    """该团队在某年是否有单独的覆盖日期 (没有时可直接复用全员索引)"""
+    return bool(team) and bool((_overlay.get(year) or {}).get(team))
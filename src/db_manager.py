@@ -1,18 +1,211 @@
 import sqlite3
 import os
+import json
 import re
+import atexit
+import threading
+from contextlib import contextmanager
 from config_loader import config
+from accounts import DEFAULT_ACCOUNT
 
 # 数据库文件位于项目根目录
 DB_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), config['app'].get('db_file', 'work_plan.db'))
 
-def init_db():
-    """初始化数据库表"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # 创建 work_plans 表
-    cursor.execute('''
+# 数据库连接参数 (从 config.yaml 的 db 段加载，均可省略)
+_db_config = config.get('db') or {}
+DB_SYNCHRONOUS = _db_config.get('synchronous', 'NORMAL')     # WAL 模式下 NORMAL 已足够安全
+DB_BUSY_TIMEOUT_MS = int(_db_config.get('busy_timeout_ms', 5000))  # 遇到写锁时的等待时间
+DB_CACHE_SIZE_KB = int(_db_config.get('cache_size_kb', 8192))      # 每个连接的页缓存大小
+DB_POOL_SIZE = int(_db_config.get('pool_size', 8))                 # 归还后保留复用的空闲连接数
+DB_TOMBSTONE_MAX_ENTRIES = int(_db_config.get('tombstone_max_entries', 5000))  # 每个账号保留的删除记录数，0 表示不清理
+
+# 待办条目的预编译正则 (导入/格式化文本时使用)
+_SEQ_NUMBER_RE = re.compile(r'(?:^|\n)\s*(\d+)\.')   # 行首序号 "1. "，用于计算下一个序号
+_SEQ_PREFIX_RE = re.compile(r'^\d+[\.\、]\s*')       # 行首的 "1. "、"1、"
+_BULLET_PREFIX_RE = re.compile(r'^[-*]\s+')           # 行首的 "- "、"* "
+
+# --- 连接管理 ---
+# 每个线程使用时从空闲池取出一个连接并一直持有 (Web 请求线程、调度线程互不干扰)，
+# Web 请求结束时通过 release_connection 归还 (开发服务器每个请求一个新线程)，空闲池最多保留 DB_POOL_SIZE 个连接；
+# 已借出的连接按线程登记，线程未归还就退出时由下一次借出时关闭，进程退出时统一关闭
+_local = threading.local()
+_idle_connections = []
+_checked_out = {}  # 线程 -> 连接
+_pool_lock = threading.Lock()
+
+# 写入监听器 listener(account, dates)：在事务提交后调用，用于缓存失效等
+# dates 为受影响的日期集合，None 表示该账号的全部日期
+_write_listeners = []
+
+
+def _open_connection():
+    """创建一个新连接并设置 WAL 及相关 PRAGMA"""
+    # isolation_level=None: 由 transaction() 显式控制事务，读操作不持有锁
+    conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={DB_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    # 负数表示以 KiB 为单位
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    # plan_items 依赖 ON DELETE CASCADE 随计划一起删除
+    conn.execute('PRAGMA foreign_keys=ON')
+    return conn
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def _reap_dead_threads():
+    """关闭已退出但没有归还连接的线程持有的连接 (调用方持有 _pool_lock)"""
+    for thread in [t for t in _checked_out if not t.is_alive()]:
+        _close_quietly(_checked_out.pop(thread))
+
+
+def get_connection():
+    """获取当前线程的数据库连接 (没有时优先从空闲池取出，否则新建)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        with _pool_lock:
+            _reap_dead_threads()
+            conn = _idle_connections.pop() if _idle_connections else None
+        if conn is None:
+            conn = _open_connection()
+        _local.conn = conn
+        _local.tx_depth = 0
+        _local.pending_writes = []
+        _local.tx_versions = {}
+        with _pool_lock:
+            _checked_out[threading.current_thread()] = conn
+    return conn
+
+
+def release_connection():
+    """将当前线程的连接归还空闲池 (Web 请求结束时调用)，池已满时关闭"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.tx_depth > 0:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.execute('ROLLBACK')
+    with _pool_lock:
+        _checked_out.pop(threading.current_thread(), None)
+        if len(_idle_connections) < DB_POOL_SIZE:
+            _idle_connections.append(conn)
+            return
+    _close_quietly(conn)
+
+
+def close_connection():
+    """关闭当前线程的数据库连接"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    with _pool_lock:
+        _checked_out.pop(threading.current_thread(), None)
+    conn.close()
+    _local.conn = None
+    _local.tx_depth = 0
+
+
+def close_all_connections():
+    """关闭所有数据库连接 (进程退出时调用)"""
+    with _pool_lock:
+        conns = _idle_connections + list(_checked_out.values())
+        _idle_connections.clear()
+        _checked_out.clear()
+    for conn in conns:
+        _close_quietly(conn)
+    _local.conn = None
+    _local.tx_depth = 0
+
+
+def get_pool_stats():
+    """获取连接池状态"""
+    with _pool_lock:
+        return {"idle": len(_idle_connections), "in_use": len(_checked_out), "pool_size": DB_POOL_SIZE}
+
+
+@contextmanager
+def transaction():
+    """
+    写事务上下文管理器，正常退出时提交，异常时回滚
+    使用 BEGIN IMMEDIATE 提前获取写锁，避免读锁升级为写锁时出现 "database is locked"
+    嵌套调用时并入最外层事务
+    用法:
+        with transaction() as conn:
+            conn.execute(...)
+    """
+    conn = get_connection()
+    if _local.tx_depth > 0:
+        _local.tx_depth += 1
+        try:
+            yield conn
+        finally:
+            _local.tx_depth -= 1
+        return
+
+    conn.execute('BEGIN IMMEDIATE')
+    _local.tx_depth = 1
+    _local.pending_writes = []
+    _local.tx_versions = {}
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        _local.tx_depth = 0
+        _local.tx_versions = {}
+        pending, _local.pending_writes = _local.pending_writes, []
+
+    # 提交成功后再通知，保证监听器看到的是已落盘的数据
+    for account, dates in pending:
+        for listener in _write_listeners:
+            listener(account, dates)
+
+
+def register_write_listener(listener):
+    """
+    注册写入监听器
+    :param listener: 回调 listener(account, dates)，dates 为受影响的日期集合，None 表示账号的全部日期
+    """
+    _write_listeners.append(listener)
+
+
+def _record_write(account, dates):
+    """在当前事务中记录一次写入，提交后通知监听器"""
+    _local.pending_writes.append((account, set(dates) if dates is not None else None))
+
+
+def _tx_version(conn, account):
+    """
+    获取当前事务中账号的变更版本号 (每个写事务只递增一次)
+    本事务写入的计划行和删除记录都标记为该版本，供增量同步使用
+    """
+    if account not in _local.tx_versions:
+        conn.execute('''
+            INSERT INTO change_versions (account, version) VALUES (?, 1)
+            ON CONFLICT (account) DO UPDATE SET version = version + 1
+        ''', (account,))
+        _local.tx_versions[account] = conn.execute(
+            'SELECT version FROM change_versions WHERE account = ?', (account,)
+        ).fetchone()[0]
+    return _local.tx_versions[account]
+
+
+# --- 数据库迁移 ---
+# 每个迁移为 (版本号, 描述, 执行函数)，启动时按版本号顺序执行，已执行的版本记录在 schema_version 表中
+
+def _migrate_create_work_plans(conn):
+    """创建 work_plans 表"""
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS work_plans (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             date TEXT NOT NULL,
@@ -21,9 +214,148 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
-    conn.commit()
-    conn.close()
+
+def _migrate_add_date_index(conn):
+    """按日期查询、范围删除及 ORDER BY date, id 均走索引"""
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_work_plans_date_id ON work_plans (date, id)')
+
+def _migrate_unique_plan_per_day(conn):
+    """每天只保留一条计划：先合并历史上同一天的多条记录，再加唯一索引"""
+    dup_dates = [row[0] for row in conn.execute(
+        'SELECT date FROM work_plans GROUP BY date HAVING COUNT(*) > 1'
+    ).fetchall()]
+
+    for date in dup_dates:
+        rows = conn.execute(
+            'SELECT id, todo, progress FROM work_plans WHERE date = ? ORDER BY id ASC', (date,)
+        ).fetchall()
+        keep_id = rows[0]['id']
+        merged_todo = format_todo_item("\n".join(row['todo'] for row in rows if row['todo']), 1)
+        merged_progress = "\n".join(row['progress'] for row in rows if row['progress'])
+        conn.execute('UPDATE work_plans SET todo = ?, progress = ? WHERE id = ?', (merged_todo, merged_progress, keep_id))
+        conn.execute('DELETE FROM work_plans WHERE date = ? AND id != ?', (date, keep_id))
+
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_work_plans_date ON work_plans (date)')
+
+def _migrate_add_account(conn):
+    """计划按账号隔离：已有计划归属默认账号，唯一约束改为每个账号每天一条"""
+    conn.execute("ALTER TABLE work_plans ADD COLUMN account TEXT NOT NULL DEFAULT ''")
+    conn.execute('UPDATE work_plans SET account = ?', (DEFAULT_ACCOUNT,))
+    conn.execute('DROP INDEX IF EXISTS ux_work_plans_date')
+    conn.execute('DROP INDEX IF EXISTS idx_work_plans_date_id')
+    # 账号内按日期查询/范围删除/排序
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_work_plans_account_date ON work_plans (account, date)')
+    # 定时任务按日期一次取出所有账号的计划
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_work_plans_date_account ON work_plans (date, account)')
+
+def _migrate_create_plan_items(conn):
+    """
+    待办内容拆分为 plan_items (每条一行，按 ordinal 排序)，追加时只需插入新行
+    已有计划的 todo 文本按行导入，导入后 work_plans.todo 不再使用
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS plan_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            plan_id INTEGER NOT NULL REFERENCES work_plans (id) ON DELETE CASCADE,
+            ordinal INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            UNIQUE (plan_id, ordinal)
+        )
+    ''')
+
+    rows = conn.execute("SELECT id, todo FROM work_plans WHERE todo != ''").fetchall()
+    items = []
+    for row in rows:
+        for ordinal, content in enumerate(parse_todo_items(row['todo']), start=1):
+            items.append((row['id'], ordinal, content))
+    conn.executemany('INSERT INTO plan_items (plan_id, ordinal, content) VALUES (?, ?, ?)', items)
+    conn.execute("UPDATE work_plans SET todo = ''")
+
+def _migrate_add_change_versions(conn):
+    """
+    增量同步：每个账号维护单调递增的变更版本号
+    计划行记录最后修改的版本，删除的计划写入 plan_tombstones
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_versions (
+            account TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS plan_tombstones (
+            plan_id INTEGER NOT NULL,
+            account TEXT NOT NULL,
+            date TEXT NOT NULL,
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_plan_tombstones_account_version ON plan_tombstones (account, version)')
+
+    conn.execute('ALTER TABLE work_plans ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_work_plans_account_version ON work_plans (account, version)')
+    # 已有计划视为版本 1
+    conn.execute('UPDATE work_plans SET version = 1')
+    conn.execute('INSERT INTO change_versions (account, version) SELECT DISTINCT account, 1 FROM work_plans')
+
+def _migrate_create_plan_templates(conn):
+    """计划模板库：保存用户确认过的计划及其需求描述，相似需求可直接复用"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS plan_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account TEXT NOT NULL,
+            requirement TEXT NOT NULL,
+            start_date TEXT,
+            end_date TEXT,
+            days_count INTEGER NOT NULL,
+            plans TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_plan_templates_account_requirement ON plan_templates (account, requirement)')
+
+def _migrate_add_pruned_version(conn):
+    """删除记录按账号限量保留：记录已清理到的版本，早于该版本的客户端需要全量同步"""
+    conn.execute('ALTER TABLE change_versions ADD COLUMN pruned_version INTEGER NOT NULL DEFAULT 0')
+
+MIGRATIONS = [
+    (1, '创建 work_plans 表', _migrate_create_work_plans),
+    (2, '添加 (date, id) 索引', _migrate_add_date_index),
+    (3, '每天唯一计划约束', _migrate_unique_plan_per_day),
+    (4, '计划按账号隔离', _migrate_add_account),
+    (5, '待办条目结构化存储', _migrate_create_plan_items),
+    (6, '变更版本与删除记录', _migrate_add_change_versions),
+    (7, '计划模板库', _migrate_create_plan_templates),
+    (8, '删除记录清理版本', _migrate_add_pruned_version),
+]
+
+def get_schema_version():
+    """获取当前数据库结构版本"""
+    row = get_connection().execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def run_migrations():
+    """执行所有尚未执行的迁移，每个迁移在独立事务中完成"""
+    with transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    for version, description, migrate in MIGRATIONS:
+        with transaction() as conn:
+            # 在写锁内重新读取版本，避免多个进程同时启动时重复执行
+            if version <= get_schema_version():
+                continue
+            migrate(conn)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+
+def init_db():
+    """初始化数据库 (执行结构迁移)"""
+    run_migrations()
 
 def get_next_sequence_number(text):
     """
@@ -36,7 +368,7 @@ def get_next_sequence_number(text):
     
     # 匹配行首的数字序号，如 "1. ", "2. "
     # 增加 \s* 以兼容缩进的情况
-    matches = re.findall(r'(?:^|\n)\s*(\d+)\.', text)
+    matches = _SEQ_NUMBER_RE.findall(text)
     if matches:
         numbers = [int(n) for n in matches]
         return max(numbers) + 1
@@ -44,161 +376,435 @@ def get_next_sequence_number(text):
         # 如果没有序号，但有内容，假设它是第1条，返回2
         return 2 if text.strip() else 1
 
-def format_todo_item(todo_text, start_seq=1):
+def parse_todo_items(todo_text):
     """
-    格式化
+    将待办文本拆分为条目列表 (每行一条，去除已有的序号或列表符)
+    例如 "1. xxx\n- yyy" 返回 ["xxx", "yyy"]
     """
-    lines = todo_text.strip().split('\n')
-    formatted_lines = []
-    current_seq = start_seq
-    
-    for line in lines:
+    if not todo_text:
+        return []
+
+    items = []
+    for line in todo_text.strip().split('\n'):
         line = line.strip()
         if not line:
             continue
-            
-        # 清理已有的序号或列表符，以便重新编号
+
         # 去除开头的 "1. ", "1、" 等
-        line = re.sub(r'^\d+[\.\、]\s*', '', line)
+        line = _SEQ_PREFIX_RE.sub('', line)
         # 去除开头的 "- ", "* "
-        line = re.sub(r'^[-*]\s+', '', line)
-        
-        formatted_lines.append(f"{current_seq}. {line}")
-        current_seq += 1
-        
-    return "\n".join(formatted_lines)
+        line = _BULLET_PREFIX_RE.sub('', line)
+        items.append(line)
+
+    return items
+
+def format_todo_item(todo_text, start_seq=1):
+    """
+    格式化
+    """
+    return "\n".join(
+        f"{seq}. {content}" for seq, content in enumerate(parse_todo_items(todo_text), start=start_seq)
+    )
+
+def render_todo(items):
+    """
+    将 plan_items 渲染为待办文本
+    :param items: [(ordinal, content), ...]，按 ordinal 升序
+    """
+    return "\n".join(f"{ordinal}. {content}" for ordinal, content in items)
+
+def _attach_todo(conn, plans):
+    """为计划字典批量填充渲染后的 todo 文本 (按计划 ID 分批查询 plan_items)"""
+    if not plans:
+        return plans
+
+    items_by_plan = {}
+    plan_ids = [plan['id'] for plan in plans]
+    # SQLite 单条语句的参数数量有限，分批查询
+    for start in range(0, len(plan_ids), 500):
+        batch = plan_ids[start:start + 500]
+        placeholders = ','.join('?' * len(batch))
+        for row in conn.execute(
+            f'SELECT plan_id, ordinal, content FROM plan_items WHERE plan_id IN ({placeholders}) ORDER BY plan_id, ordinal',
+            batch
+        ):
+            items_by_plan.setdefault(row['plan_id'], []).append((row['ordinal'], row['content']))
 
-def add_or_update_plan(date, todo, progress, mode='overwrite'):
+    for plan in plans:
+        plan['todo'] = render_todo(items_by_plan.get(plan['id'], []))
+    return plans
+
+def _replace_items(conn, plan_id, todo_text):
+    """用新的待办文本替换计划的全部条目 (序号从 1 开始)"""
+    conn.execute('DELETE FROM plan_items WHERE plan_id = ?', (plan_id,))
+    conn.executemany(
+        'INSERT INTO plan_items (plan_id, ordinal, content) VALUES (?, ?, ?)',
+        [(plan_id, ordinal, content) for ordinal, content in enumerate(parse_todo_items(todo_text), start=1)]
+    )
+
+def _append_items(conn, plan_id, todo_text):
+    """在计划已有条目之后追加新条目 (通过 (plan_id, ordinal) 索引取最大序号，与已有条目数量无关)"""
+    max_ordinal = conn.execute(
+        'SELECT COALESCE(MAX(ordinal), 0) FROM plan_items WHERE plan_id = ?', (plan_id,)
+    ).fetchone()[0]
+    conn.executemany(
+        'INSERT INTO plan_items (plan_id, ordinal, content) VALUES (?, ?, ?)',
+        [(plan_id, ordinal, content) for ordinal, content in enumerate(parse_todo_items(todo_text), start=max_ordinal + 1)]
+    )
+
+# 追加模式下进度按行拼接 (在 SQLite 内完成，无需读出旧内容)
+_APPEND_PROGRESS_SQL = "CASE WHEN work_plans.progress IS NULL OR work_plans.progress = '' THEN excluded.progress ELSE work_plans.progress || char(10) || excluded.progress END"
+
+def _upsert_plan_rows(conn, account, rows, mode):
+    """
+    批量写入计划行 (不含条目)，返回 {date: plan_id}
+    :param rows: [(date, progress), ...]
+    """
+    progress_sql = _APPEND_PROGRESS_SQL if mode == 'append' else 'excluded.progress'
+    version = _tx_version(conn, account)
+    conn.executemany(f'''
+        INSERT INTO work_plans (account, date, todo, progress, version)
+        VALUES (?, ?, '', ?, ?)
+        ON CONFLICT (account, date) DO UPDATE SET progress = {progress_sql}, version = excluded.version
+    ''', [(account, date, progress, version) for date, progress in rows])
+
+    dates = [date for date, _ in rows]
+    return {
+        row['date']: row['id']
+        for row in conn.execute(
+            'SELECT id, date FROM work_plans WHERE account = ? AND date >= ? AND date <= ?',
+            (account, min(dates), max(dates))
+        )
+    }
+
+def add_or_update_plan(date, todo, progress, mode='overwrite', account=DEFAULT_ACCOUNT):
     """
     添加或更新计划
     :param mode: 'overwrite' (覆盖/新增) 或 'append' (追加)
+    :param account: 计划所属账号
     """
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # 查询当天是否已有记录
-    cursor.execute('SELECT id, todo, progress FROM work_plans WHERE date = ? ORDER BY id ASC LIMIT 1', (date,))
-    row = cursor.fetchone()
-    
-    if row:
-        plan_id, old_todo, old_progress = row
-        
+    if mode not in ('overwrite', 'append'):
+        raise ValueError(f"无效的保存模式: {mode}")
+
+    with transaction() as conn:
+        plan_id = _upsert_plan_rows(conn, account, [(date, progress)], mode)[date]
         if mode == 'overwrite':
-            # 覆盖模式：直接更新
-            formatted_todo = format_todo_item(todo, 1)
-            cursor.execute('''
-                UPDATE work_plans 
-                SET todo = ?, progress = ?
-                WHERE id = ?
-            ''', (formatted_todo, progress, plan_id))
-            
-            # 删除多余记录
-            cursor.execute('DELETE FROM work_plans WHERE date = ? AND id != ?', (date, plan_id))
-            
-        elif mode == 'append':
-            # 追加模式
-            next_seq = get_next_sequence_number(old_todo)
-            
-            # 格式化新内容，使其序号接续
-            formatted_new_todo = format_todo_item(todo, next_seq)
-            
-            # 确保换行追加
-            new_todo = f"{old_todo}\n{formatted_new_todo}"
-            new_progress = f"{old_progress}\n{progress}" if old_progress else progress
-            
-            cursor.execute('''
-                UPDATE work_plans 
-                SET todo = ?, progress = ?
-                WHERE id = ?
-            ''', (new_todo, new_progress, plan_id))
-            
-    else:
-        # 没有记录，直接新增
-        formatted_todo = format_todo_item(todo, 1)
-        cursor.execute('''
-            INSERT INTO work_plans (date, todo, progress)
-            VALUES (?, ?, ?)
-        ''', (date, formatted_todo, progress))
-        
-    conn.commit()
-    conn.close()
+            # 覆盖模式：替换全部条目
+            _replace_items(conn, plan_id, todo)
+        else:
+            # 追加模式：序号接续已有条目
+            _append_items(conn, plan_id, todo)
+        _record_write(account, [date])
 
-def clear_plans_by_date_range(start_date, end_date):
-    """清除指定日期范围内的所有计划"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM work_plans WHERE date >= ? AND date <= ?', (start_date, end_date))
-    
-    conn.commit()
-    conn.close()
+def save_plans_bulk(plans, mode='overwrite', start_date=None, end_date=None, account=DEFAULT_ACCOUNT):
+    """
+    在一个事务中批量保存计划，失败时整体回滚
+    :param plans: [{"date": ..., "todo": ..., "progress": ...}, ...]
+    :param mode: 'overwrite' (覆盖/新增) 或 'append' (追加)
+    :param start_date: 覆盖模式下，如同时提供 start_date/end_date，先在同一事务内清除该范围的旧计划
+    :param account: 计划所属账号
+    :return: 写入的天数
+    """
+    if not plans:
+        return 0
+    if mode not in ('overwrite', 'append'):
+        raise ValueError(f"无效的保存模式: {mode}")
 
-def clear_all_plans():
-    """清除所有计划"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM work_plans')
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        if mode == 'overwrite':
+            if start_date and end_date:
+                _delete_range(conn, account, start_date, end_date)
 
-def get_plans_by_date(date):
-    """获取指定日期的所有计划"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+            # 同一批次中同一天出现多次时，以最后一条为准 (与逐条覆盖的行为一致)
+            latest = {item['date']: item for item in plans}
+            plan_ids = _upsert_plan_rows(conn, account, [(date, item['progress']) for date, item in latest.items()], mode)
+
+            conn.executemany('DELETE FROM plan_items WHERE plan_id = ?', [(plan_ids[date],) for date in latest])
+            items = []
+            for date, item in latest.items():
+                for ordinal, content in enumerate(parse_todo_items(item['todo']), start=1):
+                    items.append((plan_ids[date], ordinal, content))
+            saved_dates = latest
+
+        else:
+            # 进度按批次顺序逐条拼接，同一天出现多次时依次追加
+            plan_ids = _upsert_plan_rows(conn, account, [(item['date'], item['progress']) for item in plans], mode)
+
+            # 一次查询取出各计划当前的最大序号
+            ids = list(set(plan_ids[item['date']] for item in plans))
+            next_ordinal = {plan_id: 1 for plan_id in ids}
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                for row in conn.execute(
+                    f'SELECT plan_id, MAX(ordinal) FROM plan_items WHERE plan_id IN ({placeholders}) GROUP BY plan_id', batch
+                ):
+                    next_ordinal[row[0]] = row[1] + 1
+
+            items = []
+            for item in plans:
+                plan_id = plan_ids[item['date']]
+                for content in parse_todo_items(item['todo']):
+                    items.append((plan_id, next_ordinal[plan_id], content))
+                    next_ordinal[plan_id] += 1
+            saved_dates = set(item['date'] for item in plans)
+
+        conn.executemany('INSERT INTO plan_items (plan_id, ordinal, content) VALUES (?, ?, ?)', items)
+        _record_write(account, saved_dates)
+
+    return len(saved_dates)
+
+def _prune_tombstones(conn, account):
+    """
+    在当前事务中清理账号最早的删除记录，只保留最近 DB_TOMBSTONE_MAX_ENTRIES 条
+    被清理的版本记为 pruned_version，since 早于它的增量同步请求需要全量重新加载
+    """
+    if DB_TOMBSTONE_MAX_ENTRIES <= 0:
+        return
+    row = conn.execute('''
+        SELECT version FROM plan_tombstones WHERE account = ?
+        ORDER BY version DESC LIMIT 1 OFFSET ?
+    ''', (account, DB_TOMBSTONE_MAX_ENTRIES)).fetchone()
+    if row is None:
+        return
+    conn.execute('DELETE FROM plan_tombstones WHERE account = ? AND version <= ?', (account, row[0]))
+    conn.execute('UPDATE change_versions SET pruned_version = MAX(pruned_version, ?) WHERE account = ?', (row[0], account))
+
+def _delete_range(conn, account, start_date, end_date):
+    """在当前事务中删除账号在日期范围内的计划，并记录实际被删除的日期"""
+    deleted_dates = [row[0] for row in conn.execute(
+        'SELECT date FROM work_plans WHERE account = ? AND date >= ? AND date <= ?', (account, start_date, end_date)
+    )]
+    if deleted_dates:
+        conn.execute('''
+            INSERT INTO plan_tombstones (plan_id, account, date, version)
+            SELECT id, account, date, ? FROM work_plans WHERE account = ? AND date >= ? AND date <= ?
+        ''', (_tx_version(conn, account), account, start_date, end_date))
+        _prune_tombstones(conn, account)
+        conn.execute('DELETE FROM work_plans WHERE account = ? AND date >= ? AND date <= ?', (account, start_date, end_date))
+        _record_write(account, deleted_dates)
+
+def clear_plans_by_date_range(start_date, end_date, account=DEFAULT_ACCOUNT):
+    """清除账号在指定日期范围内的所有计划"""
+    with transaction() as conn:
+        _delete_range(conn, account, start_date, end_date)
+
+def clear_all_plans(account=DEFAULT_ACCOUNT):
+    """清除账号的所有计划"""
+    with transaction() as conn:
+        conn.execute('''
+            INSERT INTO plan_tombstones (plan_id, account, date, version)
+            SELECT id, account, date, ? FROM work_plans WHERE account = ?
+        ''', (_tx_version(conn, account), account))
+        _prune_tombstones(conn, account)
+        conn.execute('DELETE FROM work_plans WHERE account = ?', (account,))
+        _record_write(account, None)
+
+def get_plans_by_date(date, account=DEFAULT_ACCOUNT):
+    """获取账号在指定日期的所有计划"""
+    rows = get_connection().execute('''
         SELECT * FROM work_plans 
-        WHERE date = ? 
+        WHERE account = ? AND date = ? 
         ORDER BY id ASC
-    ''', (date,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
-    return [dict(row) for row in rows]
+    ''', (account, date)).fetchall()
 
-def get_all_plans():
-    """获取所有计划，按日期排序"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+    return _attach_todo(get_connection(), [dict(row) for row in rows])
+
+def get_plans_for_all_accounts(date):
+    """
+    一次查询取出所有账号在指定日期的计划 (定时任务批量填报使用)
+    :return: { account: plan }
+    """
+    conn = get_connection()
+    rows = conn.execute(
+        'SELECT * FROM work_plans WHERE date = ?', (date,)
+    ).fetchall()
+
+    return {plan['account']: plan for plan in _attach_todo(conn, [dict(row) for row in rows])}
+
+def get_all_plans(account=DEFAULT_ACCOUNT):
+    """获取账号的所有计划，按日期排序"""
+    rows = get_connection().execute('''
         SELECT * FROM work_plans 
+        WHERE account = ?
         ORDER BY date ASC, id ASC
-    ''')
-    
-    rows = cursor.fetchall()
-    conn.close()
-    
+    ''', (account,)).fetchall()
+
+    return _attach_todo(get_connection(), [dict(row) for row in rows])
+
+def get_plans_page(start_date, end_date, after=None, limit=100, account=DEFAULT_ACCOUNT):
+    """
+    按日期范围分页获取账号的计划 (基于 (date, id) 的游标分页，走索引，不使用 OFFSET)
+    :param after: 上一页最后一条的 (date, id)，为 None 时从头开始
+    :param limit: 每页条数
+    :return: (计划列表, 是否还有下一页)
+    """
+    if after:
+        rows = get_connection().execute('''
+            SELECT * FROM work_plans
+            WHERE account = ? AND date >= ? AND date <= ? AND (date, id) > (?, ?)
+            ORDER BY date ASC, id ASC
+            LIMIT ?
+        ''', (account, start_date, end_date, after[0], after[1], limit + 1)).fetchall()
+    else:
+        rows = get_connection().execute('''
+            SELECT * FROM work_plans
+            WHERE account = ? AND date >= ? AND date <= ?
+            ORDER BY date ASC, id ASC
+            LIMIT ?
+        ''', (account, start_date, end_date, limit + 1)).fetchall()
+
+    has_more = len(rows) > limit
+    return _attach_todo(get_connection(), [dict(row) for row in rows[:limit]]), has_more
+
+def iter_plans(start_date=None, end_date=None, batch_size=500, account=DEFAULT_ACCOUNT):
+    """
+    逐批迭代账号的计划 (用于导出等大结果集场景，不一次性加载到内存)
+    :param start_date: 开始日期，为 None 时不限
+    :param end_date: 结束日期，为 None 时不限
+    """
+    cursor = get_connection().execute('''
+        SELECT * FROM work_plans
+        WHERE account = ? AND date >= ? AND date <= ?
+        ORDER BY date ASC, id ASC
+    ''', (account, start_date or '', end_date or '9999-12-31'))
+
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from _attach_todo(get_connection(), [dict(row) for row in rows])
+    finally:
+        cursor.close()
+
+def update_plan(plan_id, todo, progress, account=DEFAULT_ACCOUNT):
+    """
+    更新账号下指定 ID 的计划
+    :return: 是否找到并更新了该计划
+    """
+    with transaction() as conn:
+        row = conn.execute('SELECT date FROM work_plans WHERE id = ? AND account = ?', (plan_id, account)).fetchone()
+        if not row:
+            return False
+        conn.execute('''
+            UPDATE work_plans 
+            SET progress = ?, version = ?
+            WHERE id = ?
+        ''', (progress, _tx_version(conn, account), plan_id))
+        _replace_items(conn, plan_id, todo)
+        _record_write(account, [row['date']])
+        return True
+
+def delete_plan(plan_id, account=DEFAULT_ACCOUNT):
+    """
+    删除账号下指定 ID 的计划
+    :return: 是否找到并删除了该计划
+    """
+    with transaction() as conn:
+        row = conn.execute('SELECT date FROM work_plans WHERE id = ? AND account = ?', (plan_id, account)).fetchone()
+        if not row:
+            return False
+        conn.execute(
+            'INSERT INTO plan_tombstones (plan_id, account, date, version) VALUES (?, ?, ?, ?)',
+            (plan_id, account, row['date'], _tx_version(conn, account))
+        )
+        _prune_tombstones(conn, account)
+        conn.execute('DELETE FROM work_plans WHERE id = ?', (plan_id,))
+        _record_write(account, [row['date']])
+        return True
+
+def get_change_version(account=DEFAULT_ACCOUNT):
+    """获取账号当前的变更版本号 (没有任何写入时为 0)"""
+    row = get_connection().execute('SELECT version FROM change_versions WHERE account = ?', (account,)).fetchone()
+    return row[0] if row else 0
+
+def get_pruned_version(account=DEFAULT_ACCOUNT):
+    """获取账号删除记录已清理到的版本号，since 早于该版本时增量变更不完整"""
+    row = get_connection().execute('SELECT pruned_version FROM change_versions WHERE account = ?', (account,)).fetchone()
+    return row[0] if row else 0
+
+def get_changes_since(since, start_date=None, end_date=None, account=DEFAULT_ACCOUNT):
+    """
+    获取账号在某版本之后的增量变更
+    :param since: 客户端已同步到的版本号
+    :param start_date: 可选，只返回该日期范围内的变更
+    :return: {"version": 当前版本, "upserted": [计划...], "deleted": [计划ID...]}
+    """
+    conn = get_connection()
+    # 先读版本号再读变更：之后发生的写入版本一定更大，下次同步时会被取到
+    version = get_change_version(account)
+    start_date, end_date = start_date or '', end_date or '9999-12-31'
+
+    upserted = [dict(row) for row in conn.execute('''
+        SELECT * FROM work_plans
+        WHERE account = ? AND version > ? AND date >= ? AND date <= ?
+        ORDER BY date ASC, id ASC
+    ''', (account, since, start_date, end_date))]
+    deleted = [row[0] for row in conn.execute('''
+        SELECT plan_id FROM plan_tombstones
+        WHERE account = ? AND version > ? AND date >= ? AND date <= ?
+    ''', (account, since, start_date, end_date))]
+
+    return {
+        "version": version,
+        "upserted": _attach_todo(conn, upserted),
+        "deleted": deleted,
+    }
+
+# --- 计划模板 ---
+
+def save_plan_template(requirement, plans, start_date=None, end_date=None, max_entries=None, account=DEFAULT_ACCOUNT):
+    """
+    保存计划模板，同一账号相同的需求描述只保留最新的一份
+    :param plans: [{"date": ..., "todo": ..., "progress": ...}, ...]，按日期排序后保存
+    :param max_entries: 账号的模板数上限，超出时删除最早的模板
+    :return: 模板 ID
+    """
+    plans = sorted(({"date": p['date'], "todo": p['todo'], "progress": p.get('progress') or ''} for p in plans),
+                   key=lambda p: p['date'])
+    with transaction() as conn:
+        conn.execute('DELETE FROM plan_templates WHERE account = ? AND requirement = ?', (account, requirement))
+        cursor = conn.execute('''
+            INSERT INTO plan_templates (account, requirement, start_date, end_date, days_count, plans)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (account, requirement, start_date, end_date, len(plans), json.dumps(plans, ensure_ascii=False)))
+        if max_entries:
+            conn.execute('''
+                DELETE FROM plan_templates WHERE account = ? AND id NOT IN (
+                    SELECT id FROM plan_templates WHERE account = ? ORDER BY id DESC LIMIT ?
+                )
+            ''', (account, account, max_entries))
+        return cursor.lastrowid
+
+def get_plan_templates(account=DEFAULT_ACCOUNT):
+    """获取账号的所有模板 (不含计划内容)，按 ID 排序"""
+    rows = get_connection().execute('''
+        SELECT id, requirement, start_date, end_date, days_count, created_at
+        FROM plan_templates WHERE account = ? ORDER BY id ASC
+    ''', (account,)).fetchall()
     return [dict(row) for row in rows]
 
-def update_plan(plan_id, todo, progress):
-    """更新指定 ID 的计划"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE work_plans 
-        SET todo = ?, progress = ?
-        WHERE id = ?
-    ''', (todo, progress, plan_id))
-    
-    conn.commit()
-    conn.close()
+def get_plan_template(template_id, account=DEFAULT_ACCOUNT):
+    """获取账号下指定 ID 的模板 (含计划内容)，不存在时返回 None"""
+    row = get_connection().execute(
+        'SELECT * FROM plan_templates WHERE id = ? AND account = ?', (template_id, account)
+    ).fetchone()
+    if not row:
+        return None
+    template = dict(row)
+    template['plans'] = json.loads(template['plans'])
+    return template
 
-def delete_plan(plan_id):
-    """删除指定 ID 的计划"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('DELETE FROM work_plans WHERE id = ?', (plan_id,))
-    
-    conn.commit()
-    conn.close()
+def delete_plan_template(template_id, account=DEFAULT_ACCOUNT):
+    """
+    删除账号下指定 ID 的模板
+    :return: 是否找到并删除了该模板
+    """
+    with transaction() as conn:
+        cursor = conn.execute('DELETE FROM plan_templates WHERE id = ? AND account = ?', (template_id, account))
+        return cursor.rowcount > 0
 
 # 初始化数据库
-init_db()
\ No newline at end of file
+init_db()
+atexit.register(close_all_connections)
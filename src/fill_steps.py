@@ -0,0 +1,288 @@
+import re
+import time
+import random
+import asyncio
+from config_loader import config
+from logger import logger
+import http_replay
+
+# 日报填写流程 (config.yaml 的 fill 段，均可省略)
+# 填写过程拆成一组步骤，每步等待具体的条件 (元素可见、iframe 网络空闲、输入框的值已确认)，不再使用固定的 sleep
+_fill_config = config.get('fill') or {}
+STEP_TIMEOUT_MS = int(_fill_config.get('step_timeout_ms', 10000))  # 每步的默认超时
+STEP_TIMEOUTS = dict(_fill_config.get('step_timeouts') or {})  # 按步骤名单独设置超时，如 {"submit": 20000}
+FRAME_IDLE_TIMEOUT_MS = int(_fill_config.get('frame_idle_timeout_ms', 5000))  # 等待 iframe 网络空闲的上限，超时后继续按元素等待
+SUBMIT_URL_PATTERN = _fill_config.get('submit_url_pattern')  # 提交请求地址的正则 (可选)，设置后地址不匹配的请求不视为提交
+VALUE_POLL_INTERVAL = 0.05  # 确认输入框的值时的轮询间隔 (秒)
+
+# 拟人化节奏 (默认关闭)：每步之间随机停顿 step_delay_ms 毫秒，保活时的鼠标移动和停留
+_pacing_config = _fill_config.get('pacing') or {}
+PACING_STEP_DELAY_MS = tuple(_pacing_config.get('step_delay_ms') or (0, 0))  # [最小, 最大]
+PACING_MOUSE_MOVES = int(_pacing_config.get('mouse_moves', 5))  # 保活时的鼠标移动次数
+PACING_MOUSE_DELAY_MS = tuple(_pacing_config.get('mouse_delay_ms') or (100, 300))  # 每次鼠标移动后的停顿
+PACING_DWELL_SECONDS = float(_pacing_config.get('keep_alive_dwell_seconds', 0))  # 保活时在页面上额外停留的时间
+
+FRAME_SELECTOR = "#wiki-notable-iframe"
+
+
+class FillStepError(RuntimeError):
+    """某一步填写失败，step 为失败的步骤"""
+
+    def __init__(self, step, error):
+        super().__init__(f"步骤“{step.description}”失败: {error}")
+        self.step = step
+
+
+class FillStep:
+    """
+    填写流程中的一步
+    :param locate: locate(iframe) -> Locator，iframe 为表单所在 iframe 的 FrameLocator
+    :param action: 'click' / 'fill' (清空后填写，并确认输入框的值) / 'submit' (点击后等待提交请求完成且表单关闭)
+    :param value_key: fill 时从 values 中取值的键
+    """
+
+    def __init__(self, name, description, locate, action, value_key=None):
+        self.name = name
+        self.description = description
+        self.locate = locate
+        self.action = action
+        self.value_key = value_key
+
+    @property
+    def timeout(self):
+        return int(STEP_TIMEOUTS.get(self.name, STEP_TIMEOUT_MS))
+
+
+# 默认的填写步骤 (定位器的构造在同步和异步 API 中相同)
+FILL_STEPS = [
+    FillStep('open_form', '点击“添加记录”按钮',
+             lambda iframe: iframe.get_by_role("button", name="添加记录"), 'click'),
+    FillStep('select_status', '选择“需支持”',
+             lambda iframe: iframe.locator("div").filter(has_text=re.compile(r"^需支持$")), 'click'),
+    FillStep('fill_todo', '填写今日内容',
+             lambda iframe: iframe.get_by_role("textbox").nth(4), 'fill', 'todo'),
+    FillStep('fill_progress', '填写迭代事项',
+             lambda iframe: iframe.get_by_role("textbox").nth(5), 'fill', 'progress'),
+    FillStep('submit', '提交记录',
+             lambda iframe: iframe.locator(".sc-1gu97lr-4 > button:nth-child(6)"), 'submit'),
+]
+
+# 读取输入框当前的值 (input/textarea 取 value，富文本取 innerText)
+_READ_VALUE_JS = "el => (el.value !== undefined ? el.value : el.innerText) || ''"
+
+
+def _normalize(text):
+    # 富文本编辑器会改变换行和空白，比较时忽略所有空白
+    return re.sub(r'\s+', '', text or '')
+
+
+def pacing_delay():
+    """拟人化节奏：步骤之间的随机停顿 (秒)，未配置时为 0"""
+    low, high = PACING_STEP_DELAY_MS
+    return random.uniform(low, high) / 1000 if high > 0 else 0
+
+
+def _is_submit_request(request, frame, values):
+    """
+    表单所在 iframe 发出的、请求体中包含本次填写的全部内容的写请求视为提交请求
+    (同一 iframe 中的埋点、草稿保存等请求不会被误认)；配置了 submit_url_pattern 时地址还需匹配
+    """
+    if request.method not in ('POST', 'PUT', 'PATCH') or request.frame != frame:
+        return False
+    if SUBMIT_URL_PATTERN and not re.search(SUBMIT_URL_PATTERN, request.url):
+        return False
+    try:
+        body = request.post_data
+    except Exception:
+        # 二进制请求体无法按文本解码
+        return False
+    return bool(body) and http_replay.find_encoding(body, values) is not None
+
+
+def _submit_failed(status):
+    return RuntimeError(f"提交请求已完成 (HTTP {status})，但表单未关闭，请人工确认是否提交成功")
+
+
+def get_form_frame(page, timeout=STEP_TIMEOUT_MS):
+    """获取表单所在 iframe 的 Frame 对象"""
+    return page.locator(FRAME_SELECTOR).element_handle(timeout=timeout).content_frame()
+
+
+def wait_frame_idle(page):
+    """等待表单 iframe 网络空闲 (页面刚打开或刚跳转时)，超时不视为失败"""
+    try:
+        get_form_frame(page).wait_for_load_state("networkidle", timeout=FRAME_IDLE_TIMEOUT_MS)
+    except Exception as e:
+        logger.debug(f"等待 iframe 网络空闲超时，继续按元素等待: {e}")
+
+
+def _wait_value(locator, expected, timeout_ms):
+    """轮询直到输入框的值与预期一致"""
+    deadline = time.monotonic() + timeout_ms / 1000
+    expected = _normalize(expected)
+    while True:
+        actual = _normalize(locator.evaluate(_READ_VALUE_JS))
+        if actual == expected:
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"输入框的值未能确认 (期望 {len(expected)} 字，实际 {len(actual)} 字)")
+        time.sleep(VALUE_POLL_INTERVAL)
+
+
+def _run_step(page, iframe, step, values):
+    locator = step.locate(iframe)
+    locator.wait_for(state="visible", timeout=step.timeout)
+
+    if step.action == 'click':
+        locator.click(timeout=step.timeout)
+    elif step.action == 'fill':
+        value = values[step.value_key]
+        # fill 会先清空原有内容；再确认输入框中的值确实是要填写的内容
+        locator.fill(value, timeout=step.timeout)
+        _wait_value(locator, value, step.timeout)
+    elif step.action == 'submit':
+        frame = get_form_frame(page, step.timeout)
+        try:
+            with page.expect_response(lambda resp: _is_submit_request(resp.request, frame, values),
+                                      timeout=step.timeout) as info:
+                locator.click(timeout=step.timeout)
+            response = info.value
+        except Exception as e:
+            # 没有捕获到提交请求时，以表单关闭 (提交按钮消失) 作为提交完成的依据
+            try:
+                locator.wait_for(state="hidden", timeout=FRAME_IDLE_TIMEOUT_MS)
+            except Exception:
+                raise e
+            logger.warning("未捕获到提交请求，表单已关闭，视为提交完成")
+            return None
+        if response.status >= 400:
+            raise RuntimeError(f"提交失败: HTTP {response.status}")
+        # 请求成功后再确认表单已关闭 (提交按钮消失)，前端校验失败或提交未生效时表单会保持打开
+        try:
+            locator.wait_for(state="hidden", timeout=step.timeout)
+        except Exception as e:
+            raise _submit_failed(response.status) from e
+        return response
+    else:
+        raise ValueError(f"未知的步骤动作: {step.action}")
+
+
+def run_fill_steps(page, values, steps=None, progress=None, on_submit=None):
+    """
+    在已打开目标页面的 page 上执行填写步骤
+    :param values: {"todo": ..., "progress": ...}
+    :param progress: 可选的字典，执行每一步前写入 progress["step"] = 步骤名，便于超时后判断停在哪一步
+    :param on_submit: 可选的回调 on_submit(response)，捕获到提交请求的响应后调用 (如录制提交请求)
+    :return: 各步骤耗时 {步骤名: 秒}
+    :raises: 某一步超时或失败时抛出异常，异常信息包含步骤描述
+    """
+    iframe = page.frame_locator(FRAME_SELECTOR)
+    wait_frame_idle(page)
+
+    timings = {}
+    for step in steps or FILL_STEPS:
+        delay = pacing_delay()
+        if delay:
+            time.sleep(delay)
+        if progress is not None:
+            progress["step"] = step.name
+        started_at = time.perf_counter()
+        try:
+            response = _run_step(page, iframe, step, values)
+        except Exception as e:
+            raise FillStepError(step, e) from e
+        if response is not None and on_submit is not None:
+            on_submit(response)
+        timings[step.name] = round(time.perf_counter() - started_at, 3)
+        logger.info(f"{step.description} 完成，耗时 {timings[step.name]:.2f}s")
+    return timings
+
+
+# --- 异步版本 (playwright.async_api)，步骤定义与同步版本相同 ---
+
+async def get_form_frame_async(page, timeout=STEP_TIMEOUT_MS):
+    handle = await page.locator(FRAME_SELECTOR).element_handle(timeout=timeout)
+    return await handle.content_frame()
+
+
+async def wait_frame_idle_async(page):
+    try:
+        frame = await get_form_frame_async(page)
+        await frame.wait_for_load_state("networkidle", timeout=FRAME_IDLE_TIMEOUT_MS)
+    except Exception as e:
+        logger.debug(f"等待 iframe 网络空闲超时，继续按元素等待: {e}")
+
+
+async def _wait_value_async(locator, expected, timeout_ms):
+    deadline = time.monotonic() + timeout_ms / 1000
+    expected = _normalize(expected)
+    while True:
+        actual = _normalize(await locator.evaluate(_READ_VALUE_JS))
+        if actual == expected:
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"输入框的值未能确认 (期望 {len(expected)} 字，实际 {len(actual)} 字)")
+        await asyncio.sleep(VALUE_POLL_INTERVAL)
+
+
+async def _run_step_async(page, iframe, step, values):
+    locator = step.locate(iframe)
+    await locator.wait_for(state="visible", timeout=step.timeout)
+
+    if step.action == 'click':
+        await locator.click(timeout=step.timeout)
+    elif step.action == 'fill':
+        value = values[step.value_key]
+        await locator.fill(value, timeout=step.timeout)
+        await _wait_value_async(locator, value, step.timeout)
+    elif step.action == 'submit':
+        frame = await get_form_frame_async(page, step.timeout)
+        try:
+            async with page.expect_response(lambda resp: _is_submit_request(resp.request, frame, values),
+                                            timeout=step.timeout) as info:
+                await locator.click(timeout=step.timeout)
+            response = await info.value
+        except Exception as e:
+            try:
+                await locator.wait_for(state="hidden", timeout=FRAME_IDLE_TIMEOUT_MS)
+            except Exception:
+                raise e
+            logger.warning("未捕获到提交请求，表单已关闭，视为提交完成")
+            return None
+        if response.status >= 400:
+            raise RuntimeError(f"提交失败: HTTP {response.status}")
+        try:
+            await locator.wait_for(state="hidden", timeout=step.timeout)
+        except Exception as e:
+            raise _submit_failed(response.status) from e
+        return response
+    else:
+        raise ValueError(f"未知的步骤动作: {step.action}")
+
+
+async def run_fill_steps_async(page, values, steps=None, label='', progress=None, on_submit=None):
+    """
+    run_fill_steps 的异步版本
+    :param label: 日志前缀 (如账号名)，多个账号并发填写时区分日志
+    :param on_submit: 可选的协程函数 on_submit(response)
+    """
+    iframe = page.frame_locator(FRAME_SELECTOR)
+    await wait_frame_idle_async(page)
+
+    timings = {}
+    for step in steps or FILL_STEPS:
+        delay = pacing_delay()
+        if delay:
+            await asyncio.sleep(delay)
+        if progress is not None:
+            progress["step"] = step.name
+        started_at = time.perf_counter()
+        try:
+            response = await _run_step_async(page, iframe, step, values)
+        except Exception as e:
+            raise FillStepError(step, e) from e
+        if response is not None and on_submit is not None:
+            await on_submit(response)
+        timings[step.name] = round(time.perf_counter() - started_at, 3)
+        logger.info(f"{label}{step.description} 完成，耗时 {timings[step.name]:.2f}s")
+    return timings
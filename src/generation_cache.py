@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from config_loader import config
+from logger import logger
+
+# AI 生成结果的磁盘缓存 (config.yaml 的 cache 段，均可省略)
+# 以 (模型, 服务地址, 系统提示词, 用户提示词, 工作日列表, temperature) 的 sha256 作为文件名，相同请求直接返回上次的结果
+_cache_config = config.get('cache') or {}
+GENERATION_CACHE_DIR = _cache_config.get('generation_dir', 'cache/generations')  # 相对路径按项目根目录解析
+GENERATION_CACHE_TTL = float(_cache_config.get('generation_ttl_hours', 168)) * 3600  # 过期时间 (秒)，0 表示禁用缓存
+GENERATION_CACHE_MAX_BYTES = int(float(_cache_config.get('generation_max_mb', 50)) * 1024 * 1024)  # 总大小上限
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = GENERATION_CACHE_DIR if os.path.isabs(GENERATION_CACHE_DIR) else os.path.join(BASE_DIR, GENERATION_CACHE_DIR)
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evictions": 0}
+
+# 缓存文件索引 { key: (最近访问时间, 文件大小) }，首次使用时扫描目录构建
+_index = None
+_total_bytes = 0
+
+
+def make_key(model, base_url, system_prompt, prompt, workdays, temperature):
+    """计算缓存键 (sha256 十六进制串)，base_url 参与计算，切换到 mock 或备用服务时不会命中正式服务的结果"""
+    payload = json.dumps([model, base_url, system_prompt, prompt, list(workdays), temperature], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _path(key):
+    # 按前两位分目录，避免单个目录下文件过多
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.json")
+
+
+def _load_index():
+    """扫描缓存目录构建索引 (调用方持有 _lock)"""
+    global _index, _total_bytes
+    if _index is not None:
+        return
+    _index = {}
+    _total_bytes = 0
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for sub in os.listdir(CACHE_DIR):
+        sub_dir = os.path.join(CACHE_DIR, sub)
+        if not os.path.isdir(sub_dir):
+            continue
+        for name in os.listdir(sub_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(os.path.join(sub_dir, name))
+            except OSError:
+                continue
+            _index[name[:-5]] = (st.st_mtime, st.st_size)
+            _total_bytes += st.st_size
+
+
+def _remove(key):
+    """删除缓存文件并更新索引 (调用方持有 _lock)"""
+    global _total_bytes
+    _, size = _index.pop(key, (0, 0))
+    _total_bytes -= size
+    try:
+        os.remove(_path(key))
+    except OSError:
+        pass
+
+
+def get(key):
+    """
+    读取缓存
+    :return: 缓存的值，不存在或已过期时返回 None
+    """
+    if GENERATION_CACHE_TTL <= 0:
+        return None
+
+    with _lock:
+        _load_index()
+        if key not in _index:
+            _stats["misses"] += 1
+            return None
+
+        path = _path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            _remove(key)
+            _stats["misses"] += 1
+            return None
+
+        if time.time() - entry.get('created_at', 0) > GENERATION_CACHE_TTL:
+            _remove(key)
+            _stats["expired"] += 1
+            _stats["misses"] += 1
+            return None
+
+        # 更新访问时间，淘汰时按最近最少使用的顺序
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        _index[key] = (now, _index[key][1])
+        _stats["hits"] += 1
+        return entry['value']
+
+
+def put(key, value):
+    """写入缓存，超过总大小上限时淘汰最久未使用的条目"""
+    global _total_bytes
+    if GENERATION_CACHE_TTL <= 0:
+        return
+
+    data = json.dumps({"created_at": time.time(), "value": value}, ensure_ascii=False).encode('utf-8')
+    if len(data) > GENERATION_CACHE_MAX_BYTES:
+        return
+
+    path = _path(key)
+    with _lock:
+        _load_index()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，读取方不会看到写了一半的文件
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入生成缓存失败: {e}")
+            return
+
+        _, old_size = _index.get(key, (0, 0))
+        _index[key] = (time.time(), len(data))
+        _total_bytes += len(data) - old_size
+        _stats["writes"] += 1
+
+        if _total_bytes > GENERATION_CACHE_MAX_BYTES:
+            for old_key, _ in sorted(_index.items(), key=lambda kv: kv[1][0]):
+                if _total_bytes <= GENERATION_CACHE_MAX_BYTES:
+                    break
+                _remove(old_key)
+                _stats["evictions"] += 1
+
+
+def get_stats():
+    """获取缓存统计信息"""
+    with _lock:
+        _load_index()
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_index),
+            "bytes": _total_bytes,
+            "max_bytes": GENERATION_CACHE_MAX_BYTES,
+            "hit_rate": round(_stats["hits"] / total, 4) if total else 0.0,
+        }
+
+
+def clear():
+    """清空缓存"""
+    with _lock:
+        _load_index()
+        for key in list(_index):
+            _remove(key)
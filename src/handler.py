@@ -1,4 +1,3 @@
-import re
 import time
 import json
 import urllib.request
@@ -10,11 +9,14 @@ import getpass
 import platform
 import random
 from datetime import datetime
-from playwright.sync_api import sync_playwright
 from qcloud_cos import CosConfig
 from qcloud_cos import CosS3Client
 from config_loader import config
-from db_manager import get_plans_by_date
+from plan_cache import get_plans_by_date
+from accounts import DEFAULT_ACCOUNT, DEFAULT_USER_DATA_DIR, DEFAULT_SESSION_FILE, get_user_data_dir, get_session_file, get_dingtalk_webhook
+from browser_pool import run_in_browser, open_target_page
+import http_replay
+from fill_steps import FRAME_SELECTOR, PACING_MOUSE_MOVES, PACING_MOUSE_DELAY_MS, PACING_DWELL_SECONDS, run_fill_steps, wait_frame_idle
 from logger import logger
 
 # --- 配置区域 (从 config.yaml 加载) ---
@@ -35,13 +37,10 @@ TARGET_URL = config['app']['target_url']
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 IMG_LOG_DIR = os.path.join(BASE_DIR, config['app']['img_log_dir'])
-# 浏览器数据保存路径 (项目根目录/browser_data)
-USER_DATA_DIR = os.path.join(BASE_DIR, 'browser_data')
-# 会话 Token 文件路径
-SESSION_FILE = os.path.join(BASE_DIR, 'session_token.json')
-
-# 统一的 User-Agent (模拟 Windows Chrome)
-USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+# 默认账号的浏览器数据保存路径 (项目根目录/browser_data)，其他账号见 accounts.get_user_data_dir
+USER_DATA_DIR = DEFAULT_USER_DATA_DIR
+# 默认账号的会话 Token 文件路径，其他账号见 accounts.get_session_file
+SESSION_FILE = DEFAULT_SESSION_FILE
 
 # --- 配置结束 ---
 
@@ -103,11 +102,13 @@ def upload_to_cos_and_get_url(local_file_path):
         return None
 
 
-def send_dingtalk_notification(title, content, image_url=None):
+def send_dingtalk_notification(title, content, image_url=None, webhook=None):
     """
     发送钉钉Markdown通知，支持图片
+    :param webhook: 指定 Webhook (账号单独配置时使用)，默认使用全局配置
     """
-    if not DINGTALK_WEBHOOK:
+    webhook = webhook or DINGTALK_WEBHOOK
+    if not webhook:
         logger.warning("未配置钉钉Webhook")
         return
 
@@ -127,7 +128,7 @@ def send_dingtalk_notification(title, content, image_url=None):
     try:
         headers = {'Content-Type': 'application/json'}
         req = urllib.request.Request(
-            url=DINGTALK_WEBHOOK,
+            url=webhook,
             data=json.dumps(data).encode("utf-8"),
             headers=headers
         )
@@ -142,50 +143,9 @@ def send_dingtalk_notification(title, content, image_url=None):
         logger.error(f"发送钉钉通知失败: {e}", exc_info=True)
 
 
-def _inject_stealth_scripts(context):
-    """
-    深度伪装：注入反检测脚本，模拟真实浏览器特征
-    """
-    # 1. 隐藏 webdriver 属性
-    # 2. 伪装 WebGL 渲染器 (防止被识别为 Headless/SwiftShader)
-    # 3. 伪装 Plugins 和 Languages
-    stealth_js = """
-        // 隐藏 WebDriver
-        Object.defineProperty(navigator, 'webdriver', { get: () => undefined });
-
-        // 伪装 WebGL
-        const getParameter = WebGLRenderingContext.prototype.getParameter;
-        WebGLRenderingContext.prototype.getParameter = function(parameter) {
-            // 37445: UNMASKED_VENDOR_WEBGL
-            // 37446: UNMASKED_RENDERER_WEBGL
-            if (parameter === 37445) {
-                return 'Intel Inc.';
-            }
-            if (parameter === 37446) {
-                return 'Intel(R) Iris(R) Xe Graphics';
-            }
-            return getParameter.apply(this, [parameter]);
-        };
-
-        // 伪装 Plugins (Headless 默认无插件)
-        Object.defineProperty(navigator, 'plugins', {
-            get: () => [1, 2, 3, 4, 5],
-        });
-
-        // 伪装 Languages
-        Object.defineProperty(navigator, 'languages', {
-            get: () => ['zh-CN', 'zh', 'en'],
-        });
-        
-        // 绕过 Chrome 自动化检测
-        window.chrome = { runtime: {} };
-    """
-    context.add_init_script(stealth_js)
-
-
-def _save_session_to_file(context, page):
+def _save_session_to_file(context, page, session_file=SESSION_FILE):
     """
-    [核心] 将当前最新的会话状态（Cookie + LocalStorage）保存到 session_token.json
+    [核心] 将当前最新的会话状态（Cookie + LocalStorage）保存到会话文件 (默认 session_token.json)
     实现“滚动更新”，防止 Token 轮转后本地持有旧 Token 导致恢复失败。
     """
     try:
@@ -203,45 +163,68 @@ def _save_session_to_file(context, page):
 
         origins = page.evaluate("() => window.location.origin")
         local_storage = page.evaluate("() => JSON.stringify(localStorage)")
-        
-        session_data = {
-            "cookies": cookies,
-            "origins": [
-                {
-                    "origin": origins,
-                    "localStorage": json.loads(local_storage)
-                }
-            ],
-            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
 
-        # 原子写入 (先写临时文件再重命名，防止损坏)
-        temp_file = SESSION_FILE + ".tmp"
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=4)
-        
-        if os.path.exists(SESSION_FILE):
-            os.remove(SESSION_FILE)
-        os.rename(temp_file, SESSION_FILE)
-        
-        logger.info(f"✅ 最新会话已更新至: {SESSION_FILE}")
+        write_session_file(session_file, cookies, origins, json.loads(local_storage))
     except Exception as e:
         logger.error(f"保存会话失败: {e}")
 
 
-def _inject_session_from_file(context, page):
+def write_session_file(session_file, cookies, origin, local_storage):
     """
-    从 session_token.json 文件注入会话数据 (Cookie 和 LocalStorage)
+    将会话数据 (Cookie + 一个源的 LocalStorage) 原子写入会话文件
+    同步和异步填写流程共用
     """
-    if not os.path.exists(SESSION_FILE):
-        logger.warning(f"会话文件不存在: {SESSION_FILE}，无法进行会话恢复")
-        return False
+    session_data = {
+        "cookies": cookies,
+        "origins": [
+            {
+                "origin": origin,
+                "localStorage": local_storage
+            }
+        ],
+        "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+    session_dir = os.path.dirname(session_file)
+    if not os.path.exists(session_dir):
+        os.makedirs(session_dir)
+
+    # 原子写入 (先写临时文件再重命名，防止损坏)
+    temp_file = session_file + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(session_data, f, ensure_ascii=False, indent=4)
 
+    os.replace(temp_file, session_file)
+
+    logger.info(f"✅ 最新会话已更新至: {session_file}")
+
+
+def load_session_file(session_file):
+    """
+    读取会话文件
+    :return: {"cookies": [...], "origins": [{"origin": ..., "localStorage": {键: 值}}]}，文件不存在或损坏时返回 None
+    """
+    if not os.path.exists(session_file):
+        logger.warning(f"会话文件不存在: {session_file}，无法进行会话恢复")
+        return None
     try:
-        logger.info(f"正在尝试从 {SESSION_FILE} 恢复会话...")
-        with open(SESSION_FILE, 'r', encoding='utf-8') as f:
-            session_data = json.load(f)
+        with open(session_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"读取会话文件失败: {e}")
+        return None
 
+
+def _inject_session_from_file(context, page, session_file=SESSION_FILE):
+    """
+    从会话文件 (默认 session_token.json) 注入会话数据 (Cookie 和 LocalStorage)
+    """
+    logger.info(f"正在尝试从 {session_file} 恢复会话...")
+    session_data = load_session_file(session_file)
+    if session_data is None:
+        return False
+
+    try:
         # 1. 注入 Cookies
         if 'cookies' in session_data:
             context.add_cookies(session_data['cookies'])
@@ -273,18 +256,50 @@ def _inject_session_from_file(context, page):
         return False
 
 
+def _submit_via_http(account, session_file, values):
+    """
+    用录制的提交请求直接提交日报，不启动浏览器 (见 http_replay)
+    :return: {"error": 异常或 None, "screenshot": None}；被拒绝且允许回退时返回 None，由调用方改用浏览器填写
+    """
+    logger.info("⚡ 使用录制的提交请求直接提交...")
+    try:
+        session_data = load_session_file(session_file)
+        if session_data is None:
+            raise http_replay.ReplayRejected("会话文件不存在或已损坏")
+        cookies = http_replay.replay(account, values, session_data)
+        if cookies is not None:
+            # 服务端轮转了 Cookie，同步更新会话文件
+            origin = (session_data.get('origins') or [{}])[0]
+            write_session_file(session_file, cookies, origin.get('origin'), origin.get('localStorage') or {})
+        logger.info("✅ 日报自动填写成功！")
+        return {"error": None, "screenshot": None}
+    except http_replay.ReplayRejected as e:
+        if http_replay.FILL_MODE == 'http':
+            logger.error(f"❌ 直接提交被拒绝: {e}")
+            return {"error": e, "screenshot": None}
+        logger.warning(f"⚠️ 直接提交被拒绝，改用浏览器填写: {e}")
+        return None
+    except Exception as e:
+        # 包括 ReplayUncertain (请求可能已到达服务端)，无法确定是否已提交，不再用浏览器重试
+        logger.error(f"❌ 直接提交失败: {e}", exc_info=True)
+        return {"error": e, "screenshot": None}
+
+
 def _simulate_human_activity(page):
     """
     模拟人类活动：鼠标移动、随机点击
+    移动次数和停顿由 fill.pacing 配置 (mouse_moves 为 0 时跳过)
     """
+    if PACING_MOUSE_MOVES <= 0:
+        return
     try:
         logger.info("🤖 模拟人类活动...")
         # 随机移动鼠标
-        for _ in range(5):
+        for _ in range(PACING_MOUSE_MOVES):
             x = random.randint(100, 1000)
             y = random.randint(100, 800)
-            page.mouse.move(x, y)
-            time.sleep(random.uniform(0.5, 1.5))
+            page.mouse.move(x, y, steps=5)
+            time.sleep(random.uniform(*PACING_MOUSE_DELAY_MS) / 1000)
         
         # 尝试点击一些非破坏性的元素，例如侧边栏菜单，以触发更真实的交互
         # 如果找不到特定元素，回退到点击 body
@@ -300,110 +315,90 @@ def _simulate_human_activity(page):
         logger.warning(f"模拟活动失败: {e}")
 
 
-def keep_alive():
+def keep_alive(account=DEFAULT_ACCOUNT):
     """
     后台保活任务：访问页面以刷新 Session，并检查 Cookie 是否有效
-    如果失效，尝试从 session_token.json 恢复
+    如果失效，尝试从账号的会话文件恢复
+    使用账号的常驻浏览器 (见 browser_pool)，拿到的页面已打开目标地址
     """
+    user_data_dir = get_user_data_dir(account)
+    session_file = get_session_file(account)
+
+    def refresh(context, page):
+        # 等待跳转和 iframe 加载完成
+        wait_frame_idle(page)
+
+        # Check login status
+        iframe = page.frame_locator(FRAME_SELECTOR)
+        try:
+            # Wait up to 5s to check if logged in
+            iframe.get_by_role("button", name="添加记录").wait_for(timeout=5000)
+            logger.info("✅ 登录状态有效")
+        except Exception:
+            logger.warning(f"⚠️ 登录状态失效，尝试使用 {os.path.basename(session_file)} 恢复...")
+            if _inject_session_from_file(context, page, session_file):
+                logger.info("会话数据注入完成，重新加载页面验证...")
+                open_target_page(page)
+                wait_frame_idle(page)
+
+                # Re-check login status
+                iframe.get_by_role("button", name="添加记录").wait_for(timeout=10000)
+                logger.info("✅ 会话恢复成功，登录状态有效")
+            else:
+                raise Exception("会话恢复失败或文件不存在")
+
+        # 刷新页面以确保 Session 延期
+        logger.info("🔄 刷新页面以确保 Session 延期...")
+        page.reload()
+        page.wait_for_load_state("domcontentloaded")
+
+        # 模拟活动并按拟人化节奏停留 (fill.pacing)
+        _simulate_human_activity(page)
+        if PACING_DWELL_SECONDS > 0:
+            logger.info(f"⏳ 保持页面活跃 {PACING_DWELL_SECONDS:g} 秒...")
+            time.sleep(PACING_DWELL_SECONDS)
+
+        # --- 关键：保存最新的 Session ---
+        _save_session_to_file(context, page, session_file)
+        # -----------------------------
+
     try:
         logger.info("=" * 40)
-        logger.info("🔄 [保活] 开始执行 Cookie 保活任务")
+        logger.info(f"🔄 [保活] 开始执行 Cookie 保活任务 (账号: {account})")
         
-        if not os.path.exists(USER_DATA_DIR):
+        if not os.path.exists(user_data_dir):
             logger.warning("浏览器数据目录不存在，跳过保活")
             return
 
-        # 强制移除 DISPLAY
-        if 'DISPLAY' in os.environ:
-            del os.environ['DISPLAY']
-
-        with sync_playwright() as p:
-            # 使用持久化上下文
-            context = p.chromium.launch_persistent_context(
-                user_data_dir=USER_DATA_DIR,
-                headless=True,
-                user_agent=USER_AGENT,
-                args=[
-                    "--start-maximized", 
-                    "--disable-gpu", 
-                    "--lang=zh-CN",
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",
-                    "--disable-setuid-sandbox",
-                    "--disable-infobars"
-                ],
-                viewport={'width': 1920, 'height': 1080},
-                locale='zh-CN',
-                timezone_id='Asia/Shanghai'
-            )
-            
-            _inject_stealth_scripts(context)
-            
-            page = context.pages[0] if context.pages else context.new_page()
-            
-            logger.info(f"正在访问页面: {TARGET_URL}")
-            try:
-                page.goto(TARGET_URL, timeout=60000)
-                page.wait_for_load_state("domcontentloaded")
-                time.sleep(2) # Wait for redirects
-                
-                # Check login status
-                iframe = page.frame_locator("#wiki-notable-iframe")
-                try:
-                    # Wait up to 5s to check if logged in
-                    iframe.get_by_role("button", name="添加记录").wait_for(timeout=5000)
-                    logger.info("✅ 登录状态有效")
-                except Exception:
-                    logger.warning("⚠️ 登录状态失效，尝试使用 session_token.json 恢复...")
-                    if _inject_session_from_file(context, page):
-                        logger.info("会话数据注入完成，重新加载页面验证...")
-                        page.goto(TARGET_URL, timeout=60000)
-                        page.wait_for_load_state("domcontentloaded")
-                        time.sleep(2)
-                        
-                        # Re-check login status
-                        iframe.get_by_role("button", name="添加记录").wait_for(timeout=10000)
-                        logger.info("✅ 会话恢复成功，登录状态有效")
-                    else:
-                        raise Exception("会话恢复失败或文件不存在")
-                
-                # 刷新页面以确保 Session 延期
-                logger.info("🔄 刷新页面以确保 Session 延期...")
-                page.reload()
-                page.wait_for_load_state("domcontentloaded")
-                
-                # 增加停留时间并模拟活动
-                logger.info("⏳ 保持页面活跃 10 秒...")
-                _simulate_human_activity(page)
-                time.sleep(10)
-                
-                # --- 关键：保存最新的 Session ---
-                _save_session_to_file(context, page)
-                # -----------------------------
-                
-                logger.info(f"Session 已刷新并保存")
-                
-            except Exception as e:
-                logger.warning(f"⚠️ 保活失败: {e}")
-                # 保活失败不发送钉钉通知，仅记录日志
-            finally:
-                context.close()
-                logger.info("🔄 [保活] 任务结束")
+        try:
+            run_in_browser(account, refresh)
+            logger.info(f"Session 已刷新并保存")
+        except Exception as e:
+            logger.warning(f"⚠️ 保活失败: {e}")
+            # 保活失败不发送钉钉通知，仅记录日志
+        finally:
+            logger.info("🔄 [保活] 任务结束")
                 
     except Exception as e:
         logger.error(f"保活任务异常: {e}")
 
 
-def run(is_api_call=False):
+def run(account=DEFAULT_ACCOUNT, is_api_call=False, plan=None):
     """
     执行日报填写任务
+    :param account: 为哪个账号填写 (决定使用的计划、浏览器数据目录、会话文件和钉钉 Webhook)
     :param is_api_call: 是否为 API 调用，如果是，则返回执行结果字典
+    :param plan: 已查询好的今日计划 (定时任务批量查询后传入)，为 None 时从数据库查询
     :return: 如果 is_api_call 为 True，返回 {"success": bool, "message": str}
     """
+    user_data_dir = get_user_data_dir(account)
+    session_file = get_session_file(account)
+    webhook = get_dingtalk_webhook(account)
+
     # --- 调试信息：记录执行环境 ---
     try:
         logger.info("=" * 40)
-        logger.info("🚀 任务开始执行 (Environment Debug)")
+        logger.info(f"🚀 任务开始执行 (账号: {account})")
         logger.info(f"📅 当前系统时间: {datetime.now()}")
         logger.info(f"🆔 进程 PID: {os.getpid()}")
         logger.info(f"👤 运行用户: {getpass.getuser()}")
@@ -416,10 +411,10 @@ def run(is_api_call=False):
 
     # 1. 检查今天是否有日报计划
     today_str = datetime.now().strftime("%Y-%m-%d")
-    plans = get_plans_by_date(today_str)
+    plans = [plan] if plan else get_plans_by_date(today_str, account=account)
     
     if not plans:
-        msg = f"今天 ({today_str}) 没有找到日报计划，发送提醒..."
+        msg = f"账号 {account} 今天 ({today_str}) 没有找到日报计划，发送提醒..."
         logger.warning(msg)
         
         # 获取调试信息用于通知
@@ -430,25 +425,28 @@ def run(is_api_call=False):
         send_dingtalk_notification(
             "⚠️ 日报未填写提醒",
             f"## ⚠️ 今日 ({today_str}) 尚未生成日报计划\n\n"
+            f"**账号**: {account}\n\n"
             f"请尽快登录系统生成今日日报，以便自动填写。\n\n"
             f"--- \n"
             f"**调试信息**:\n"
             f"- IP: {server_ip}\n"
             f"- OS: {os_info}\n"
             f"- Time: {current_time}\n"
-            f"- Script: {os.path.basename(sys.argv[0])}"
+            f"- Script: {os.path.basename(sys.argv[0])}",
+            webhook=webhook
         )
         if is_api_call:
             return {"success": False, "message": msg}
         return
 
     # 2. 检查浏览器数据目录是否存在
-    if not os.path.exists(USER_DATA_DIR):
-        msg = f"认证失败: 未找到浏览器数据目录 ({USER_DATA_DIR})"
+    if not os.path.exists(user_data_dir):
+        msg = f"认证失败: 未找到浏览器数据目录 ({user_data_dir})"
         logger.error(msg)
         send_dingtalk_notification(
             "❌ 日报填写失败",
-            f"## ❌ 认证失败\n\n**原因**: 未在项目根目录找到 `browser_data` 目录。\n\n**解决方法**: 请在本地运行 `python script/get_cookie.py` 脚本进行登录，并确保目录已上传到服务器。"
+            f"## ❌ 认证失败\n\n**账号**: {account}\n\n**原因**: 未找到浏览器数据目录 `{os.path.relpath(user_data_dir, BASE_DIR)}`。\n\n**解决方法**: 请在本地运行 `python script/get_cookie.py --account {account}` 脚本进行登录，并确保目录已上传到服务器。",
+            webhook=webhook
         )
         if is_api_call:
             return {"success": False, "message": msg}
@@ -458,157 +456,112 @@ def run(is_api_call=False):
     today_plan = plans[0]
     todo_content = today_plan['todo']
     progress_content = today_plan['progress'] or "正常推进中"
+    values = {"todo": todo_content, "progress": progress_content}
 
     # 确保图片日志目录存在
     if not os.path.exists(IMG_LOG_DIR):
         os.makedirs(IMG_LOG_DIR)
 
-    # 强制移除 DISPLAY 环境变量，防止 Xshell 触发 Xmanager 弹窗
-    if 'DISPLAY' in os.environ:
-        logger.info("检测到 DISPLAY 环境变量，正在移除以避免 X11 转发干扰...")
-        del os.environ['DISPLAY']
+    def fill(context, page):
+        """
+        在账号的常驻浏览器中填写日报 (页面已打开目标地址)
+        :return: {"error": 异常或 None, "screenshot": 截图路径或 None}
+        """
+        def record(response):
+            # 录制提交请求，之后可以直接 HTTP 提交 (fill.mode 为 browser 时不录制)
+            try:
+                local_storage = json.loads(page.evaluate("() => JSON.stringify(localStorage)"))
+                http_replay.save_recording(account, response.request, response.status, response.text(), values, local_storage)
+            except Exception as e:
+                logger.warning(f"录制提交请求失败: {e}")
 
-    # 使用 sync_playwright 上下文管理器
-    with sync_playwright() as p:
-        context = None
         try:
-            logger.info("启动浏览器...")
-            # 使用持久化上下文
-            context = p.chromium.launch_persistent_context(
-                user_data_dir=USER_DATA_DIR,
-                headless=True,
-                user_agent=USER_AGENT,
-                args=[
-                    "--start-maximized", 
-                    "--disable-gpu", 
-                    "--lang=zh-CN",
-                    "--disable-blink-features=AutomationControlled",
-                    "--no-sandbox",
-                    "--disable-setuid-sandbox",
-                    "--disable-infobars"
-                ],
-                viewport={'width': 1920, 'height': 1080},
-                locale='zh-CN', # 设置上下文语言环境
-                timezone_id='Asia/Shanghai' # 设置时区
-            )
-            
-            _inject_stealth_scripts(context)
-            
-            logger.info("浏览器上下文已启动")
-
-            page = context.pages[0] if context.pages else context.new_page()
-            screenshot_path = ""
-
-            logger.info(f"正在打开页面: {TARGET_URL}")
-            # 增加超时时间到 60秒
-            page.goto(TARGET_URL, timeout=60000)
-            page.wait_for_load_state("domcontentloaded")
-
-            # 等待1秒，确保页面完全加载
-            time.sleep(1)
-
-            # 1. 点击“添加记录”按钮
-            logger.info("点击“添加记录”按钮")
-            iframe = page.frame_locator("#wiki-notable-iframe")
-            iframe.get_by_role("button", name="添加记录").click()
-            time.sleep(1)
-
-            logger.info("选择“需支持”")
-            iframe.locator("div").filter(has_text=re.compile(r"^需支持$")).click()
-
-            # 按下backspace
-            logger.info("清除旧内容")
-            for _ in range(15):
-                iframe.get_by_role("textbox").nth(4).press("Backspace")
-                time.sleep(0.1)
-            time.sleep(1)
-
-            logger.info(f"填写今日内容: {todo_content[:20]}...")
-            iframe.get_by_role("textbox").nth(4).fill(todo_content)
-            time.sleep(1)
-
-            logger.info("点击下一个输入框")
-            # 移除旧的复杂选择器点击，直接定位第5个输入框
-            # iframe.locator("div:nth-child(3) > ...").click() 
-            
-            logger.info(f"填写迭代事项: {progress_content[:20]}...")
-            # 直接填写第5个输入框，无需先点击
-            iframe.get_by_role("textbox").nth(5).fill(progress_content)
-            time.sleep(1)
-
-            logger.info("提交记录")
-            iframe.locator(".sc-1gu97lr-4 > button:nth-child(6)").click()
-            time.sleep(1)
+            # 按步骤填写，每步等待元素可见、输入框的值确认、提交请求完成
+            timings = run_fill_steps(page, values, on_submit=record if http_replay.FILL_MODE != 'browser' else None)
+            logger.info(f"填写步骤共耗时 {sum(timings.values()):.2f}s")
 
             logger.info("✅ 日报自动填写成功！")
-            screenshot_name = f"daily_report_success_{get_timestamp()}.png"
+            screenshot_name = f"daily_report_success_{account}_{get_timestamp()}.png"
             screenshot_path = os.path.join(IMG_LOG_DIR, screenshot_name)
             page.screenshot(path=screenshot_path)
             logger.info(f"截图已保存: {screenshot_path}")
 
-            # --- 核心：上传图片并发送通知 ---
-            image_url = upload_to_cos_and_get_url(screenshot_path)
-            
-            server_ip = get_host_ip()
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            os_info = f"{platform.system()} {platform.release()}"
-
-            send_dingtalk_notification(
-                "日报填写成功",
-                f"## ✅ 日报填写成功\n\n"
-                f"**服务器IP**: {server_ip}\n"
-                f"**操作系统**: {os_info}\n"
-                f"**执行时间**: {current_time}\n\n"
-                f"**状态**: 已归档至腾讯云\n\n"
-                f"**内容摘要**:\n{todo_content}",
-                image_url
-            )
-            
             # --- 关键：保存最新的 Session ---
-            _save_session_to_file(context, page)
+            _save_session_to_file(context, page, session_file)
             # -----------------------------
-            
-            if is_api_call:
-                return {"success": True, "message": "日报填写成功"}
+
+            return {"error": None, "screenshot": screenshot_path}
 
         except Exception as e:
             logger.error(f"❌ 发生错误: {e}", exc_info=True)
-            
-            image_url = None
-            if 'page' in locals():
-                try:
-                    screenshot_name = f"daily_report_error_{get_timestamp()}.png"
-                    screenshot_path = os.path.join(IMG_LOG_DIR, screenshot_name)
-                    page.screenshot(path=screenshot_path)
-                    image_url = upload_to_cos_and_get_url(screenshot_path)
-                except Exception as screenshot_error:
-                    logger.error(f"截图失败: {screenshot_error}")
-
-            server_ip = get_host_ip()
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            os_info = f"{platform.system()} {platform.release()}"
-
-            send_dingtalk_notification(
-                "日报填写失败",
-                f"## ❌ 日报填写失败\n\n"
-                f"**服务器IP**: {server_ip}\n"
-                f"**操作系统**: {os_info}\n"
-                f"**执行时间**: {current_time}\n\n"
-                f"**错误信息**: {str(e)}",
-                image_url
-            )
-            
-            if is_api_call:
-                return {"success": False, "message": f"执行失败: {str(e)}"}
+            screenshot_path = None
+            try:
+                screenshot_name = f"daily_report_error_{account}_{get_timestamp()}.png"
+                screenshot_path = os.path.join(IMG_LOG_DIR, screenshot_name)
+                page.screenshot(path=screenshot_path)
+            except Exception as screenshot_error:
+                logger.error(f"截图失败: {screenshot_error}")
+                screenshot_path = None
+            return {"error": e, "screenshot": screenshot_path}
+
+    # 有录制的提交请求时先直接 HTTP 提交，被拒绝时再用浏览器填写
+    result = None
+    if http_replay.should_replay(account):
+        result = _submit_via_http(account, session_file, values)
+
+    if result is None:
+        logger.info("获取浏览器...")
+        try:
+            result = run_in_browser(account, fill)
+        except Exception as e:
+            # 浏览器启动或打开页面失败
+            logger.error(f"❌ 发生错误: {e}", exc_info=True)
+            result = {"error": e, "screenshot": None}
 
-        finally:
-            if context:
-                time.sleep(2)
-                try:
-                    context.close()
-                    logger.info("浏览器上下文已关闭")
-                except Exception as e:
-                    logger.warning(f"关闭浏览器时出错 (可能已关闭): {e}")
+    # 上传截图和发送通知在浏览器线程之外进行，不占用浏览器
+    notify_fill_result(account, todo_content, result["error"], result["screenshot"], webhook)
+    if is_api_call:
+        if result["error"] is None:
+            return {"success": True, "message": "日报填写成功"}
+        return {"success": False, "message": f"执行失败: {str(result['error'])}"}
+
+
+def notify_fill_result(account, todo_content, error, screenshot_path=None, webhook=None):
+    """
+    上传截图并发送填写结果的钉钉通知 (同步和异步填写流程共用)
+    :param error: 失败时的异常或错误信息，成功时为 None
+    """
+    image_url = upload_to_cos_and_get_url(screenshot_path) if screenshot_path else None
+    server_ip = get_host_ip()
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    os_info = f"{platform.system()} {platform.release()}"
+
+    if error is None:
+        send_dingtalk_notification(
+            "日报填写成功",
+            f"## ✅ 日报填写成功\n\n"
+            f"**账号**: {account}\n"
+            f"**服务器IP**: {server_ip}\n"
+            f"**操作系统**: {os_info}\n"
+            f"**执行时间**: {current_time}\n\n"
+            f"**状态**: 已归档至腾讯云\n\n"
+            f"**内容摘要**:\n{todo_content}",
+            image_url,
+            webhook=webhook
+        )
+        return
+
+    send_dingtalk_notification(
+        "日报填写失败",
+        f"## ❌ 日报填写失败\n\n"
+        f"**账号**: {account}\n"
+        f"**服务器IP**: {server_ip}\n"
+        f"**操作系统**: {os_info}\n"
+        f"**执行时间**: {current_time}\n\n"
+        f"**错误信息**: {str(error)}",
+        image_url,
+        webhook=webhook
+    )
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ACCOUNT)
\ No newline at end of file
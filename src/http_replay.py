@@ -0,0 +1,297 @@
+import os
+import re
+import json
+import threading
+import urllib.parse
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from config_loader import config
+from accounts import RECORDINGS_DIR, get_recording_file
+from logger import logger
+
+# 直接 HTTP 提交 (config.yaml 的 fill 段，均可省略)
+# 浏览器填写时录制表单 iframe 发出的提交请求，把日报内容和日期替换为占位符后保存；
+# 之后用会话文件中的 Cookie 直接重放该请求，不再启动浏览器。重放被拒绝时改走浏览器填写 (并重新录制)
+_fill_config = config.get('fill') or {}
+FILL_MODE = _fill_config.get('mode', 'auto')  # browser (只用浏览器) / http (有录制时只重放，被拒绝不回退) / auto (优先重放，被拒绝时用浏览器)
+HTTP_TIMEOUT = float(_fill_config.get('http_timeout_seconds', 15))  # 重放请求的超时时间 (秒)
+RECORDING_MAX_AGE_DAYS = float(_fill_config.get('recording_max_age_days', 30))  # 录制超过该天数后重新用浏览器录制，0 表示不限
+HTTP_POOL_SIZE = int(_fill_config.get('http_pool_size', 4))  # 每个账号的连接池大小
+
+# 录制时不保存的请求头 (Cookie 每次从会话文件读取，其余由 requests 自动生成)
+_SKIP_HEADERS = {'cookie', 'content-length', 'host', 'connection', 'accept-encoding'}
+# 响应 JSON 中表示业务结果的字段，重放时与录制时不一致则视为结果不确定 (不重试)
+_RESULT_FIELDS = ('code', 'errcode', 'errCode', 'error_code', 'ret', 'status', 'success', 'ok')
+# 请求头中的 Token 与 LocalStorage 中的值相同时，重放时改用会话文件中的最新值 (过短的值容易误匹配)
+_MIN_TOKEN_LENGTH = 16
+_DATE_FORMAT = "%Y-%m-%d"
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+# 日报内容在请求体中可能的编码方式 (按顺序尝试)
+_ENCODERS = {
+    "json": lambda text: json.dumps(text, ensure_ascii=False)[1:-1],
+    "json_ascii": lambda text: json.dumps(text)[1:-1],
+    "form": lambda text: urllib.parse.quote_plus(text),
+    "raw": lambda text: text,
+}
+
+_sessions = {}
+_lock = threading.Lock()
+_stats = {"recorded": 0, "replays": 0, "accepted": 0, "rejected": 0, "errors": 0}
+
+
+class ReplayRejected(Exception):
+    """重放的请求确定没有被处理 (发送前连接失败或 3xx/4xx)，可以安全地改用浏览器重试"""
+
+
+class ReplayUncertain(Exception):
+    """请求可能已经被服务端处理 (发送中断、未收到完整响应、5xx 或 2xx 但响应与录制时不一致)，无法确定是否已提交，不应自动重试"""
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def _local_storage_items(local_storage):
+    if isinstance(local_storage, list):
+        return {item['name']: item['value'] for item in local_storage}
+    return dict(local_storage or {})
+
+
+def _session_local_storage(session_data):
+    """合并会话文件中所有源的 LocalStorage"""
+    merged = {}
+    for item in session_data.get('origins') or []:
+        merged.update(_local_storage_items(item.get('localStorage')))
+    return merged
+
+
+def _result_fields(text):
+    """从响应 JSON 中取出表示业务结果的字段，不是 JSON 对象时返回 None"""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return {key: data[key] for key in _RESULT_FIELDS if key in data and not isinstance(data[key], (dict, list))}
+
+
+def find_encoding(body, values):
+    """
+    按 _ENCODERS 的顺序查找请求体中日报内容的编码方式 (浏览器填写时也用于识别提交请求)
+    :return: 编码方式，请求体中找不到全部内容时返回 None
+    """
+    for name, encode in _ENCODERS.items():
+        if all(text and text in body for text in (encode(value) for value in values.values())):
+            return name
+    return None
+
+
+def _template_body(body, values, date_str):
+    """
+    把请求体中的日报内容和日期替换为占位符
+    :return: (模板, 编码方式)，请求体中找不到日报内容时返回 None
+    """
+    name = find_encoding(body, values)
+    if name is None:
+        return None
+    encoded = {key: _ENCODERS[name](value) for key, value in values.items()}
+    template = body
+    # 先替换较长的内容，避免一个值是另一个值的一部分时被拆开
+    for key in sorted(encoded, key=lambda k: len(encoded[k]), reverse=True):
+        template = template.replace(encoded[key], "{{" + key + "}}")
+    return template.replace(date_str, "{{date}}"), name
+
+
+def save_recording(account, request, status, response_text, values, local_storage=None):
+    """
+    保存浏览器填写时捕获到的提交请求 (同步和异步流程共用，request 为 Playwright 的 Request)
+    :param values: 本次填写的 {"todo": ..., "progress": ...}，用于在请求体中定位并替换为占位符
+    :param local_storage: 页面的 LocalStorage，用于识别请求头中的 Token
+    :return: 是否已保存
+    """
+    if FILL_MODE == 'browser':
+        return False
+    if status >= 300 or not request.post_data:
+        return False
+
+    templated = _template_body(request.post_data, values, datetime.now().strftime(_DATE_FORMAT))
+    if templated is None:
+        logger.warning(f"[{account}] 提交请求中找不到日报内容，不录制")
+        return False
+    body, encoding = templated
+
+    headers = {name: value for name, value in request.headers.items()
+               if name.lower() not in _SKIP_HEADERS and not name.startswith(':')}
+    storage = _local_storage_items(local_storage)
+    header_tokens = {}
+    for name, value in headers.items():
+        for key, token in storage.items():
+            if isinstance(token, str) and len(token) >= _MIN_TOKEN_LENGTH and token in value:
+                header_tokens[name] = {"key": key, "value": token}
+                break
+
+    recording = {
+        "method": request.method,
+        "url": request.url,
+        "headers": headers,
+        "header_tokens": header_tokens,
+        "body": body,
+        "encoding": encoding,
+        "expect": {"status": status, "fields": _result_fields(response_text)},
+        "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    if not os.path.exists(RECORDINGS_DIR):
+        os.makedirs(RECORDINGS_DIR)
+    recording_file = get_recording_file(account)
+    temp_file = recording_file + ".tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(recording, f, ensure_ascii=False, indent=4)
+    os.replace(temp_file, recording_file)
+
+    _count("recorded")
+    logger.info(f"[{account}] 已录制提交请求: {request.method} {request.url}")
+    return True
+
+
+def load_recording(account):
+    """读取账号的录制，不存在、损坏或已过期时返回 None"""
+    recording_file = get_recording_file(account)
+    if not os.path.exists(recording_file):
+        return None
+    try:
+        with open(recording_file, 'r', encoding='utf-8') as f:
+            recording = json.load(f)
+    except Exception as e:
+        logger.warning(f"读取录制文件失败: {e}")
+        return None
+
+    if RECORDING_MAX_AGE_DAYS > 0:
+        recorded_at = datetime.strptime(recording['recorded_at'], "%Y-%m-%d %H:%M:%S")
+        if (datetime.now() - recorded_at).total_seconds() > RECORDING_MAX_AGE_DAYS * 86400:
+            logger.info(f"[{account}] 录制已超过 {RECORDING_MAX_AGE_DAYS:g} 天，需重新录制")
+            return None
+    return recording
+
+
+def should_replay(account):
+    """当前配置下是否应先尝试直接 HTTP 提交"""
+    return FILL_MODE in ('http', 'auto') and load_recording(account) is not None
+
+
+def _is_pre_send_failure(error):
+    """请求是否在发出之前就失败 (连接超时、建立连接失败或域名解析失败)，只有这些情况可以确定服务端没有收到请求"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    # requests 的 ConnectionError 包装的是 urllib3 的 MaxRetryError，reason 为底层异常
+    # (NameResolutionError 是 NewConnectionError 的子类；RemoteDisconnected、ProtocolError 等可能发生在请求体发出之后)
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _get_session(account):
+    """每个账号一个带连接池的 requests.Session (Cookie 每次重放前从会话文件重新设置)"""
+    with _lock:
+        session = _sessions.get(account)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[account] = session
+        return session
+
+
+def _build_request(recording, values, session_data):
+    encode = _ENCODERS[recording['encoding']]
+    replacements = {key: encode(value) for key, value in values.items()}
+    replacements["date"] = datetime.now().strftime(_DATE_FORMAT)
+    # 一次性替换所有占位符，日报内容中恰好包含占位符文本时也不会被再次替换
+    body = _PLACEHOLDER_RE.sub(lambda m: replacements.get(m.group(1), m.group(0)), recording['body'])
+
+    headers = dict(recording['headers'])
+    storage = _session_local_storage(session_data)
+    for name, token in (recording.get('header_tokens') or {}).items():
+        current = storage.get(token['key'])
+        if current and name in headers:
+            headers[name] = headers[name].replace(token['value'], current)
+    return headers, body.encode('utf-8')
+
+
+def _merge_cookies(cookies, jar):
+    """用响应中下发的 Cookie 更新会话文件中的 Cookie 列表，没有变化时返回 None"""
+    changed = False
+    merged = [dict(cookie) for cookie in cookies]
+    for new in jar:
+        for cookie in merged:
+            if cookie['name'] == new.name and cookie.get('domain', '').lstrip('.') == new.domain.lstrip('.'):
+                if cookie['value'] != new.value:
+                    cookie['value'] = new.value
+                    changed = True
+                break
+    return merged if changed else None
+
+
+def replay(account, values, session_data):
+    """
+    用录制的请求直接提交日报
+    :param values: {"todo": ..., "progress": ...}
+    :param session_data: 账号的会话文件内容 (见 handler.load_session_file)
+    :return: 响应下发了新 Cookie 时返回更新后的 Cookie 列表 (调用方写回会话文件)，否则返回 None
+    :raises ReplayRejected: 没有录制、请求发出前连接失败或服务端拒绝 (3xx/4xx)，可以改用浏览器填写
+    :raises ReplayUncertain: 请求可能已被处理 (发送中断、超时未收到响应、5xx、2xx 但响应与录制时不一致)，无法确定是否已提交，不应重试
+    """
+    recording = load_recording(account)
+    if recording is None:
+        raise ReplayRejected("没有可用的录制")
+
+    headers, body = _build_request(recording, values, session_data)
+    session = _get_session(account)
+    session.cookies.clear()
+    for cookie in session_data.get('cookies') or []:
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+
+    _count("replays")
+    try:
+        resp = session.request(recording['method'], recording['url'], headers=headers, data=body,
+                               timeout=HTTP_TIMEOUT, allow_redirects=False)
+    except requests.exceptions.RequestException as e:
+        if _is_pre_send_failure(e):
+            _count("rejected")
+            raise ReplayRejected(f"连接失败: {e}") from e
+        _count("errors")
+        raise ReplayUncertain(f"请求中断，无法确定是否已提交: {e}") from e
+
+    # 5xx 时服务端可能已经保存了记录，不自动改用浏览器重试
+    if resp.status_code >= 500:
+        _count("errors")
+        raise ReplayUncertain(f"HTTP {resp.status_code}，服务端可能已保存记录")
+
+    # 重定向通常意味着会话失效 (跳转到登录页)
+    expect = recording['expect']
+    if not 200 <= resp.status_code < 300:
+        _count("rejected")
+        raise ReplayRejected(f"HTTP {resp.status_code}")
+    # 2xx 说明服务端已经处理了请求，响应与录制时不一致也可能已经保存，只报告失败，不改用浏览器重试
+    if expect.get('fields') is not None:
+        fields = _result_fields(resp.text)
+        if fields is None or any(fields.get(key) != value for key, value in expect['fields'].items()):
+            _count("errors")
+            raise ReplayUncertain(f"响应与录制时不一致，无法确定是否已提交: {resp.text[:200]}")
+
+    _count("accepted")
+    logger.info(f"[{account}] 直接 HTTP 提交成功 (HTTP {resp.status_code}，耗时 {resp.elapsed.total_seconds():.2f}s)")
+    return _merge_cookies(session_data.get('cookies') or [], resp.cookies)
+
+
+def get_stats():
+    """获取直接 HTTP 提交的统计信息"""
+    with _lock:
+        return {**_stats, "mode": FILL_MODE}
@@ -0,0 +1,168 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config_loader import config
+from logger import logger
+
+# 进程内后台任务队列 (config.yaml 的 jobs 段，均可省略)
+# 耗时的 AI 生成在固定大小的线程池中执行，Web 请求只负责提交任务和查询状态
+_jobs_config = config.get('jobs') or {}
+JOB_WORKERS = int(_jobs_config.get('workers', 2))  # 同时执行的任务数
+JOB_MAX_PER_USER = int(_jobs_config.get('max_per_user', 2))  # 每个用户同时排队/执行的任务数上限
+JOB_MAX_QUEUED = int(_jobs_config.get('max_queued', 20))  # 全局排队任务数上限
+JOB_RESULT_TTL = float(_jobs_config.get('result_ttl_minutes', 30)) * 60  # 已结束任务的保留时间 (秒)
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class TooManyJobsError(Exception):
+    """用户任务数或全局排队数超过上限"""
+
+
+class Job:
+    """单个后台任务，执行函数通过 items / progress 上报中间结果，通过 is_cancelled() 响应取消"""
+
+    def __init__(self, user, kind):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.kind = kind
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.items = []       # 已产出的部分结果 (追加写)
+        self.progress = {}    # 任意进度信息，如 {"days_count": 20}
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def to_dict(self, offset=0):
+        """
+        任务状态
+        :param offset: 只返回第 offset 条之后的部分结果，用于轮询时增量获取
+        """
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "progress": dict(self.progress),
+            "count": len(self.items),
+            "items": self.items[offset:],
+        }
+
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+
+
+def _cleanup():
+    """移除超过保留时间的已结束任务 (调用方持有 _lock)"""
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.status not in ACTIVE_STATUSES and now - job.finished_at > JOB_RESULT_TTL
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _finish(job, status, result=None, error=None):
+    with _lock:
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+
+
+def _run(job, fn, args, kwargs):
+    with _lock:
+        if job.status != QUEUED:
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+
+    logger.info(f"任务 {job.id} ({job.kind}, 用户 {job.user}) 开始执行，排队 {job.started_at - job.created_at:.2f}s")
+    try:
+        result = fn(job, *args, **kwargs)
+    except Exception as e:
+        logger.error(f"任务 {job.id} 执行失败: {e}", exc_info=True)
+        _finish(job, FAILED, error=str(e))
+        return
+
+    if job.is_cancelled():
+        _finish(job, CANCELLED)
+    else:
+        _finish(job, SUCCEEDED, result=result)
+    logger.info(f"任务 {job.id} 结束: {job.status}，执行 {job.finished_at - job.started_at:.2f}s")
+
+
+def submit(user, kind, fn, *args, **kwargs):
+    """
+    提交后台任务
+    :param fn: 执行函数，调用方式为 fn(job, *args, **kwargs)，返回值作为任务结果
+    :return: Job
+    :raises TooManyJobsError: 该用户进行中的任务数达到 JOB_MAX_PER_USER，或全局排队数达到 JOB_MAX_QUEUED
+    """
+    job = Job(user, kind)
+    with _lock:
+        _cleanup()
+        active = [j for j in _jobs.values() if j.status in ACTIVE_STATUSES]
+        if sum(1 for j in active if j.user == user) >= JOB_MAX_PER_USER:
+            raise TooManyJobsError(f"进行中的任务过多 (每个用户最多 {JOB_MAX_PER_USER} 个)，请稍后再试")
+        if sum(1 for j in active if j.status == QUEUED) >= JOB_MAX_QUEUED:
+            raise TooManyJobsError("系统繁忙，请稍后再试")
+        _jobs[job.id] = job
+        job.future = _executor.submit(_run, job, fn, args, kwargs)
+    return job
+
+
+def get_job(job_id, user=None):
+    """获取任务，指定 user 时只返回该用户的任务"""
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is None or (user is not None and job.user != user):
+        return None
+    return job
+
+
+def cancel(job_id, user=None):
+    """
+    取消任务：排队中的任务直接取消，执行中的任务由执行函数在下一个检查点停止
+    :return: 取消后的 Job，任务不存在时返回 None
+    """
+    job = get_job(job_id, user)
+    if job is None:
+        return None
+
+    job._cancel_event.set()
+    with _lock:
+        if job.status == QUEUED:
+            job.future.cancel()
+            job.status = CANCELLED
+            job.finished_at = time.time()
+    return job
+
+
+def get_stats():
+    """获取队列统计信息"""
+    with _lock:
+        counts = {}
+        for job in _jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": JOB_WORKERS, "max_per_user": JOB_MAX_PER_USER, "jobs": counts}
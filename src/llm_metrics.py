@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+
+# AI 调用指标：按 "端点:模型" 统计调用次数、失败率、首 token 耗时 (TTFT)、总耗时和 token 用量
+# 耗时只保留最近 LATENCY_WINDOW 次，用于计算分位数 (也用于对冲请求的触发延迟)
+LATENCY_WINDOW = 500
+
+_lock = threading.Lock()
+_models = {}
+
+
+def _entry(key):
+    """获取或创建指标条目 (调用方持有 _lock)"""
+    entry = _models.get(key)
+    if entry is None:
+        entry = {
+            "calls": 0,
+            "failures": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "hedges": 0,        # 触发对冲的次数 (仅主端点)
+            "hedge_wins": 0,    # 对冲请求先于主请求返回的次数 (仅主端点)
+            "latency": deque(maxlen=LATENCY_WINDOW),
+            "ttft": deque(maxlen=LATENCY_WINDOW),
+        }
+        _models[key] = entry
+    return entry
+
+
+def record_call(key, latency, ttft=None, prompt_tokens=None, completion_tokens=None):
+    """
+    记录一次成功的调用
+    :param latency: 总耗时 (秒)
+    :param ttft: 首 token 耗时 (秒)，非流式调用为 None
+    """
+    with _lock:
+        entry = _entry(key)
+        entry["calls"] += 1
+        entry["latency"].append(latency)
+        if ttft is not None:
+            entry["ttft"].append(ttft)
+        entry["prompt_tokens"] += prompt_tokens or 0
+        entry["completion_tokens"] += completion_tokens or 0
+
+
+def record_failure(key):
+    """记录一次失败的调用"""
+    with _lock:
+        entry = _entry(key)
+        entry["calls"] += 1
+        entry["failures"] += 1
+
+
+def record_hedge(key, won):
+    """
+    记录一次对冲
+    :param key: 主端点的指标键
+    :param won: 对冲请求是否先返回
+    """
+    with _lock:
+        entry = _entry(key)
+        entry["hedges"] += 1
+        if won:
+            entry["hedge_wins"] += 1
+
+
+def _percentile(values, pct):
+    """最近邻法计算分位数，values 为已排序列表"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))
+    return values[index]
+
+
+def get_percentile(key, pct, metric='latency', min_samples=20):
+    """
+    获取最近调用的耗时分位数 (秒)
+    :param metric: 'latency' 或 'ttft'
+    :return: 样本数不足 min_samples 时返回 None
+    """
+    with _lock:
+        entry = _models.get(key)
+        values = sorted(entry[metric]) if entry else []
+    if len(values) < min_samples:
+        return None
+    return _percentile(values, pct)
+
+
+def _summary(values):
+    values = sorted(values)
+    return {
+        f"p{pct}_ms": round(_percentile(values, pct) * 1000) if values else None
+        for pct in (50, 90, 99)
+    }
+
+
+def get_stats():
+    """获取所有端点/模型的指标"""
+    with _lock:
+        snapshot = {key: {**entry, "latency": list(entry["latency"]), "ttft": list(entry["ttft"])} for key, entry in _models.items()}
+
+    stats = {}
+    for key, entry in snapshot.items():
+        stats[key] = {
+            "calls": entry["calls"],
+            "failures": entry["failures"],
+            "failure_rate": round(entry["failures"] / entry["calls"], 4) if entry["calls"] else 0.0,
+            "prompt_tokens": entry["prompt_tokens"],
+            "completion_tokens": entry["completion_tokens"],
+            "hedges": entry["hedges"],
+            "hedge_wins": entry["hedge_wins"],
+            "latency": _summary(entry["latency"]),
+            "ttft": _summary(entry["ttft"]),
+        }
+    return stats
@@ -0,0 +1,174 @@
+import threading
+from collections import OrderedDict
+from config_loader import config
+from accounts import DEFAULT_ACCOUNT
+import db_manager
+
+# 缓存配置 (config.yaml 的 cache 段，均可省略)
+_cache_config = config.get('cache') or {}
+PLAN_CACHE_MAX_ENTRIES = int(_cache_config.get('plan_max_entries', 1024))  # LRU 最大条目数
+PLAN_CACHE_MAX_RANGE_MONTHS = int(_cache_config.get('plan_max_range_months', 3))  # 超过该月数的范围查询直接查库
+
+# LRU 缓存: key 为 ('day', account, 'YYYY-MM-DD') 或 ('month', account, 'YYYY-MM')
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+# 每个账号的失效代数：读库前记录，写回缓存时若代数已变化说明期间发生过写入，放弃写回，避免缓存旧数据
+_generations = {}
+
+
+def _get(key):
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return _cache[key]
+        _stats["misses"] += 1
+        return None
+
+
+def _put(key, account, generation, value):
+    with _lock:
+        if _generations.get(account, 0) != generation:
+            return
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > PLAN_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def _generation(account):
+    with _lock:
+        return _generations.get(account, 0)
+
+
+def _copy(plans):
+    """返回副本，防止调用方修改缓存中的数据"""
+    return [dict(plan) for plan in plans]
+
+
+def _month_bounds(month):
+    """'YYYY-MM' -> ('YYYY-MM-01', 'YYYY-MM-31')，日期按字符串比较，31 号对所有月份都适用"""
+    return f"{month}-01", f"{month}-31"
+
+
+def _months_between(start_date, end_date):
+    """返回 [start_date, end_date] 覆盖的所有月份 'YYYY-MM'"""
+    year, month = int(start_date[:4]), int(start_date[5:7])
+    end_year, end_month = int(end_date[:4]), int(end_date[5:7])
+    months = []
+    while (year, month) <= (end_year, end_month):
+        months.append(f"{year:04d}-{month:02d}")
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return months
+
+
+def invalidate(account, dates=None):
+    """
+    使缓存失效 (由 db_manager 在写事务提交后调用)
+    :param dates: 受影响的日期集合，None 表示该账号的全部缓存
+    """
+    with _lock:
+        _generations[account] = _generations.get(account, 0) + 1
+        _stats["invalidations"] += 1
+
+        if dates is None:
+            for key in [key for key in _cache if key[1] == account]:
+                del _cache[key]
+            return
+
+        for date in dates:
+            _cache.pop(('day', account, date), None)
+            _cache.pop(('month', account, date[:7]), None)
+
+
+def get_plans_by_date(date, account=DEFAULT_ACCOUNT):
+    """获取账号在指定日期的计划 (优先读缓存)"""
+    key = ('day', account, date)
+    plans = _get(key)
+    if plans is None:
+        generation = _generation(account)
+        plans = db_manager.get_plans_by_date(date, account=account)
+        _put(key, account, generation, plans)
+    return _copy(plans)
+
+
+def _get_month_entry(month, account):
+    """
+    获取按月缓存条目 (变更版本号, 计划列表)
+    版本号在读库之前读取，数据至少包含该版本及之前的所有写入
+    """
+    key = ('month', account, month)
+    entry = _get(key)
+    if entry is None:
+        generation = _generation(account)
+        version = db_manager.get_change_version(account)
+        start_date, end_date = _month_bounds(month)
+        entry = (version, list(db_manager.iter_plans(start_date, end_date, account=account)))
+        _put(key, account, generation, entry)
+    return entry
+
+
+def get_plans_for_month(month, account=DEFAULT_ACCOUNT):
+    """获取账号在某月 ('YYYY-MM') 的全部计划 (优先读缓存)，按 (date, id) 排序"""
+    return _copy(_get_month_entry(month, account)[1])
+
+
+def get_plans_page(start_date, end_date, after=None, limit=100, account=DEFAULT_ACCOUNT):
+    """
+    与 db_manager.get_plans_page 相同的分页接口，额外返回数据对应的变更版本号 (用于后续增量同步)
+    范围不超过 PLAN_CACHE_MAX_RANGE_MONTHS 个月时由按月缓存拼装，否则直接查库
+    :return: (计划列表, 是否还有下一页, 变更版本号)
+    """
+    months = _months_between(start_date, end_date)
+    if len(months) > PLAN_CACHE_MAX_RANGE_MONTHS:
+        version = db_manager.get_change_version(account)
+        page, has_more = db_manager.get_plans_page(start_date, end_date, after, limit, account=account)
+        return page, has_more, version
+
+    page = []
+    has_more = False
+    # 拼装多个月时取最小的版本号，保证客户端从该版本同步不会漏掉变更
+    version = None
+    for month in months:
+        month_version, plans = _get_month_entry(month, account)
+        version = month_version if version is None else min(version, month_version)
+        for plan in plans:
+            if plan['date'] < start_date or plan['date'] > end_date:
+                continue
+            if after and (plan['date'], plan['id']) <= tuple(after):
+                continue
+            if len(page) == limit:
+                has_more = True
+                break
+            page.append(plan)
+        if has_more:
+            break
+
+    return _copy(page), has_more, version
+
+
+def get_stats():
+    """获取缓存统计信息"""
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entries": len(_cache),
+            "max_entries": PLAN_CACHE_MAX_ENTRIES,
+            "hit_rate": round(_stats["hits"] / total, 4) if total else 0.0,
+        }
+
+
+def clear():
+    """清空缓存"""
+    with _lock:
+        _cache.clear()
+
+
+# 注册写入监听，所有写路径提交后精确失效对应日期/月份
+db_manager.register_write_listener(invalidate)
@@ -0,0 +1,191 @@
+import re
+import math
+import threading
+from collections import Counter
+from config_loader import config
+from accounts import DEFAULT_ACCOUNT
+import db_manager
+from logger import logger
+
+# 计划模板库 (config.yaml 的 templates 段，均可省略)
+# 用户确认入库的计划连同需求描述保存为模板，新需求与某个模板足够相似时直接复用，不再请求 AI
+_templates_config = config.get('templates') or {}
+TEMPLATES_ENABLED = bool(_templates_config.get('enabled', True))
+TEMPLATE_MIN_SIMILARITY = float(_templates_config.get('min_similarity', 0.75))  # 复用模板的最低相似度 (余弦相似度 0~1)
+TEMPLATE_MAX_ENTRIES = int(_templates_config.get('max_entries', 200))  # 每个账号保留的模板数上限
+TEMPLATE_MAX_LENGTH_RATIO = float(_templates_config.get('max_length_ratio', 3))  # 工作日数与模板天数相差超过该倍数时不复用
+
+# 相似度按字符 n-gram 的 TF-IDF 计算，中文不需要分词
+NGRAM_SIZES = (2, 3)
+_NON_WORD_RE = re.compile(r'[\W_]+')
+
+_lock = threading.Lock()
+_indexes = {}  # { 账号: _TemplateIndex }，模板变化时丢弃，下次查询时重建
+_generations = {}  # 每个账号的失效代数，构建索引期间模板有变化时不保存该索引
+_stats = {"lookups": 0, "hits": 0, "saves": 0}
+
+
+def _ngrams(text):
+    """文本归一化 (小写、去掉空白和标点) 后切分为字符 n-gram 计数"""
+    text = _NON_WORD_RE.sub('', text.lower())
+    grams = Counter()
+    for n in NGRAM_SIZES:
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    if not grams and text:
+        grams[text] = 1
+    return grams
+
+
+class _TemplateIndex:
+    """单个账号的 TF-IDF 索引，倒排表只对有共同 n-gram 的模板计算相似度"""
+
+    def __init__(self, templates):
+        self.size = len(templates)
+        term_counts = [(t['id'], _ngrams(t['requirement'])) for t in templates]
+
+        df = Counter()
+        for _, grams in term_counts:
+            df.update(grams.keys())
+        self.idf = {term: self._idf(count) for term, count in df.items()}
+
+        self.vectors = {}
+        self.norms = {}
+        self.postings = {}
+        for template_id, grams in term_counts:
+            vector = {term: tf * self.idf[term] for term, tf in grams.items()}
+            self.vectors[template_id] = vector
+            self.norms[template_id] = math.sqrt(sum(w * w for w in vector.values()))
+            for term in vector:
+                self.postings.setdefault(term, []).append(template_id)
+
+    def _idf(self, df):
+        # 平滑 IDF，未出现过的 n-gram (df=0) 权重最高
+        return math.log((1 + self.size) / (1 + df)) + 1
+
+    def search(self, text):
+        """
+        查找最相似的模板
+        :return: (模板 ID, 相似度)，没有任何共同 n-gram 时返回 None
+        """
+        query = {term: tf * self.idf.get(term, self._idf(0)) for term, tf in _ngrams(text).items()}
+        query_norm = math.sqrt(sum(w * w for w in query.values()))
+        if not query_norm:
+            return None
+
+        dots = Counter()
+        for term, weight in query.items():
+            for template_id in self.postings.get(term, ()):
+                dots[template_id] += weight * self.vectors[template_id][term]
+        if not dots:
+            return None
+
+        template_id, score = max(
+            ((tid, dot / (query_norm * self.norms[tid])) for tid, dot in dots.items() if self.norms[tid]),
+            key=lambda pair: (pair[1], pair[0]),
+        )
+        return template_id, score
+
+
+def _get_index(account):
+    with _lock:
+        index = _indexes.get(account)
+        generation = _generations.get(account, 0)
+    if index is None:
+        index = _TemplateIndex(db_manager.get_plan_templates(account=account))
+        with _lock:
+            if _generations.get(account, 0) == generation:
+                _indexes[account] = index
+    return index
+
+
+def invalidate(account):
+    """丢弃账号的索引"""
+    with _lock:
+        _indexes.pop(account, None)
+        _generations[account] = _generations.get(account, 0) + 1
+
+
+def save_template(requirement, plans, start_date=None, end_date=None, account=DEFAULT_ACCOUNT):
+    """
+    保存用户确认的计划为模板
+    :return: 模板 ID，未启用或数据为空时返回 None
+    """
+    requirement = (requirement or '').strip()
+    if not TEMPLATES_ENABLED or not requirement or not plans:
+        return None
+
+    template_id = db_manager.save_plan_template(requirement, plans, start_date, end_date,
+                                                max_entries=TEMPLATE_MAX_ENTRIES, account=account)
+    invalidate(account)
+    with _lock:
+        _stats["saves"] += 1
+    logger.info(f"计划模板已保存: #{template_id} ({len(plans)} 天)，账号 {account}")
+    return template_id
+
+
+def find_similar(requirement, account=DEFAULT_ACCOUNT):
+    """
+    查找与需求最相似的模板
+    :return: (模板 ID, 相似度)，没有模板时返回 None
+    """
+    index = _get_index(account)
+    if not index.size:
+        return None
+    return index.search(requirement)
+
+
+def remap_plan(plans, workdays):
+    """
+    将模板的计划按比例映射到新的工作日列表：第 i 个工作日取模板中相对位置相同的那一天
+    工作日更多时模板中的某些天会重复，更少时跳过部分天，整体的阶段顺序保持不变
+    """
+    source_count = len(plans)
+    target_count = len(workdays)
+    return [
+        {**plans[min(source_count - 1, i * source_count // target_count)], "date": day}
+        for i, day in enumerate(workdays)
+    ]
+
+
+def match_plan(requirement, workdays, account=DEFAULT_ACCOUNT):
+    """
+    用相似模板直接生成计划
+    :return: (计划列表, 模板 ID, 相似度)，没有足够相似的模板时返回 None
+    """
+    if not TEMPLATES_ENABLED or not workdays:
+        return None
+
+    with _lock:
+        _stats["lookups"] += 1
+    try:
+        found = find_similar(requirement, account)
+    except Exception as e:
+        logger.warning(f"查找计划模板失败: {e}")
+        return None
+    if not found or found[1] < TEMPLATE_MIN_SIMILARITY:
+        return None
+
+    template_id, score = found
+    template = db_manager.get_plan_template(template_id, account=account)
+    if not template or not template['plans']:
+        return None
+    ratio = max(len(workdays), template['days_count']) / max(1, min(len(workdays), template['days_count']))
+    if ratio > TEMPLATE_MAX_LENGTH_RATIO:
+        logger.info(f"相似模板 #{template_id} (相似度 {score:.2f}) 的天数 {template['days_count']} 与工作日数 {len(workdays)} 相差过大，不复用")
+        return None
+
+    with _lock:
+        _stats["hits"] += 1
+    logger.info(f"复用计划模板 #{template_id} (相似度 {score:.2f}，{template['days_count']} 天 -> {len(workdays)} 天)")
+    return remap_plan(template['plans'], workdays), template_id, score
+
+
+def get_stats():
+    """获取模板库统计信息"""
+    with _lock:
+        return {
+            **_stats,
+            "enabled": TEMPLATES_ENABLED,
+            "min_similarity": TEMPLATE_MIN_SIMILARITY,
+            "hit_rate": round(_stats["hits"] / _stats["lookups"], 4) if _stats["lookups"] else 0.0,
+        }
@@ -0,0 +1,150 @@
+import re
+import threading
+from fnmatch import fnmatch
+from config_loader import config
+from logger import logger
+
+# 请求拦截 (config.yaml 的 browser.block 段，均可省略)
+# 填写只用到表单 iframe，页面上的图片、字体、媒体和第三方统计脚本都不需要加载：
+# 只为要拦截的地址注册路由 (按扩展名和 URL 关键字构造的正则，由浏览器端匹配)，其余请求不经过 Python；
+# 命中的请求再按实际资源类型和 allow_patterns 判断，allow_patterns 中的地址始终放行
+# 注意: Playwright 在上下文注册了任何路由后都会关闭 HTTP 缓存，常驻浏览器重新加载页面时脚本和样式需重新下载
+_block_config = (config.get('browser') or {}).get('block') or {}
+BLOCK_ENABLED = bool(_block_config.get('enabled', True))
+BLOCK_RESOURCE_TYPES = set(_block_config.get('resource_types') or ('image', 'media', 'font'))  # 支持 image / media / font
+BLOCK_URL_PATTERNS = list(_block_config.get('url_patterns') or (  # URL 关键字 (包含即拦截)，不论资源类型
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "hm.baidu.com",
+    "cnzz.com",
+    "growingio.com",
+    "sentry.io",
+    "hotjar.com",
+))
+ALLOW_PATTERNS = list(_block_config.get('allow_patterns') or [])  # 表单依赖的地址 (fnmatch 通配符，优先于上面两项)
+
+# 资源类型在请求发出前无法由浏览器端匹配，按 URL 扩展名近似
+_TYPE_EXTENSIONS = {
+    "image": ("png", "jpg", "jpeg", "gif", "webp", "svg", "ico", "bmp", "avif"),
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "media": ("mp4", "webm", "mp3", "ogg", "wav", "m4a", "mov"),
+}
+
+# 被拦截的请求没有实际下载，无法得知真实大小：按资源类型的典型大小 (KB) 估算，可在 browser.block.estimated_kb 中覆盖
+ESTIMATED_KB = {"image": 30, "media": 500, "font": 60, "script": 40, "stylesheet": 20,
+                **(_block_config.get('estimated_kb') or {})}
+ESTIMATED_KB_DEFAULT = 10
+
+_lock = threading.Lock()
+_totals = {"requests": 0, "bytes": 0}
+
+
+def _build_route_patterns():
+    """按配置构造要注册路由的正则 (只使用浏览器端也能解析的语法)"""
+    unsupported = BLOCK_RESOURCE_TYPES - set(_TYPE_EXTENSIONS)
+    if unsupported:
+        logger.warning(f"browser.block.resource_types 中的 {sorted(unsupported)} 无法按扩展名匹配，已忽略")
+    patterns = []
+    extensions = sorted({ext for t in BLOCK_RESOURCE_TYPES for ext in _TYPE_EXTENSIONS.get(t, ())})
+    if extensions:
+        patterns.append(re.compile(r"\.(?:%s)(?:[?#]|$)" % "|".join(extensions), re.IGNORECASE))
+    if BLOCK_URL_PATTERNS:
+        patterns.append(re.compile("|".join(re.escape(keyword) for keyword in BLOCK_URL_PATTERNS)))
+    return patterns
+
+
+ROUTE_PATTERNS = _build_route_patterns()
+
+
+class BlockStats:
+    """一个浏览器上下文的拦截计数 (请求数为实际值，流量为估算值)，take() 取出本次运行的计数并清零"""
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.by_type = {}
+
+    def add(self, resource_type):
+        size = ESTIMATED_KB.get(resource_type, ESTIMATED_KB_DEFAULT) * 1024
+        self.requests += 1
+        self.bytes += size
+        self.by_type[resource_type] = self.by_type.get(resource_type, 0) + 1
+        with _lock:
+            _totals["requests"] += 1
+            _totals["bytes"] += size
+
+    def take(self):
+        result = {"requests": self.requests, "estimated_kb": round(self.bytes / 1024), "by_type": self.by_type}
+        self.requests, self.bytes, self.by_type = 0, 0, {}
+        return result
+
+
+def should_block(request):
+    """命中路由的请求按 allow_patterns、实际资源类型和 URL 关键字判断是否中止 (如 XHR 请求的 .svg 不拦截)"""
+    url = request.url
+    if url.startswith('data:') or any(fnmatch(url, pattern) for pattern in ALLOW_PATTERNS):
+        return False
+    if request.resource_type in BLOCK_RESOURCE_TYPES:
+        return True
+    return any(keyword in url for keyword in BLOCK_URL_PATTERNS)
+
+
+def apply(context):
+    """
+    在同步 API 的浏览器上下文上注册拦截路由
+    :return: BlockStats，未启用时返回 None
+    """
+    if not BLOCK_ENABLED or not ROUTE_PATTERNS:
+        return None
+    stats = BlockStats()
+
+    def handle(route):
+        if should_block(route.request):
+            stats.add(route.request.resource_type)
+            route.abort()
+        else:
+            route.continue_()
+
+    for pattern in ROUTE_PATTERNS:
+        context.route(pattern, handle)
+    return stats
+
+
+async def apply_async(context):
+    """apply 的异步版本 (playwright.async_api 的上下文)"""
+    if not BLOCK_ENABLED or not ROUTE_PATTERNS:
+        return None
+    stats = BlockStats()
+
+    async def handle(route):
+        if should_block(route.request):
+            stats.add(route.request.resource_type)
+            await route.abort()
+        else:
+            await route.continue_()
+
+    for pattern in ROUTE_PATTERNS:
+        await context.route(pattern, handle)
+    return stats
+
+
+def log_run(stats, label=''):
+    """记录并返回本次运行的拦截统计"""
+    if stats is None:
+        return None
+    result = stats.take()
+    if result["requests"]:
+        logger.info(f"{label}本次拦截 {result['requests']} 个请求，估算节省 {result['estimated_kb']} KB ({result['by_type']})")
+    return result
+
+
+def get_stats():
+    """获取拦截统计 (启动以来的累计值，estimated_kb 按 ESTIMATED_KB 估算，并非实测)"""
+    with _lock:
+        return {
+            "enabled": BLOCK_ENABLED,
+            "requests": _totals["requests"],
+            "estimated_kb": round(_totals["bytes"] / 1024),
+            "bytes_measured": False,
+        }
@@ -1,10 +1,15 @@
 import time
 import schedule
 import threading
-from datetime import datetime
+from datetime import datetime, timedelta
 from config_loader import config
 from handler import run as run_handler, keep_alive
+import browser_pool
+import async_filler
+import http_replay
 from workday_utils import get_holiday_info
+from accounts import list_accounts, get_team
+from db_manager import get_plans_for_all_accounts
 from logger import logger
 
 # --- 全局变量与锁 ---
@@ -15,20 +20,79 @@ _current_schedule_time_lock = threading.Lock()
 # 存储当前任务时间的全局变量
 _current_schedule_time = None
 
+# 填报前提前多少分钟启动各账号的常驻浏览器 (config.yaml 的 browser.prewarm_minutes)，0 表示不预热
+PREWARM_MINUTES = int((config.get('browser') or {}).get('prewarm_minutes', 5))
+
+def _workday_accounts(today_str, log=True):
+    """今天需要填报的账号 (按账号所属团队叠加公司日历判断是否为工作日)"""
+    accounts = []
+    for account in list_accounts():
+        holiday_info = get_holiday_info(today_str, team=get_team(account))
+        if holiday_info:
+            if log:
+                logger.info(f"账号 {account}: 今天是 {holiday_info}，跳过定时任务。")
+        else:
+            accounts.append(account)
+    return accounts
+
+def prewarm():
+    """提前启动今天需要填报的账号的浏览器并打开目标页面"""
+    if async_filler.FILL_ENGINE == 'async':
+        # 并发填写时使用临时启动的浏览器，常驻浏览器只用于失败后的重试
+        return
+    accounts = _workday_accounts(datetime.now().strftime("%Y-%m-%d"), log=False)
+    if accounts:
+        logger.info(f"预热浏览器: {', '.join(accounts)}")
+        browser_pool.warm_up(accounts)
+
+def _schedule_jobs(time_str):
+    """添加日报填写任务 (以及提前预热浏览器的任务)，返回填写任务的 job 实例"""
+    if PREWARM_MINUTES > 0:
+        prewarm_time = (datetime.strptime(time_str, "%H:%M") - timedelta(minutes=PREWARM_MINUTES)).strftime("%H:%M")
+        schedule.every().day.at(prewarm_time).do(prewarm)
+    return schedule.every().day.at(time_str).do(job)
+
 def job():
-    # 检查今天是否为工作日
     today_str = datetime.now().strftime("%Y-%m-%d")
-    holiday_info = get_holiday_info(today_str)
-    
-    if holiday_info:
-        logger.info(f"今天是 {holiday_info}，跳过定时任务。")
+    accounts = _workday_accounts(today_str)
+    if not accounts:
         return
 
-    logger.info("开始执行定时任务...")
+    # 一次查询取出所有账号今天的计划，再逐个账号填写
+    try:
+        plans = get_plans_for_all_accounts(today_str)
+    except Exception as e:
+        logger.error(f"查询今日计划失败: {e}", exc_info=True)
+        return
+
+    logger.info(f"开始执行定时任务... 共 {len(accounts)} 个账号，其中 {len(plans)} 个已有今日计划")
+    if async_filler.FILL_ENGINE != 'async':
+        for account in accounts:
+            _run_account(account, plans.get(account))
+        return
+
+    # 没有计划的账号只需发送提醒，已录制提交请求的账号直接 HTTP 提交 (被拒绝时由 handler 改用常驻浏览器)；
+    # 其余账号并发填写，提交前失败的再逐个改用常驻浏览器重试
+    browser_plans = {}
+    for account in accounts:
+        if account not in plans or http_replay.should_replay(account):
+            _run_account(account, plans.get(account))
+        else:
+            browser_plans[account] = plans[account]
+    try:
+        results = async_filler.fill_accounts(browser_plans)
+    except Exception as e:
+        logger.error(f"并发填写失败，改为逐个账号填写: {e}", exc_info=True)
+        results = [{"account": a, "fallback": True} for a in browser_plans]
+    for r in results:
+        if r["fallback"]:
+            _run_account(r["account"], plans[r["account"]])
+
+def _run_account(account, plan):
     try:
-        run_handler()
+        run_handler(account=account, plan=plan)
     except Exception as e:
-        logger.error(f"定时任务执行失败: {e}", exc_info=True)
+        logger.error(f"账号 {account} 定时任务执行失败: {e}", exc_info=True)
 
 def get_current_schedule_time():
     """获取当前定时任务的执行时间"""
@@ -53,7 +117,7 @@ def update_schedule_time(new_time_str):
             # schedule.every(1).hours.do(keep_alive)
             
             # 添加新任务并获取 job 实例
-            job_instance = schedule.every().day.at(new_time_str).do(job)
+            job_instance = _schedule_jobs(new_time_str)
             
             # 更新全局时间变量
             with _current_schedule_time_lock:
@@ -78,8 +142,8 @@ def start_scheduler():
     
     # 初始化定时任务
     with schedule_lock:
-        # 1. 日报填写任务
-        job_instance = schedule.every().day.at(time_str).do(job)
+        # 1. 日报填写任务 (及浏览器预热任务)
+        job_instance = _schedule_jobs(time_str)
         # 2. Session 保活任务 (每1小时执行一次)
         # schedule.every(1).hours.do(keep_alive)
     
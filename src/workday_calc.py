@@ -0,0 +1,104 @@
+import datetime
+import functools
+from workday_utils import get_year_index, parse_date
+
+# 工作日运算：基于 workday_utils 的按年索引和工作日前缀和
+# 年内查询为 O(1)，跨年查询只与跨越的年数有关，与天数无关
+
+MIN_YEAR = datetime.MINYEAR
+MAX_YEAR = datetime.MAXYEAR
+
+# 接口参数上限：每跨一年都要构建并缓存一个年份索引，过大的跨度会非常慢
+MAX_COUNT_RANGE_DAYS = 3660  # 统计区间的最大跨度 (约 10 年)
+MAX_OFFSET_WORKDAYS = 3650  # 工作日偏移的最大绝对值
+
+
+def _date_range_guard(func):
+    """日期运算超出 datetime 支持的范围 (OverflowError) 时统一抛出 ValueError"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except OverflowError as e:
+            raise ValueError("超出可计算的日期范围") from e
+    return wrapper
+
+
+def _locate(date_str, team=None):
+    """日期字符串 -> (年份索引, 年内偏移)"""
+    date_obj = parse_date(date_str)
+    index = get_year_index(date_obj.year, team)
+    return index, date_obj.toordinal() - index.first_ordinal
+
+
+@_date_range_guard
+def is_workday(date_str, team=None):
+    """判断指定日期是否为工作日"""
+    index, offset = _locate(date_str, team)
+    return index.is_workday(offset)
+
+
+@_date_range_guard
+def count_workdays(start_date_str, end_date_str, team=None):
+    """
+    统计 [start, end] 区间 (含两端) 内的工作日数量
+    :return: 工作日数量，start 晚于 end 时返回 0
+    """
+    start_index, start_offset = _locate(start_date_str, team)
+    end_index, end_offset = _locate(end_date_str, team)
+
+    if (start_index.year, start_offset) > (end_index.year, end_offset):
+        return 0
+
+    if start_index.year == end_index.year:
+        return start_index.workday_prefix[end_offset + 1] - start_index.workday_prefix[start_offset]
+
+    # 跨年：首年剩余 + 中间整年 + 末年已过
+    count = len(start_index.workday_offsets) - start_index.workday_prefix[start_offset]
+    for year in range(start_index.year + 1, end_index.year):
+        count += len(get_year_index(year, team).workday_offsets)
+    count += end_index.workday_prefix[end_offset + 1]
+    return count
+
+
+@_date_range_guard
+def add_workdays(date_str, n, team=None):
+    """
+    计算指定日期之后 (n > 0) 或之前 (n < 0) 的第 |n| 个工作日
+    n == 0 时，若当天是工作日则返回当天，否则返回下一个工作日
+    :return: 'YYYY-MM-DD'
+    """
+    index, offset = _locate(date_str, team)
+
+    if n == 0:
+        if index.is_workday(offset):
+            return index.workday_dates[index.workday_prefix[offset]]
+        n = 1
+
+    if n > 0:
+        # 当天及之前的工作日数即为下一个工作日在年内工作日列表中的下标
+        rank = index.workday_prefix[offset + 1] + n - 1
+        while rank >= len(index.workday_offsets):
+            rank -= len(index.workday_offsets)
+            if index.year >= MAX_YEAR:
+                raise ValueError("超出可计算的日期范围")
+            index = get_year_index(index.year + 1, team)
+    else:
+        rank = index.workday_prefix[offset] + n
+        while rank < 0:
+            if index.year <= MIN_YEAR:
+                raise ValueError("超出可计算的日期范围")
+            index = get_year_index(index.year - 1, team)
+            rank += len(index.workday_offsets)
+
+    return index.workday_dates[rank]
+
+
+def next_workday(date_str, team=None):
+    """指定日期之后的下一个工作日"""
+    return add_workdays(date_str, 1, team)
+
+
+def previous_workday(date_str, team=None):
+    """指定日期之前的上一个工作日"""
+    return add_workdays(date_str, -1, team)
@@ -1,5 +1,11 @@
+import bisect
 import datetime
-from datetime import timedelta
+import threading
+from array import array
+from collections import OrderedDict
+from config_loader import config
+from logger import logger
+import calendar_overlay
 
 # 尝试导入 chinese_calendar 库用于判断法定节假日
 # 如果没有安装，请运行: pip install chinesecalendar
@@ -23,105 +29,207 @@ HOLIDAY_MAP = {
     "Laba Festival": "腊八节",
 }
 
-def get_workdays(start_date_str, end_date_str):
+# --- 按年预计算的工作日索引 ---
+# 每个年份首次被查询时构建一次，之后所有线程共享 (只读)；超过 calendar.year_index_max_entries 个时淘汰最久未使用的年份
+# 区间查询通过二分定位后直接切片，不再逐日调用 chinese_calendar
+# 公司日历覆盖文件 (calendar_overlay) 在构建时合并进索引，文件变化后只重建受影响的年份
+
+class _YearIndex:
+    """单个年份的工作日索引"""
+    __slots__ = ('year', 'first_ordinal', 'days', 'workday_bits', 'workday_prefix',
+                 'workday_offsets', 'workday_dates', 'holiday_offsets', 'holiday_dates', 'holiday_names')
+
+    def __init__(self, year):
+        self.year = year
+        self.first_ordinal = datetime.date(year, 1, 1).toordinal()
+        self.days = datetime.date(year, 12, 31).toordinal() - self.first_ordinal + 1
+        # 工作日位图：第 offset 天是否为工作日
+        self.workday_bits = bytearray((self.days + 7) // 8)
+        # 工作日前缀和：workday_prefix[offset] 为年内前 offset 天 (不含当天) 的工作日数
+        self.workday_prefix = array('H', [0]) * (self.days + 1)
+        # 工作日 / 非工作日的年内偏移 (升序) 及对应的日期字符串、节假日名称
+        self.workday_offsets = []
+        self.workday_dates = []
+        self.holiday_offsets = []
+        self.holiday_dates = []
+        self.holiday_names = []
+
+    def is_workday(self, offset):
+        return bool(self.workday_bits[offset >> 3] & (1 << (offset & 7)))
+
+
+def _day_info(day):
+    """计算单个日期是否为工作日及非工作日的名称 (仅在构建索引时调用)"""
+    if HAS_CHINESE_CALENDAR:
+        if chinese_calendar.is_workday(day):
+            return True, None
+        on_holiday, holiday_name = chinese_calendar.get_holiday_detail(day)
+        if holiday_name:
+            # 尝试映射中文名称
+            name_str = str(holiday_name)
+            return False, HOLIDAY_MAP.get(name_str, name_str)
+        return False, "周末"
+
+    # 降级方案
+    if day.weekday() >= 5:
+        return False, "周末"
+    return True, None
+
+
+def _build_year_index(year, team=None):
+    index = _YearIndex(year)
+    day = datetime.date(year, 1, 1)
+    one_day = datetime.timedelta(days=1)
+    overrides = calendar_overlay.get_overrides(year, team)
+
+    for offset in range(index.days):
+        date_str = day.strftime("%Y-%m-%d")
+        if date_str in overrides:
+            is_workday, name = overrides[date_str]
+        else:
+            try:
+                is_workday, name = _day_info(day)
+            except NotImplementedError:
+                # chinese_calendar 尚未收录该年份的安排，按周末规则处理
+                if offset == 0:
+                    logger.warning(f"chinese_calendar 不支持 {year} 年，按周一至周五为工作日处理")
+                is_workday, name = day.weekday() < 5, (None if day.weekday() < 5 else "周末")
+
+        index.workday_prefix[offset + 1] = index.workday_prefix[offset] + (1 if is_workday else 0)
+        if is_workday:
+            index.workday_bits[offset >> 3] |= 1 << (offset & 7)
+            index.workday_offsets.append(offset)
+            index.workday_dates.append(date_str)
+        else:
+            index.holiday_offsets.append(offset)
+            index.holiday_dates.append(date_str)
+            index.holiday_names.append(name)
+        day += one_day
+
+    return index
+
+
+YEAR_INDEX_MAX_ENTRIES = int((config.get('calendar') or {}).get('year_index_max_entries', 64))  # 每个约 1KB
+
+# key 为 (年份, 团队)，团队为 None 表示全员日历，按最近使用顺序排列
+_year_indexes = OrderedDict()
+_year_indexes_lock = threading.Lock()
+
+
+def _refresh_overlay():
+    """覆盖文件变化时丢弃受影响年份的索引 (所有团队)，下次查询时重建"""
+    changed_years = calendar_overlay.reload_if_changed()
+    if not changed_years:
+        return
+    with _year_indexes_lock:
+        for key in [key for key in _year_indexes if key[0] in changed_years]:
+            del _year_indexes[key]
+
+
+def get_year_index(year, team=None):
+    """
+    获取年份索引 (懒加载，每个年份只构建一次)
+    :param team: 团队名，该团队当年没有单独的覆盖日期时复用全员索引
+    """
+    _refresh_overlay()
+    if not calendar_overlay.has_team_overrides(year, team):
+        team = None
+
+    key = (year, team)
+    with _year_indexes_lock:
+        index = _year_indexes.get(key)
+        if index is not None:
+            _year_indexes.move_to_end(key)
+            return index
+        index = _build_year_index(year, team)
+        _year_indexes[key] = index
+        while len(_year_indexes) > YEAR_INDEX_MAX_ENTRIES:
+            _year_indexes.popitem(last=False)
+    return index
+
+
+def parse_date(date_str):
+    """解析 'YYYY-MM-DD' 格式的日期，格式错误时抛出 ValueError"""
+    return datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+
+
+def _year_slices(start_date, end_date, team=None):
+    """
+    将 [start_date, end_date] 按年份拆分
+    :return: [(年份索引, 年内起始偏移, 年内结束偏移), ...]
+    """
+    slices = []
+    for year in range(start_date.year, end_date.year + 1):
+        index = get_year_index(year, team)
+        lo = start_date.toordinal() - index.first_ordinal if year == start_date.year else 0
+        hi = end_date.toordinal() - index.first_ordinal if year == end_date.year else index.days - 1
+        slices.append((index, lo, hi))
+    return slices
+
+
+def get_workdays(start_date_str, end_date_str, team=None):
     """
     获取指定日期范围内的所有工作日（排除周末和法定节假日，包含调休的工作日）
     :param start_date_str: 开始日期，格式 'YYYY-MM-DD'
     :param end_date_str: 结束日期，格式 'YYYY-MM-DD'
+    :param team: 团队名，用于叠加该团队的公司日历覆盖
     :return: 工作日日期字符串列表
     """
     try:
-        start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d").date()
-        end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d").date()
+        start_date = parse_date(start_date_str)
+        end_date = parse_date(end_date_str)
     except ValueError:
         print("日期格式错误，请使用 YYYY-MM-DD 格式")
         return []
-    
+
     workdays = []
-    current_date = start_date
-    
-    while current_date <= end_date:
-        is_workday = False
-        
-        if HAS_CHINESE_CALENDAR:
-            if chinese_calendar.is_workday(current_date):
-                is_workday = True
-        else:
-            if current_date.weekday() < 5:
-                is_workday = True
-                
-        if is_workday:
-            workdays.append(current_date.strftime("%Y-%m-%d"))
-            
-        current_date += timedelta(days=1)
-        
+    for index, lo, hi in _year_slices(start_date, end_date, team):
+        i = bisect.bisect_left(index.workday_offsets, lo)
+        j = bisect.bisect_right(index.workday_offsets, hi)
+        workdays.extend(index.workday_dates[i:j])
+
     return workdays
 
-def get_holiday_info(date_str):
+def get_holiday_info(date_str, team=None):
     """
     获取指定日期的节假日信息
     :param date_str: 日期字符串 'YYYY-MM-DD'
+    :param team: 团队名，用于叠加该团队的公司日历覆盖
     :return: 节假日名称或原因 (例如 '周末', '元旦', '春节')，如果是工作日返回 None
     """
     try:
-        date_obj = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+        date_obj = parse_date(date_str)
     except ValueError:
         return None
 
-    if HAS_CHINESE_CALENDAR:
-        # 如果是工作日（包含调休上班），直接返回 None
-        if chinese_calendar.is_workday(date_obj):
-            return None
-        
-        # 获取节假日名称
-        on_holiday, holiday_name = chinese_calendar.get_holiday_detail(date_obj)
-        if on_holiday:
-            if holiday_name:
-                # 尝试映射中文名称
-                name_str = str(holiday_name)
-                return HOLIDAY_MAP.get(name_str, name_str)
-            else:
-                return "周末"
-    else:
-        # 降级方案
-        if date_obj.weekday() >= 5:
-            return "周末"
-            
-    return None
-
-def get_holidays_in_range(start_date_str, end_date_str):
+    index = get_year_index(date_obj.year, team)
+    offset = date_obj.toordinal() - index.first_ordinal
+    if index.is_workday(offset):
+        return None
+
+    i = bisect.bisect_left(index.holiday_offsets, offset)
+    return index.holiday_names[i]
+
+def get_holidays_in_range(start_date_str, end_date_str, team=None):
     """
     批量获取指定日期范围内的所有非工作日信息
     :param start_date_str: 开始日期 'YYYY-MM-DD'
     :param end_date_str: 结束日期 'YYYY-MM-DD'
+    :param team: 团队名，用于叠加该团队的公司日历覆盖
     :return: 字典 { 'YYYY-MM-DD': '节假日名称' }
     """
     try:
-        start_date = datetime.datetime.strptime(start_date_str, "%Y-%m-%d").date()
-        end_date = datetime.datetime.strptime(end_date_str, "%Y-%m-%d").date()
+        start_date = parse_date(start_date_str)
+        end_date = parse_date(end_date_str)
     except ValueError:
         return {}
 
     holidays = {}
-    current_date = start_date
-    
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        
-        if HAS_CHINESE_CALENDAR:
-            if not chinese_calendar.is_workday(current_date):
-                on_holiday, holiday_name = chinese_calendar.get_holiday_detail(current_date)
-                if holiday_name:
-                    name_str = str(holiday_name)
-                    holidays[date_str] = HOLIDAY_MAP.get(name_str, name_str)
-                else:
-                    holidays[date_str] = "周末"
-        else:
-            if current_date.weekday() >= 5:
-                holidays[date_str] = "周末"
-                
-        current_date += timedelta(days=1)
-        
+    for index, lo, hi in _year_slices(start_date, end_date, team):
+        i = bisect.bisect_left(index.holiday_offsets, lo)
+        j = bisect.bisect_right(index.holiday_offsets, hi)
+        holidays.update(zip(index.holiday_dates[i:j], index.holiday_names[i:j]))
+
     return holidays
 
 if __name__ == "__main__":